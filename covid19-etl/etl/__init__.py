@@ -1,11 +1,35 @@
+"""
+Registry of the ETL jobs. Job `<JOB_NAME>` is class `<JOB_NAME>` of module
+`etl.<job_name>`. The modules are only imported when a job is loaded, so
+running one job does not import the dependencies of all the other jobs.
+"""
+
+
 from importlib import import_module
 from pathlib import Path
 
-__all__ = []
-for f in Path(__file__).parent.glob("*.py"):
-    if "__" not in f.stem:
-        try:
-            __all__.append(import_module(f".{f.stem}", __package__))
-        except Exception as e:
-            print(f"Unable to import module {f.stem} - skipping it. Details: {e}")
-del import_module, Path
+
+ETL_DIR = Path(__file__).parent
+
+
+def list_jobs():
+    """
+    Returns the names of all the ETL jobs, without importing them.
+    """
+    return sorted(
+        f.stem.upper()
+        for f in ETL_DIR.glob("*.py")
+        if "__" not in f.stem and f.stem != "base"
+    )
+
+
+def get_job_module_path(job_name):
+    return f"etl.{job_name.lower()}"
+
+
+def load_job(job_name):
+    """
+    Imports the module of an ETL job and returns the job's class.
+    """
+    etl_module = import_module(get_job_module_path(job_name))
+    return getattr(etl_module, job_name.upper())
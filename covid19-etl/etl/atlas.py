@@ -47,6 +47,7 @@ class ATLAS(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.nodes = {
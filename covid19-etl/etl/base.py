@@ -1,6 +1,9 @@
-import requests
+from abc import ABC, abstractmethod
 import time
 
+from utils.session_helper import create_session
+from utils.snapshot_helper import Snapshot
+
 
 def retry_wrapper(func):
     def retry_logic(*args, **kwargs):
@@ -29,10 +32,15 @@ def retry_wrapper(func):
 
 
 class BaseETL:
+    # names of the jobs that must complete before this one runs
+    dependencies = []
+
     def __init__(self, base_url, access_token, s3_bucket):
         self.base_url = base_url
         self.access_token = access_token
         self.s3_bucket = s3_bucket
+        # shared by the ETL and its helpers so connections are reused
+        self.session = create_session()
 
     def files_to_submissions(self):
         pass
@@ -42,4 +50,77 @@ class BaseETL:
 
     @retry_wrapper
     def get(self, path, *args, **kwargs):
-        return requests.get(path, *args, **kwargs)
+        return self.session.get(path, *args, **kwargs)
+
+
+class StagedETL(BaseETL, ABC):
+    """
+    ETL split into 3 stages, whose intermediate data is saved to an on-disk
+    snapshot (see `utils.snapshot_helper`):
+    - `fetch`: downloads the raw data to `self.snapshot`
+    - `transform`: converts the raw data in `self.snapshot` to Sheepdog
+    records, and writes them with the `RecordWriter` it receives
+    - `load`: submits the records in `self.snapshot` to Sheepdog
+
+    The stages that completed are not run again if the job is retried, as
+    long as the snapshot is not stale: a failed load does not download and
+    parse the data again. The snapshot of a successful run is kept until
+    the next run, so the transform stage can be benchmarked offline against
+    the last fetched data.
+
+    Subclasses must implement `fetch` and `transform`, and must set
+    `self.metadata_helper` to use the default `load`.
+    """
+
+    def __init__(self, base_url, access_token, s3_bucket):
+        super().__init__(base_url, access_token, s3_bucket)
+        self.snapshot = Snapshot(type(self).__name__)
+
+    @abstractmethod
+    def fetch(self):
+        pass
+
+    @abstractmethod
+    def transform(self, writer):
+        pass
+
+    def load(self):
+        """
+        Submits the records of each node type, in the order the node types
+        were first written by the transform stage.
+        """
+        node_types = self.snapshot.get_stage_info("transform")["node_types"]
+        self.metadata_helper.start_streaming(node_types)
+        for node_type in node_types:
+            print(f"Submitting {node_type} data")
+            for record in self.snapshot.read_records(node_type):
+                self.metadata_helper.add_record_to_submit(record)
+        self.metadata_helper.batch_submit_records()
+
+    def run_transform(self):
+        with self.snapshot.record_writer() as writer:
+            self.transform(writer)
+        self.snapshot.mark_done("transform", node_types=writer.node_types)
+        for node_type in writer.node_types:
+            print(f"  {writer.counts[node_type]} {node_type} records")
+
+    def files_to_submissions(self):
+        if self.snapshot.is_done("load") or self.snapshot.is_stale():
+            self.snapshot.reset()
+
+        if self.snapshot.is_done("fetch"):
+            print(f"Using the data already fetched to {self.snapshot.path}")
+        else:
+            print("Fetching the data")
+            self.fetch()
+            self.snapshot.mark_done("fetch")
+
+        if self.snapshot.is_done("transform"):
+            print(f"Using the records already transformed in {self.snapshot.path}")
+        else:
+            print("Transforming the data")
+            self.run_transform()
+
+    def submit_metadata(self):
+        self.load()
+        self.snapshot.mark_done("load")
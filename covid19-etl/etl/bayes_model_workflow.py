@@ -1,5 +1,4 @@
 from datetime import datetime
-import requests
 import time
 
 from etl import base
@@ -23,7 +22,9 @@ class BAYES_MODEL_WORKFLOW(base.BaseETL):
             print(
                 "Got a 403, token might have expired. Getting a new token and retrying"
             )
-            new_access_token = get_access_token(self.base_url, self.api_key)
+            new_access_token = get_access_token(
+                self.base_url, self.api_key, session=self.session
+            )
             self.headers = {"Authorization": f"Bearer {new_access_token}"}
             r = self.get(url, headers=self.headers)
 
@@ -39,7 +40,9 @@ class BAYES_MODEL_WORKFLOW(base.BaseETL):
         return resp_data["status"]
 
     def files_to_submissions(self):
-        self.api_key = get_api_key(base_url, headers=self.headers)
+        self.api_key = get_api_key(
+            self.base_url, headers=self.headers, session=self.session
+        )
 
         print("Preparing request body")
         url = f"https://raw.githubusercontent.com/uc-cdis/covid19model/{self.model_version}/cwl/request_body.json"
@@ -50,7 +53,7 @@ class BAYES_MODEL_WORKFLOW(base.BaseETL):
 
         print("Starting workflow run")
         url = f"{self.base_url}/ga4gh/wes/v1/runs"
-        r = requests.post(url, json=request_body, headers=self.headers)
+        r = self.session.post(url, json=request_body, headers=self.headers)
         assert (
             r.status_code == 200
         ), f"Could not start Mariner workflow ({r.status_code}):\n{r.text}"
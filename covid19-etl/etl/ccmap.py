@@ -114,6 +114,8 @@ class CCMAP(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            skip_unchanged_records=True,
+            session=self.session,
         )
 
         # structure is
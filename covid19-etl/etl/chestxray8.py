@@ -20,6 +20,7 @@ class CHESTXRAY8(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.file_helper = FileHelper(
@@ -27,6 +28,7 @@ class CHESTXRAY8(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.cmc_submitter_id = format_submitter_id("cmc_chestxray8", {})
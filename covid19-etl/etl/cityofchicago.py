@@ -31,9 +31,7 @@ def str_to_datetime(string):
 
 class CITYOFCHICAGO(base.BaseETL):
     def __init__(self, base_url, access_token, s3_bucket):
-        self.base_url = base_url
-        self.access_token = access_token
-        self.s3_bucket = s3_bucket
+        super().__init__(base_url, access_token, s3_bucket)
 
         self.program_name = "open"
         self.project_code = "cityofchicago"
@@ -42,6 +40,7 @@ class CITYOFCHICAGO(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=self.access_token,
+            session=self.session,
         )
 
         self.city = "Chicago"
@@ -107,6 +107,8 @@ class COM_MOBILITY(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            skip_unchanged_records=True,
+            session=self.session,
         )
 
         self.expected_file_headers = [
@@ -126,22 +128,21 @@ class COM_MOBILITY(base.BaseETL):
             "residential_percent_change_from_baseline",
         ]
 
-        self.summary_locations = []
-        self.summary_socio_demographics = []
-
     def files_to_submissions(self):
         """
-        Reads CSV files and converts the data to Sheepdog records
+        Reads CSV files and converts the data to Sheepdog records. The
+        records are streamed to Sheepdog as they are generated, so the
+        whole dataset is never held in memory.
         """
         url = "https://www.gstatic.com/covid19/mobility/Global_Mobility_Report.csv"
         self.parse_file(url)
 
     def parse_file(self, url):
         """
-        Converts a CSV file to data we can submit via Sheepdog. Stores the
-        records to submit in `self.location_data` and `self.time_series_data`.
-        Ignores any records that are already in Sheepdog (relies on unique
-        `submitter_id` to check)
+        Converts a CSV file to data we can submit via Sheepdog, and streams
+        the records to `self.metadata_helper`, which submits them as soon as
+        a batch is full. Ignores any records that are already in Sheepdog
+        (relies on the last submission date to check)
 
         Args:
             url (str): URL at which the CSV file is available
@@ -152,6 +153,9 @@ class COM_MOBILITY(base.BaseETL):
 
         print("Getting data from {}".format(url))
 
+        self.metadata_helper.start_streaming(
+            ["summary_location", "summary_socio_demographic"]
+        )
         with closing(self.get(url, stream=True)) as r:
             f = (line.decode("utf-8") for line in r.iter_lines())
             reader = csv.reader(f, delimiter=",", quotechar='"')
@@ -209,11 +213,13 @@ class COM_MOBILITY(base.BaseETL):
                     )
 
                     summary_location = {
+                        "type": "summary_location",
                         "submitter_id": summary_location_submitter_id,
                         "projects": [{"code": self.project_code}],
                     }
 
                     summary_socio_demographic = {
+                        "type": "summary_socio_demographic",
                         "submitter_id": summary_socio_demographic_submitter_id,
                         "summary_locations": [
                             {"submitter_id": summary_location_submitter_id}
@@ -244,31 +250,20 @@ class COM_MOBILITY(base.BaseETL):
                         gen3_field, func = SPECIAL_MAP_FIELDS[field]
                         summary_socio_demographic[gen3_field] = func(row_dict[field])
 
-                    self.summary_locations.append(summary_location)
-                    self.summary_socio_demographics.append(summary_socio_demographic)
+                    self.metadata_helper.add_record_to_submit(summary_location)
+                    self.metadata_helper.add_record_to_submit(summary_socio_demographic)
         if the_lattest_data_datetime:
             self.last_submission_date_time = the_lattest_data_datetime
 
     def submit_metadata(self):
         """
-        Converts the data in `self.time_series_data` to Sheepdog records.
-        `self.location_data already contains Sheepdog records. Batch submits
-        all records in `self.location_data` and `self.time_series_data`
+        Submits the records still buffered by `self.metadata_helper` (the
+        rest were streamed to Sheepdog while parsing) and updates the last
+        submission date.
         """
-        # Commented
-        # Only required for one time submission of summary_location
-        print("Submitting summary_location data")
-        for loc in self.summary_locations:
-            loc_record = {"type": "summary_location"}
-            loc_record.update(loc)
-            self.metadata_helper.add_record_to_submit(loc_record)
-        self.metadata_helper.batch_submit_records()
-
-        print("Submitting summary_socio_demographic data")
-        for sc in self.summary_socio_demographics:
-            sc_record = {"type": "summary_socio_demographic"}
-            sc_record.update(sc)
-            self.metadata_helper.add_record_to_submit(sc_record)
+        print(
+            "Submitting the remaining summary_location and summary_socio_demographic data"
+        )
         self.metadata_helper.batch_submit_records()
         self.metadata_helper.update_last_submission(
             self.last_submission_date_time.strftime("%Y-%m-%d")
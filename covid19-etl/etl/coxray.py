@@ -104,6 +104,7 @@ class COXRAY(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.file_helper = FileHelper(
@@ -111,6 +112,7 @@ class COXRAY(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.nodes = {
@@ -18,6 +18,7 @@ class COXRAY_FILE(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
     def files_to_submissions(self):
@@ -1,9 +1,9 @@
 import csv
 import re
 from contextlib import closing
-from datetime import datetime
 
 from etl import base
+from utils.date_helper import parse_date
 from utils.metadata_helper import MetadataHelper
 
 
@@ -40,6 +40,8 @@ class CTP(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            skip_unchanged_records=True,
+            session=self.session,
         )
 
         self.expected_file_headers = set(
@@ -247,7 +249,7 @@ class CTP(base.BaseETL):
         """
 
         date = row[self.header_to_column["date"]]
-        date = datetime.strptime(date, "%Y%m%d").date()
+        date = parse_date(date, "%Y%m%d").date()
         date = date.strftime("%Y-%m-%d")
 
         country = "US"
@@ -24,6 +24,7 @@ class DS4C(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.subjects = []
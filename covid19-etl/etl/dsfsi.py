@@ -1,10 +1,10 @@
 import copy
 import csv
-import datetime
 import re
 from contextlib import closing
 
 from etl import base
+from utils.date_helper import parse_date_with_formats
 from utils.metadata_helper import MetadataHelper
 
 
@@ -77,6 +77,16 @@ def normalize_symptoms(symptoms):
     return result
 
 
+DATE_FORMATS = (
+    "%Y/%m/%d",
+    "%Y-%m-%d",
+    "%d-%m-%y",
+    "%m/%d/%Y",
+    "%d-%b-%y",
+    "%m.%d.%Y",
+)
+
+
 def normalize_date(date):
     if not date or date in ["NA", "N/A"]:
         return None
@@ -89,12 +99,7 @@ def normalize_date(date):
     if d == "early March":
         d = "2020-03-01"
 
-    parsed_date = None
-    for fmt in ("%Y/%m/%d", "%Y-%m-%d", "%d-%m-%y", "%m/%d/%Y", "%d-%b-%y", "%m.%d.%Y"):
-        try:
-            parsed_date = datetime.datetime.strptime(d, fmt)
-        except ValueError:
-            pass
+    parsed_date = parse_date_with_formats(d, DATE_FORMATS)
 
     if not parsed_date:
         print(f"Couldn't parse date '{date}', returning date=None")
@@ -281,6 +286,7 @@ class DSFSI(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         # structure is
@@ -1,9 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 import datetime
 import os
 import time
 
 from etl import base
+from utils.date_helper import parse_date
 from utils.idph_helper import fields_mapping
 from utils.format_helper import (
     derived_submitter_id,
@@ -13,6 +15,12 @@ from utils.metadata_helper import MetadataHelper
 
 CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
 
+# maximum number of requests made to the IDPH API at the same time
+MAX_CONCURRENT_REQUESTS = 8
+
+COUNTY_TIME_SERIES_URL = "https://idph.illinois.gov/DPHPublicInformation/api/COVIDExport/GetCountyTestResultsTimeSeries?countyName={}"
+DEMOGRAPHICS_URL = "https://idph.illinois.gov/DPHPublicInformation/api/COVIDExport/GetDemographics{}?CountyName={}&beginDate={}&endDate={}"
+
 
 class IDPH(base.BaseETL):
     def __init__(self, base_url, access_token, s3_bucket):
@@ -25,6 +33,8 @@ class IDPH(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            skip_unchanged_records=True,
+            session=self.session,
         )
 
         self.country = "US"
@@ -90,54 +100,93 @@ class IDPH(base.BaseETL):
             else None
         )
 
+        # download the data for all the counties in parallel, then parse it
+        demographics_urls = {
+            county: self.get_demographics_urls(
+                # we need to start the day after `latest_submitted_date` but this is easier
+                start_date=latest_submitted_datetime,
+                end_date=today,
+                county=county,
+            )
+            for county in self.county_dict
+        }
+        urls = [COUNTY_TIME_SERIES_URL.format(county) for county in self.county_dict]
+        for county_urls in demographics_urls.values():
+            urls.extend(county_urls)
+        data = dict(zip(urls, self.fetch_json(urls)))
+
         for county in self.county_dict:
-            self.parse_county_data(latest_submitted_datetime, county)
+            demographics = self.parse_demographics(
+                [data[url] for url in demographics_urls[county]]
+            )
+            self.parse_county_data(
+                latest_submitted_datetime,
+                county,
+                data[COUNTY_TIME_SERIES_URL.format(county)],
+                demographics,
+            )
 
         self.parse_state_data(latest_submitted_datetime)
 
         print("Done in {} secs".format(int(time.time() - start)))
 
-    def parse_county_data(self, latest_submitted_date, county):
+    def fetch_json(self, urls, headers=None):
         """
-        Converts a JSON files to data we can submit via Sheepdog. Stores the
-        records to submit in `self.summary_locations` and `self.summary_clinicals`.
+        Downloads JSON data from the IDPH API, making up to
+        `MAX_CONCURRENT_REQUESTS` requests at the same time.
 
         Args:
-            latest_submitted_date (datetime): date for latest submitted date
-            county (str): county name
+            urls (list): URLs to download
+            headers (dict): headers to send with each request
+
+        Returns:
+            (list): the JSON data for each URL, in the same order as `urls`
         """
-        demographics = self.get_demographics(
-            # we need to start the day after `latest_submitted_date` but this is easier
-            start_date=latest_submitted_date,
-            end_date=datetime.date.today(),
-            county=county,
-        )
 
-        url = f"https://idph.illinois.gov/DPHPublicInformation/api/COVIDExport/GetCountyTestResultsTimeSeries?countyName={county}"
-        print("Getting county data from {}".format(url))
+        def _get_json(url):
+            r = self.get(url, headers=headers)
+            assert r, f"No data at {url}"
+            return r.json()
 
-        with closing(self.get(url, stream=True)) as r:
-            daily_data = r.json()
-            for data in daily_data:
-                date = datetime.datetime.strptime(
-                    data["ReportDate"], "%Y-%m-%dT%H:%M:%S"
-                )
-                date_str = date.strftime("%Y-%m-%d")
-                if latest_submitted_date and date <= latest_submitted_date:
-                    continue  # skip historical data we already have
+        print(
+            f"Getting data from {len(urls)} URLs ({MAX_CONCURRENT_REQUESTS} at a time)"
+        )
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+            data = list(executor.map(_get_json, urls))
+        print(f"  Done in {int(time.time() - start)} secs")
+        return data
+
+    def parse_county_data(
+        self, latest_submitted_date, county, daily_data, demographics
+    ):
+        """
+        Converts a county's JSON data to data we can submit via Sheepdog.
+        Stores the records to submit in `self.summary_locations` and
+        `self.summary_clinicals`.
 
-                summary_location, summary_clinical = self.parse_county_data_for_date(
-                    date_str, county, data
-                )
-                summary_clinical = {
-                    **summary_clinical,
-                    **demographics[date_str],  # add demographics data
-                }
+        Args:
+            latest_submitted_date (datetime): date for latest submitted date
+            county (str): county name
+            daily_data (list): county time series data from the IDPH API
+            demographics (dict): output of `parse_demographics` for the county
+        """
+        for data in daily_data:
+            date = parse_date(data["ReportDate"], "%Y-%m-%dT%H:%M:%S")
+            date_str = date.strftime("%Y-%m-%d")
+            if latest_submitted_date and date <= latest_submitted_date:
+                continue  # skip historical data we already have
+
+            summary_location, summary_clinical = self.parse_county_data_for_date(
+                date_str, county, data
+            )
+            summary_clinical = {
+                **summary_clinical,
+                **demographics[date_str],  # add demographics data
+            }
 
-                self.summary_locations[
-                    summary_location["submitter_id"]
-                ] = summary_location
-                self.summary_clinicals.append(summary_clinical)
+            self.summary_locations[summary_location["submitter_id"]] = summary_location
+            self.summary_clinicals.append(summary_clinical)
 
     def parse_state_data(self, latest_submitted_date):
         """
@@ -161,9 +210,7 @@ class IDPH(base.BaseETL):
         with closing(self.get(url, stream=True)) as r:
             daily_data = r.json()
             for illinois_data in daily_data:
-                date = datetime.datetime.strptime(
-                    illinois_data["testDate"], "%Y-%m-%dT%H:%M:%S"
-                )
+                date = parse_date(illinois_data["testDate"], "%Y-%m-%dT%H:%M:%S")
                 date_str = date.strftime("%Y-%m-%d")
                 if latest_submitted_date and date <= latest_submitted_date:
                     continue  # skip historical data we already have
@@ -224,7 +271,7 @@ class IDPH(base.BaseETL):
 
         return summary_location, summary_clinical
 
-    def get_demographics(self, start_date, end_date, county):
+    def get_demographics_urls(self, start_date, end_date, county):
         """
         Args:
             start_date (datetime): first time to fetch demographics data for
@@ -232,31 +279,53 @@ class IDPH(base.BaseETL):
             county (str): county name
 
         Returns:
-            (dict): demographics values to add to "summary_clinical" records
+            (list): demographics URLs, in the order of `fields_mapping`
         """
         start_date = start_date.strftime("%Y-%m-%d")
         end_date = end_date.strftime("%Y-%m-%d")
+        return [
+            DEMOGRAPHICS_URL.format(_type.capitalize(), county, start_date, end_date)
+            for _type in fields_mapping
+        ]
+
+    def parse_demographics(self, demographics_data):
+        """
+        Args:
+            demographics_data (list): JSON data for each demographics URL
+                returned by `get_demographics_urls`
+
+        Returns:
+            (dict): demographics values to add to "summary_clinical" records
+        """
         demographics = {}
-        for _type, (field, mapping) in fields_mapping.items():
-            type_name = _type.capitalize()
-            url = f"https://idph.illinois.gov/DPHPublicInformation/api/COVIDExport/GetDemographics{type_name}?CountyName={county}&beginDate={start_date}&endDate={end_date}"
-            print("Getting demographics data from {}".format(url))
-            with closing(self.get(url, stream=True)) as r:
-                data = r.json()
-                for item in data:
-                    date = item["ReportDate"].split("T")[0]
-                    dst_field = mapping[item[field].strip()]
-                    if not dst_field:
-                        continue
-                    # don't get "deaths" because it's always 0
-                    for key in ["count", "tested"]:
-                        if key in item:
-                            count_field = f"{dst_field}_{key}"
-                            if date not in demographics:
-                                demographics[date] = {}
-                            demographics[date][count_field] = item[key]
+        for (field, mapping), data in zip(fields_mapping.values(), demographics_data):
+            for item in data:
+                date = item["ReportDate"].split("T")[0]
+                dst_field = mapping[item[field].strip()]
+                if not dst_field:
+                    continue
+                # don't get "deaths" because it's always 0
+                for key in ["count", "tested"]:
+                    if key in item:
+                        count_field = f"{dst_field}_{key}"
+                        if date not in demographics:
+                            demographics[date] = {}
+                        demographics[date][count_field] = item[key]
         return demographics
 
+    def get_demographics(self, start_date, end_date, county):
+        """
+        Args:
+            start_date (datetime): first time to fetch demographics data for
+            end_date (datetime): last time to fetch demographics data for
+            county (str): county name
+
+        Returns:
+            (dict): demographics values to add to "summary_clinical" records
+        """
+        urls = self.get_demographics_urls(start_date, end_date, county)
+        return self.parse_demographics(self.fetch_json(urls))
+
     def submit_metadata(self):
         """
         Submits the data in `self.summary_locations` and `self.summary_clinicals` to Sheepdog.
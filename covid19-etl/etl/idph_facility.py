@@ -25,6 +25,7 @@ class IDPH_FACILITY(IDPH):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.country = "US"
@@ -31,6 +31,7 @@ class IDPH_HOSPITAL(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.country = "US"
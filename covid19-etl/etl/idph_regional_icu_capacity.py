@@ -30,6 +30,7 @@ class IDPH_REGIONAL_ICU_CAPACITY(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.country = "US"
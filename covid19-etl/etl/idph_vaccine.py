@@ -28,6 +28,8 @@ class IDPH_VACCINE(IDPH):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            skip_unchanged_records=True,
+            session=self.session,
         )
         self.country = "US"
         self.state = "IL"
@@ -163,29 +165,21 @@ class IDPH_VACCINE(IDPH):
         }
 
         self.parse_list_of_counties()
-        illinois_summary_clinical_submitter_id = ""
-        for i, county in enumerate(self.counties_inventory):
-            if i % 10 == 0:
-                print(f"{i} / {len(self.counties_inventory)} counties ({county})")
 
-            county_covid_response = self.get(
-                COUNTY_COVID_LINK_FORMAT.format(county),
-                headers={"content-type": "json"},
-            )
-            assert (
-                county_covid_response
-            ), f"No data at {COUNTY_COVID_LINK_FORMAT.format(county)}"
-            county_covid_data = json.loads(county_covid_response.text).get(
-                "CurrentVaccineAdministration"
-            )
+        # download the data for all the counties in parallel, then parse it
+        counties = list(self.counties_inventory)
+        urls = [COUNTY_COVID_LINK_FORMAT.format(county) for county in counties] + [
+            COUNTY_DEMO_LINK_FORMAT.format(county) for county in counties
+        ]
+        data = self.fetch_json(urls, headers={"content-type": "json"})
+        county_covid_data_list = data[: len(counties)]
+        county_demo_data_list = data[len(counties) :]
 
-            county_demo_response = self.get(
-                COUNTY_DEMO_LINK_FORMAT.format(county), headers={"content-type": "json"}
-            )
-            assert (
-                county_demo_response
-            ), f"No data at {COUNTY_DEMO_LINK_FORMAT.format(county)}"
-            county_demo_data = json.loads(county_demo_response.text)
+        illinois_summary_clinical_submitter_id = ""
+        for county, county_covid_data, county_demo_data in zip(
+            counties, county_covid_data_list, county_demo_data_list
+        ):
+            county_covid_data = county_covid_data.get("CurrentVaccineAdministration")
 
             (
                 summary_location_submitter_id,
@@ -32,14 +32,15 @@ from etl import base
 from etl.jhu_to_s3 import MAP_DATA_FOLDER
 from utils.country_codes_utils import get_county_to_fips_dictionary
 from utils.metadata_helper import MetadataHelper
+from utils.s3_helper import S3Publisher, read_object
 
 
 VACCINES_BY_COUNTY_BY_DATE_FILENAME = "vaccines_by_county_by_date.json"
 
-CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
-
 
 class IDPH_VACCINE_TO_S3(base.BaseETL):
+    dependencies = ["IDPH_VACCINE"]
+
     def __init__(self, base_url, access_token, s3_bucket):
         super().__init__(base_url, access_token, s3_bucket)
 
@@ -50,15 +51,17 @@ class IDPH_VACCINE_TO_S3(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
         self.s3_client = boto3.client("s3")
+        self.result = None
 
     def get_existing_data_from_s3(self):
         s3_path = os.path.join(MAP_DATA_FOLDER, VACCINES_BY_COUNTY_BY_DATE_FILENAME)
         bucket = self.s3_bucket.split("s3://")[-1]
         try:
-            res = self.s3_client.get_object(Bucket=bucket, Key=s3_path)
-            return json.loads(res["Body"].read().decode("utf-8"))
+            body = read_object(self.s3_client, bucket, s3_path)
+            return json.loads(body.decode("utf-8"))
         except Exception as e:
             print(
                 f"WARNING: Unable to get existing data from S3. Will get all data from Peregrine instead. Details: {e}"
@@ -219,24 +222,13 @@ class IDPH_VACCINE_TO_S3(base.BaseETL):
 
         new_data = self.get_new_data_from_peregrine(days_since_last_update)
         county_to_fips_dict = get_county_to_fips_dictionary()
-        result = self.format_result(county_to_fips_dict, existing_data, new_data)
-
-        # save to local
-        with open(
-            os.path.join(CURRENT_DIR, VACCINES_BY_COUNTY_BY_DATE_FILENAME), "w"
-        ) as f:
-            f.write(
-                json.dumps(
-                    result,
-                    separators=(",", ":"),
-                )
-            )
+        self.result = self.format_result(county_to_fips_dict, existing_data, new_data)
 
     def submit_metadata(self):
-        abs_path = os.path.join(CURRENT_DIR, VACCINES_BY_COUNTY_BY_DATE_FILENAME)
+        if self.result is None:
+            return
         s3_path = os.path.join(MAP_DATA_FOLDER, VACCINES_BY_COUNTY_BY_DATE_FILENAME)
         print(f"Uploading file to S3 at '{s3_path}'")
-        self.s3_client.upload_file(
-            Filename=abs_path, Bucket=self.s3_bucket, Key=s3_path
-        )
-        os.remove(abs_path)
+        publisher = S3Publisher(self.s3_client, self.s3_bucket, content_encoding="gzip")
+        publisher.publish_json(s3_path, self.result)
+        publisher.wait()
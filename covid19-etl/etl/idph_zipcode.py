@@ -2,6 +2,7 @@ from contextlib import closing
 import datetime
 
 from etl import base
+from utils.date_helper import parse_date
 from utils.idph_helper import fields_mapping
 from utils.format_helper import (
     derived_submitter_id,
@@ -21,6 +22,7 @@ class IDPH_ZIPCODE(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.country = "US"
@@ -57,7 +59,8 @@ class IDPH_ZIPCODE(base.BaseETL):
 
         Args:
             date_str (str): date in "%Y-%m-%d" format
-            existing_summary_locations (list): [<location submitter_id>, ...]
+            existing_summary_locations (SubmitterIdIndex): existing location
+                submitter_ids
         """
         url = f"https://idph.illinois.gov/DPHPublicInformation/api/COVIDExport/GetZip?reportDate={date_str}"
         print("Getting data from {}".format(url))
@@ -77,9 +80,9 @@ class IDPH_ZIPCODE(base.BaseETL):
         """
         From county-level data, generate the data we can submit via Sheepdog
         """
-        date = datetime.datetime.strptime(
-            zipcode_values["reportDate"], "%Y-%m-%dT%H:%M:%S"
-        ).strftime("%Y-%m-%d")
+        date = parse_date(zipcode_values["reportDate"], "%Y-%m-%dT%H:%M:%S").strftime(
+            "%Y-%m-%d"
+        )
         zipcode = zipcode_values["zip"]
 
         summary_location_submitter_id = format_submitter_id(
@@ -1,17 +1,20 @@
 from collections import defaultdict
 from contextlib import closing
 import csv
-from datetime import datetime
 import re
 
 from etl import base
+from utils.date_helper import get_unified_date_format
+from utils.jhu_helper import TimeSeriesParser
+from utils.local_state_helper import LocalState
 from utils.metadata_helper import MetadataHelper
 
 
-# we are only keeping in Sheepdog the latest data (last date in the
-# original data source) to avoid memory issues. when that's fixed,
-# we can go back to storing all the JHU data.
-LAST_DATE_ONLY = True
+# key of the last date for which all the files were processed, in the
+# local state. The latest date in Guppy is only used when there is no local
+# state: it is the latest date of any file, so it can be after the last
+# date of a file that lags behind the others
+LAST_DATE_STATE_KEY = "last_processed_date"
 
 
 def format_location_submitter_id(country, province, county=None):
@@ -27,35 +30,19 @@ def format_location_submitter_id(country, province, county=None):
     return submitter_id.strip("-")
 
 
-def get_unified_date_format(date):
-    month, day, year = date.split("/")
-
-    # format all the dates the same way
-    if len(year) == 2:
-        year = "20{}".format(year)
-    if len(month) == 1:
-        month = "0{}".format(month)
-    if len(day) == 1:
-        day = "0{}".format(day)
-
-    return "-".join((year, month, day))
-
-
 def format_summary_clinical_submitter_id(location_submitter_id, date):
     """summary_clinical_<country>_<province>_<county>_<date>"""
     sub_id = location_submitter_id.replace("summary_location", "summary_clinical")
     return "{}_{}".format(sub_id, date)
 
 
-def time_series_date_to_string(date):
-    return datetime.strptime(date, "%Y-%m-%d").isoformat("T")
-
-
 class JHU(base.BaseETL):
     def __init__(self, base_url, access_token, s3_bucket):
         super().__init__(base_url, access_token, s3_bucket)
         self.location_data = {}
-        self.time_series_data = defaultdict(lambda: defaultdict(dict))
+        # { <location submitter_id>: { <data type>: (<dates>, <values>, <missing>) } }
+        # where <values> and <missing> are the arrays parsed by TimeSeriesParser
+        self.time_series_data = defaultdict(dict)
         self.program_name = "open"
         self.project_code = "JHU"
         self.metadata_helper = MetadataHelper(
@@ -63,6 +50,8 @@ class JHU(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            submit_max_in_flight=4,
+            session=self.session,
         )
         self.expected_csv_headers = {
             "global": ["Province/State", "Country/Region", "Lat", "Long", "1/22/20"],
@@ -133,8 +122,14 @@ class JHU(base.BaseETL):
                 },
             },
         }
-        self.existing_summary_locations = []
-        self.last_date = ""
+        self.existing_summary_locations = set()
+        self.last_date = ""  # only the dates after this date are processed
+        # all the files have data up to this date
+        self.processed_until = None
+        # True if a file could not be read: its dates after `self.last_date`
+        # were not processed
+        self.incomplete = False
+        self.local_state = None
 
     def files_to_submissions(self):
         """
@@ -155,9 +150,14 @@ class JHU(base.BaseETL):
 
         (
             self.existing_summary_locations,
-            self.last_date,
+            guppy_last_date,
         ) = self.metadata_helper.get_existing_data_jhu()
 
+        # only process the dates that were not submitted yet
+        self.local_state = LocalState(self.metadata_helper.project_id)
+        self.last_date = self.local_state.get(LAST_DATE_STATE_KEY) or guppy_last_date
+        print(f"Last submitted date: {self.last_date}")
+
         for file_type in ["global", "US_counties"]:
             for data_type, url in urls[file_type].items():
                 self.parse_file(file_type, data_type, url)
@@ -167,7 +167,8 @@ class JHU(base.BaseETL):
         Converts a CSV file to data we can submit via Sheepdog. Stores the
         records to submit in `self.location_data` and `self.time_series_data`.
         Ignores any records that are already in Sheepdog (relies on unique
-        `submitter_id` to check)
+        `submitter_id` to check) and only parses the date columns after
+        `self.last_date`.
 
         Args:
             file_type (str): type of this file - one
@@ -185,6 +186,7 @@ class JHU(base.BaseETL):
 
             if headers[0] == "404: Not Found":
                 print("  Unable to get file contents, received {}.".format(headers))
+                self.incomplete = True
                 return
 
             expected_h = self.expected_csv_headers[file_type]
@@ -205,12 +207,28 @@ class JHU(base.BaseETL):
                 )
             )
 
-            for row in reader:
-                if not row:  # ignore empty rows
-                    continue
-                location, date_to_value = self.parse_row(
-                    file_type, data_type, headers, row
+            # dates in this file are sorted: keep track of the last date
+            # for which all the files have data
+            file_last_date = get_unified_date_format(last_date)
+            if not self.processed_until or file_last_date < self.processed_until:
+                self.processed_until = file_last_date
+
+            parser = TimeSeriesParser(
+                headers,
+                self.get_header_to_column(file_type, data_type)["dates_start"],
+                after_date=self.last_date,
+            )
+            if not parser.dates:
+                print("  No new dates")
+                return
+            print(
+                "  Parsing {} new dates: {} to {}".format(
+                    len(parser.dates), parser.dates[0], parser.dates[-1]
                 )
+            )
+
+            for row, values, missing in parser.iter_rows(reader):
+                location = self.parse_row(file_type, data_type, row)
                 if not location:
                     # We are using US data by state instead of global
                     continue
@@ -223,39 +241,37 @@ class JHU(base.BaseETL):
                 ):
                     self.location_data[location_submitter_id] = location
 
-                for date, value in date_to_value.items():
-                    # do not re-submit summary_clinical data that
-                    # already exist. Assume anything older than the last
-                    # submitted date has already been submitted
-                    if (
-                        time_series_date_to_string(date)
-                        > time_series_date_to_string(self.last_date)
-                        or LAST_DATE_ONLY
-                    ):
-                        self.time_series_data[location_submitter_id][date][
-                            data_type
-                        ] = value
-
-    def parse_row(self, file_type, data_type, headers, row):
+                # keep the parsed arrays instead of a dict per date: the
+                # records are only generated at submission time
+                self.time_series_data[location_submitter_id][data_type] = (
+                    parser.dates,
+                    values,
+                    missing,
+                )
+
+    def get_header_to_column(self, file_type, data_type):
+        header_to_column = self.header_to_column[file_type]
+        if "country" not in header_to_column:
+            header_to_column = header_to_column[data_type]
+        return header_to_column
+
+    def parse_row(self, file_type, data_type, row):
         """
-        Converts a row of a CSV file to data we can submit via Sheepdog
+        Converts the location columns of a row of a CSV file to data we can
+        submit via Sheepdog. The date columns are parsed by `TimeSeriesParser`.
 
         Args:
             file_type (str): type of this file - one
                 of ["global", "US_counties"]
             data_type (str): type of the data in this file - one
                 of ["confirmed", "deaths", "recovered"]
-            headers (list(str)): CSV file headers (first row of the file)
             row (list(str)): row of data
 
         Returns:
-            (dict, dict) tuple:
-                - location data, in a format ready to be submitted to Sheepdog
-                - { "date1": <value>, "date2": <value> } from the row data
+            (dict): location data, in a format ready to be submitted to
+            Sheepdog, or None if the row should be ignored
         """
-        header_to_column = self.header_to_column[file_type]
-        if "country" not in header_to_column:
-            header_to_column = header_to_column[data_type]
+        header_to_column = self.get_header_to_column(file_type, data_type)
 
         country = row[header_to_column["country"]]
         province = row[header_to_column["province"]]
@@ -264,12 +280,12 @@ class JHU(base.BaseETL):
 
         if country == "US" and province == "":
             # We are using US data by state instead of global
-            return None, None
+            return None
 
         if int(float(latitude)) == 0 and int(float(longitude)) == 0:
             # Data with "Out of <state>" or "Unassigned" county value have
             # unknown coordinates of (0,0). We don't submit them for now
-            return None, None
+            return None
 
         submitter_id = format_location_submitter_id(country, province)
         location = {
@@ -299,61 +315,58 @@ class JHU(base.BaseETL):
                 location["FIPS"] = int(float(fips))
         location["submitter_id"] = submitter_id
 
-        date_to_value = {}
-        dates_start = header_to_column["dates_start"]
-        dates_indices = range(dates_start, len(headers))
-        if LAST_DATE_ONLY:
-            dates_indices = [len(headers) - 1]
-        for i in dates_indices:
-            date = headers[i]
-            date = get_unified_date_format(date)
-
-            if row[i] == "":  # ignore empty values
-                continue
-            try:
-                val = int(float(row[i]))
-            except ValueError:
-                print(
-                    'Unable to convert {} to int for "{}", "{}" at {}'.format(
-                        row[i], province, country, date
-                    )
-                )
-                raise
-            date_to_value[date] = val
-
-        return location, date_to_value
+        return location
 
     def submit_metadata(self):
         """
         Converts the data in `self.time_series_data` to Sheepdog records.
         `self.location_data already contains Sheepdog records. Batch submits
-        all records in `self.location_data` and `self.time_series_data`
+        all records in `self.location_data` and `self.time_series_data`.
+        Only new `summary_clinical` records are submitted, so existing
+        records don't need to be deleted first.
         """
-        if LAST_DATE_ONLY:
-            # delete the old data from the Sheepdog DB
-            print("Deleting old summary_clinical data")
-            self.metadata_helper.delete_nodes(["summary_clinical"])
+        # stream the records to Sheepdog as they are generated, instead of
+        # generating all the records before submitting them
+        self.metadata_helper.start_streaming(["summary_location", "summary_clinical"])
 
         print("Submitting summary_location data")
         for location in self.location_data.values():
             record = {"type": "summary_location"}
             record.update(location)
             self.metadata_helper.add_record_to_submit(record)
-        self.metadata_helper.batch_submit_records()
 
         print("Submitting summary_clinical data")
         for location_submitter_id, time_series in self.time_series_data.items():
-            for date, data in time_series.items():
-                submitter_id = format_summary_clinical_submitter_id(
-                    location_submitter_id, date
-                )
-                record = {
-                    "type": "summary_clinical",
-                    "submitter_id": submitter_id,
-                    "summary_locations": [{"submitter_id": location_submitter_id}],
-                    "date": date,
-                }
-                for data_type, value in data.items():
-                    record[data_type] = value
+            # merge the data types for each date
+            records = {}  # { <date>: <record> }
+            for data_type, (dates, values, missing) in time_series.items():
+                for date, value, is_missing in zip(
+                    dates, values.tolist(), missing.tolist()
+                ):
+                    if is_missing:  # ignore empty values
+                        continue
+                    if date not in records:
+                        records[date] = {
+                            "type": "summary_clinical",
+                            "submitter_id": format_summary_clinical_submitter_id(
+                                location_submitter_id, date
+                            ),
+                            "summary_locations": [
+                                {"submitter_id": location_submitter_id}
+                            ],
+                            "date": date,
+                        }
+                    records[date][data_type] = value
+            for record in records.values():
                 self.metadata_helper.add_record_to_submit(record)
         self.metadata_helper.batch_submit_records()
+
+        # dates after `processed_until` are missing from some files: they
+        # will be processed again by the next run. `processed_until` can be
+        # before the date in Guppy if a file lags behind the others
+        if self.incomplete:
+            print(
+                "WARNING: some files could not be read; the next run will process the same dates again"
+            )
+        elif self.processed_until:
+            self.local_state.set(LAST_DATE_STATE_KEY, self.processed_until)
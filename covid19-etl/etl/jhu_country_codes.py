@@ -16,6 +16,7 @@ class JHU_COUNTRY_CODES(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
     def files_to_submissions(self):
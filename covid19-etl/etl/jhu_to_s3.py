@@ -9,12 +9,12 @@ import boto3
 from contextlib import closing
 import csv
 from datetime import datetime
-import json
 import os
-import pathlib
-import time
 
 from etl import base
+from utils.date_helper import get_unified_date_format
+from utils.jhu_helper import TimeSeriesParser
+from utils.s3_helper import S3Publisher
 
 
 """
@@ -72,22 +72,6 @@ TIME_SERIES_DATA_FOLDER = "time_series"
 IL_JSON_BY_DATE_FILENAME = "jhu_il_json_by_time_latest.json"
 MINIMUM_COUNT = 5
 
-CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
-
-
-def get_unified_date_format(date):
-    month, day, year = date.split("/")
-
-    # format all the dates the same way
-    if len(year) == 2:
-        year = "20{}".format(year)
-    if len(month) == 1:
-        month = "0{}".format(month)
-    if len(day) == 1:
-        day = "0{}".format(day)
-
-    return "-".join((year, month, day))
-
 
 def replace_small_counts_simple(data):
     # remove values smaller than the threshold
@@ -165,16 +149,7 @@ class JHU_TO_S3(base.BaseETL):
             },
         }
 
-        # create data folders
-        data_folders = [
-            os.path.join(CURRENT_DIR, MAP_DATA_FOLDER),
-            os.path.join(CURRENT_DIR, TIME_SERIES_DATA_FOLDER),
-            os.path.join(CURRENT_DIR, TIME_SERIES_DATA_FOLDER, "county"),
-        ]
-        for path in data_folders:
-            pathlib.Path(path).mkdir(exist_ok=True)
-
-        # generate data files
+        # generate data
         for data_type, url_data in urls.items():
             self.parse_file(
                 data_type,
@@ -185,41 +160,8 @@ class JHU_TO_S3(base.BaseETL):
 
         print("Latest date: {}".format(self.latest_date))
 
-        # write map_data files
         for data_type in self.totals:
             self.totals[data_type] = replace_small_counts_simple(self.totals[data_type])
-        with open(
-            os.path.join(CURRENT_DIR, MAP_DATA_FOLDER, IL_JSON_BY_DATE_FILENAME), "w"
-        ) as f:
-            # create smaller file size by eliminating white space
-            f.write(
-                json.dumps(
-                    {
-                        "il_county_list": self.county_by_date,
-                        "last_updated": self.latest_date,
-                        "totals": self.totals,
-                    },
-                    separators=(",", ":"),
-                )
-            )
-
-        # write time_series files
-        for county_fips, data in self.county_by_date.items():
-            with open(
-                os.path.join(
-                    CURRENT_DIR,
-                    TIME_SERIES_DATA_FOLDER,
-                    "county",
-                    f"{county_fips}.json",
-                ),
-                "w",
-            ) as f:
-                f.write(
-                    json.dumps(
-                        data["by_date"],
-                        separators=(",", ":"),
-                    )
-                )
 
     def parse_file(self, data_type, url, expected_h, header_to_column):
         """
@@ -254,12 +196,23 @@ class JHU_TO_S3(base.BaseETL):
             ) > datetime.strptime(file_latest_date, "%Y-%m-%d"):
                 self.latest_date = file_latest_date
 
-            for row in reader:
-                self.parse_row(data_type, headers, row, header_to_column)
+            parser = TimeSeriesParser(headers, header_to_column["dates_start"])
+            for row, values, missing in parser.iter_rows(reader):
+                self.parse_row(
+                    data_type, row, header_to_column, parser, values, missing
+                )
 
-    def parse_row(self, data_type, headers, row, header_to_column):
-        if not row:  # ignore empty rows
-            return
+    def parse_row(self, data_type, row, header_to_column, parser, values, missing):
+        """
+        Args:
+            data_type (str): type of the data in this file - one
+                of ["confirmed", "deaths", "recovered"]
+            row (list(str)): row of data
+            header_to_column (dict): mapping of CSV header to column number
+            parser (TimeSeriesParser): parser for this file
+            values (np.ndarray): the row's values, parsed by `parser`
+            missing (np.ndarray): the row's missing values mask
+        """
         country = row[header_to_column["country"]]
         province = row[header_to_column["province"]]
         if country != "US" or province != "Illinois":
@@ -272,57 +225,53 @@ class JHU_TO_S3(base.BaseETL):
                 "county": county,
                 "by_date": {},
             }
-        dates_start = header_to_column["dates_start"]
-        for i in range(dates_start, len(headers)):
-            date = headers[i]
-            date = get_unified_date_format(date)
-            if date not in self.county_by_date[county_fips]["by_date"]:
-                self.county_by_date[county_fips]["by_date"][date] = {}
-
-            if row[i] == "":  # ignore empty values
+        by_date = self.county_by_date[county_fips]["by_date"]
+        for date, val, is_missing in zip(
+            parser.dates, values.tolist(), missing.tolist()
+        ):
+            if date not in by_date:
+                by_date[date] = {}
+
+            if is_missing:  # ignore empty values
                 continue
-            try:
-                val = int(float(row[i]))
-            except ValueError:
-                print(
-                    'Unable to convert {} to int for "{}", "{}" at {}'.format(
-                        row[i], province, country, date
-                    )
-                )
-                raise
 
             # store confirmed and deaths numbers
             val = replace_small_counts_simple(val)
             if data_type == "confirmed":
-                self.county_by_date[county_fips]["by_date"][date]["C"] = val
+                by_date[date]["C"] = val
             else:  # deaths
-                self.county_by_date[county_fips]["by_date"][date]["D"] = val
+                by_date[date]["D"] = val
 
         # update totals with the values for the latest date
-        latest_val = int(float(row[-1]))
+        latest_val = int(values[-1])
         if data_type == "confirmed":
             self.totals["C"] += latest_val
         else:  # deaths
             self.totals["D"] += latest_val
 
     def submit_metadata(self):
+        """
+        Uploads the map_data and time_series files to S3. Files whose
+        content did not change since the last run are not uploaded again.
+        """
         print("Uploading to S3...")
-        start = time.time()
-
-        for folder in [MAP_DATA_FOLDER, TIME_SERIES_DATA_FOLDER]:
-            for abs_path, _, files in os.walk(os.path.join(CURRENT_DIR, folder)):
-                i = 0
-                for file_name in files:
-                    local_path = os.path.join(abs_path, file_name)
-                    s3_path = os.path.relpath(local_path, CURRENT_DIR)
-                    if folder == TIME_SERIES_DATA_FOLDER:
-                        if i % 50 == 0:
-                            print(f"  Uploading county data: {i} / {len(files)}")
-                        i += 1
-                    else:
-                        print(f"  Uploading {s3_path}")
-                    self.s3_client.upload_file(local_path, self.s3_bucket, s3_path)
-                    os.remove(local_path)
-
-        print("  Done in {} secs".format(int(time.time() - start)))
+        publisher = S3Publisher(self.s3_client, self.s3_bucket, content_encoding="gzip")
+
+        publisher.publish_json(
+            os.path.join(MAP_DATA_FOLDER, IL_JSON_BY_DATE_FILENAME),
+            {
+                "il_county_list": self.county_by_date,
+                "last_updated": self.latest_date,
+                "totals": self.totals,
+            },
+        )
+
+        print(f"  Uploading data for {len(self.county_by_date)} counties")
+        for county_fips, data in self.county_by_date.items():
+            publisher.publish_json(
+                os.path.join(TIME_SERIES_DATA_FOLDER, "county", f"{county_fips}.json"),
+                data["by_date"],
+            )
+
+        publisher.wait()
         print("Done!")
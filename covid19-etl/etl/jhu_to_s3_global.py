@@ -13,12 +13,12 @@ from copy import deepcopy
 from collections import defaultdict
 import csv
 from datetime import datetime
-import json
 import os
-import pathlib
-import time
 
 from etl import base
+from utils.date_helper import get_unified_date_format
+from utils.jhu_helper import TimeSeriesParser
+from utils.s3_helper import S3Publisher
 from utils.country_codes_utils import get_codes_dictionary, get_codes_for_country_name
 
 
@@ -208,22 +208,6 @@ IL_JSON_BY_TIME_FILENAME = "jhu_il_json_by_time_latest.json"
 TIME_SERIES_DATA_FOLDER = "time_series"
 MINIMUM_COUNT = 5
 
-CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
-
-
-def get_unified_date_format(date):
-    month, day, year = date.split("/")
-
-    # format all the dates the same way
-    if len(year) == 2:
-        year = "20{}".format(year)
-    if len(month) == 1:
-        month = "0{}".format(month)
-    if len(day) == 1:
-        day = "0{}".format(day)
-
-    return "-".join((year, month, day))
-
 
 def replace_small_counts_simple(data):
     # remove values smaller than the threshold
@@ -327,6 +311,7 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
         }
         self.latest_date = None
         self.s3_client = boto3.client("s3")
+        self.map_data = {}  # { <file name>: <JSON data> }
 
     def files_to_submissions(self):
         """
@@ -349,17 +334,6 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
             for data_type, url in urls[file_type].items():
                 self.parse_file_to_nested_dict(file_type, data_type, url)
 
-        # create data folders
-        data_folders = [
-            os.path.join(CURRENT_DIR, MAP_DATA_FOLDER),
-            os.path.join(CURRENT_DIR, TIME_SERIES_DATA_FOLDER),
-            os.path.join(CURRENT_DIR, TIME_SERIES_DATA_FOLDER, "country"),
-            os.path.join(CURRENT_DIR, TIME_SERIES_DATA_FOLDER, "state"),
-            os.path.join(CURRENT_DIR, TIME_SERIES_DATA_FOLDER, "county"),
-        ]
-        for path in data_folders:
-            pathlib.Path(path).mkdir(exist_ok=True)
-
         # generate data files
         self.nested_dict_to_geojson()
         self.nested_dict_to_data_by_level()
@@ -406,10 +380,20 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
             ) > datetime.strptime(file_latest_date, "%Y-%m-%d"):
                 self.latest_date = file_latest_date
 
-            for row in reader:
-                self.parse_row(file_type, data_type, headers, row)
+            parser = TimeSeriesParser(
+                headers,
+                self.get_header_to_column(file_type, data_type)["dates_start"],
+            )
+            for row, values, missing in parser.iter_rows(reader):
+                self.parse_row(file_type, data_type, row, parser, values, missing)
+
+    def get_header_to_column(self, file_type, data_type):
+        header_to_column = self.header_to_column[file_type]
+        if "country" not in header_to_column:
+            header_to_column = header_to_column[data_type]
+        return header_to_column
 
-    def parse_row(self, file_type, data_type, headers, row):
+    def parse_row(self, file_type, data_type, row, parser, values, missing):
         """
         Converts a row of a CSV file to self.nested_dict in the format
         described on top of this file.
@@ -419,15 +403,12 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
                 of ["global", "US_counties"]
             data_type (str): type of the data in this file - one
                 of ["confirmed", "deaths", "recovered"]
-            headers (list(str)): CSV file headers (first row of the file)
             row (list(str)): row of data
+            parser (TimeSeriesParser): parser for this file
+            values (np.ndarray): the row's values, parsed by `parser`
+            missing (np.ndarray): the row's missing values mask
         """
-        if not row:  # ignore empty rows
-            return
-
-        header_to_column = self.header_to_column[file_type]
-        if "country" not in header_to_column:
-            header_to_column = header_to_column[data_type]
+        header_to_column = self.get_header_to_column(file_type, data_type)
 
         country = row[header_to_column["country"]]
         latitude = row[header_to_column["latitude"]] or "0"
@@ -503,22 +484,7 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
                 tmp_dict = tmp_dict["counties"][fips]
         time_series = tmp_dict["time_series"]
 
-        dates_start = header_to_column["dates_start"]
-        for i in range(dates_start, len(headers)):
-            date = headers[i]
-            date = get_unified_date_format(date)
-
-            if row[i] == "":  # ignore empty values
-                continue
-            try:
-                val = int(float(row[i]))
-            except ValueError:
-                print(
-                    'Unable to convert {} to int for "{}", "{}" at {}'.format(
-                        row[i], province, country, date
-                    )
-                )
-                raise
+        for date, val in parser.to_dict(values, missing).items():
             time_series[date][data_type] = val
 
     def nested_dict_to_geojson(self):
@@ -611,15 +577,7 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
                         features.append(feat_county)
 
         geojson = {"type": "FeatureCollection", "features": features}
-        with open(
-            os.path.join(CURRENT_DIR, MAP_DATA_FOLDER, GEOJSON_FILENAME), "w"
-        ) as f:
-            f.write(
-                json.dumps(
-                    geojson,
-                    separators=(",", ":"),
-                )
-            )
+        self.map_data[GEOJSON_FILENAME] = geojson
 
     def nested_dict_to_data_by_level(self):
         """
@@ -730,15 +688,7 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
 
         # add last updated date
         js["last_updated"] = self.latest_date
-        with open(
-            os.path.join(CURRENT_DIR, MAP_DATA_FOLDER, JSON_BY_LEVEL_FILENAME), "w"
-        ) as f:
-            f.write(
-                json.dumps(
-                    js,
-                    separators=(",", ":"),
-                )
-            )
+        self.map_data[JSON_BY_LEVEL_FILENAME] = js
 
     def nested_dict_to_time_series_by_level(self):
         print("Generating time series files...")
@@ -825,10 +775,9 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
                     if original_count > aggregated_count:
                         tmp["country"][iso3][date][key] = original_count
 
-        # save as JSON files, and upload to S3
+        # upload to S3 as JSON files
         print("Uploading time series files to S3...")
-        start = time.time()
-
+        publisher = S3Publisher(self.s3_client, self.s3_bucket, content_encoding="gzip")
         for data_level in ["country", "state", "county"]:
             print("  Uploading {} files".format(data_level.capitalize()))
             i = 0
@@ -838,25 +787,12 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
                     data_by_date[date] = replace_small_counts(data, data_level)
 
                 file_name = "{}.json".format(location_id)
-                abs_path = os.path.join(
-                    CURRENT_DIR, TIME_SERIES_DATA_FOLDER, data_level, file_name
-                )
-
-                # write to local file, upload to S3, delete local file
+                s3_path = os.path.join(TIME_SERIES_DATA_FOLDER, data_level, file_name)
                 if data_level == "county" and i % 100 == 0:
                     print(f"    {i} / {len(tmp[data_level])}")
                 i += 1
-                with open(abs_path, "w") as f:
-                    f.write(
-                        json.dumps(
-                            data_by_date,
-                            separators=(",", ":"),
-                        )
-                    )
-                s3_path = os.path.relpath(abs_path, CURRENT_DIR)
-                self.s3_client.upload_file(abs_path, self.s3_bucket, s3_path)
-                os.remove(abs_path)
-        print("  Done in {} secs".format(int(time.time() - start)))
+                publisher.publish_json(s3_path, data_by_date)
+        publisher.wait()
 
     def nested_dict_to_data_by_time(self):
         """
@@ -893,29 +829,17 @@ class JHU_TO_S3_GLOBAL(base.BaseETL):
                             "D": replace_small_counts_simple(deaths),
                         }
 
-        with open(
-            os.path.join(CURRENT_DIR, MAP_DATA_FOLDER, IL_JSON_BY_TIME_FILENAME), "w"
-        ) as f:
-            # create smaller file size by eliminating white space
-            f.write(
-                json.dumps(
-                    {"il_county_list": countyList, "last_updated": self.latest_date},
-                    separators=(",", ":"),
-                )
-            )
+        self.map_data[IL_JSON_BY_TIME_FILENAME] = {
+            "il_county_list": countyList,
+            "last_updated": self.latest_date,
+        }
 
     def submit_metadata(self):
         print("Uploading other files to S3...")
-        start = time.time()
 
         # files in TIME_SERIES_DATA_FOLDER have already been uploaded to S3
-        for folder in [MAP_DATA_FOLDER]:
-            for abs_path, _, files in os.walk(os.path.join(CURRENT_DIR, folder)):
-                for file_name in files:
-                    local_path = os.path.join(abs_path, file_name)
-                    s3_path = os.path.relpath(local_path, CURRENT_DIR)
-                    self.s3_client.upload_file(local_path, self.s3_bucket, s3_path)
-                    os.remove(local_path)
-
-        print("  Done in {} secs".format(int(time.time() - start)))
+        publisher = S3Publisher(self.s3_client, self.s3_bucket, content_encoding="gzip")
+        for file_name, data in self.map_data.items():
+            publisher.publish_json(os.path.join(MAP_DATA_FOLDER, file_name), data)
+        publisher.wait()
         print("Done!")
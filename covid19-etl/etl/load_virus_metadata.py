@@ -64,6 +64,7 @@ class LOAD_VIRUS_METADATA(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
     def checksum(self, filename):
@@ -10,12 +10,19 @@ from botocore import UNSIGNED
 from botocore.config import Config
 import boto3
 import codecs
-from google.cloud import bigquery
 
 from etl import base
 from utils.async_file_helper import AsyncFileHelper
+from utils.async_session_helper import shared_async_session
+from utils.bigquery_helper import BigQueryFetcher
 from utils.format_helper import format_submitter_id
 from utils.metadata_helper import MetadataHelper
+from utils.ncbi_helper import (
+    ACCESSION_NUMBER_REGEX,
+    AccessionFilenameIndex,
+    read_accession_manifest,
+    write_accession_manifest,
+)
 from etl.ncbi_file import NCBI_FILE
 
 DATA_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -26,6 +33,9 @@ FILE_EXTENSION_MAPPING = {"fq": "fastq", "fa": "fasta"}
 
 MAX_RETRIES = 3
 
+# number of BigQuery records whose indexd records are looked up together
+INDEXD_LOOKUP_BATCH_SIZE = 1000
+
 
 def get_file_extension(filename):
     """get file extension from the filename"""
@@ -142,20 +152,65 @@ SPECIAL_MAP_FIELDS = {
     ),
 }
 
-
-def read_ncbi_manifest(bucket, key, accession_number_filename_map):
-    """read the manifest"""
-    s3 = boto3.resource("s3", config=Config(signature_version=UNSIGNED))
-    s3_object = s3.Object(bucket, key)
-    line_stream = codecs.getreader("utf-8")
-    for line in line_stream(s3_object.get()["Body"]):
-        words = line.split("\t")
-        r1 = re.findall("[SDE]RR\d+", words[5])
-        if len(r1) >= 1:
-            accession_number_filename_map[r1[0]] = words[1]
+# fields of the `sample` and `virus_sequence` records. The values are the
+# BigQuery columns with the same names, or mapped in SPECIAL_MAP_FIELDS
+SAMPLE_FIELDS = [
+    "ncbi_bioproject",
+    "ncbi_biosample",
+    "sample_accession",
+    "host_associated_environmental_package_sam",
+    "organism",
+    "collection_date",
+    "country_region",
+    "continent",
+]
+VIRUS_SEQUENCE_FIELDS = [
+    "assay_type",
+    "avgspotlen",
+    "bytes",
+    "center_name",
+    "consent",
+    "datastore_provider",
+    "datastore_region",
+    "description_sam",
+    "ena_checklist_sam",
+    "ena_first_public_run",
+    "ena_last_update_run",
+    "experiment",
+    "insdc_center_name_sam",
+    "insdc_first_public_sam",
+    "insdc_center_alias_sam",
+    "insdc_last_update_sam",
+    "investigation_type_sam",
+    "insdc_status_sam",
+    "instrument",
+    "library_name",
+    "libraryselection",
+    "librarysource",
+    "mbases",
+    "mbytes",
+    "platform",
+    "sra_accession_sam",
+    "sra_study",
+    "title_sam",
+    "release_date",
+    "data_format",
+    "librarylayout",
+]
+# only the BigQuery columns that are used are selected
+BIG_QUERY_COLUMNS = sorted(
+    set(
+        SPECIAL_MAP_FIELDS[field][0] if field in SPECIAL_MAP_FIELDS else field
+        for field in SAMPLE_FIELDS + VIRUS_SEQUENCE_FIELDS
+    )
+)
+SRA_METADATA_TABLE = "nih-sra-datastore.sra.metadata"
 
 
 class NCBI(base.BaseETL):
+    # the data files are indexed by NCBI_FILE and NCBI_MANIFEST
+    dependencies = ["NCBI_FILE", "NCBI_MANIFEST"]
+
     def __init__(self, base_url, access_token, s3_bucket):
         super().__init__(base_url, access_token, s3_bucket)
 
@@ -163,13 +218,19 @@ class NCBI(base.BaseETL):
         self.project_code = "ncbi-covid-19"
         self.manifest_bucket = "sra-pub-sars-cov2"
         self.sra_src_manifest = "sra-src/Manifest"
-        self.accession_number_filename_map = {}
+        # opened on first access; rebuilt only when the manifest changes
+        self.accession_number_filename_map = AccessionFilenameIndex(
+            self.manifest_bucket, self.sra_src_manifest
+        )
+        # BigQuery client (default: `bigquery.Client()`)
+        self.big_query_client = None
 
         self.metadata_helper = MetadataHelper(
             base_url=self.base_url,
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.file_helper = AsyncFileHelper(
@@ -204,48 +265,43 @@ class NCBI(base.BaseETL):
             }
         )
 
-        read_ncbi_manifest(
-            self.manifest_bucket,
-            self.sra_src_manifest,
-            self.accession_number_filename_map,
-        )
-
     def submit_metadata(self):
         start = time.strftime("%X")
         loop = asyncio.get_event_loop()
-        tasks = []
-
-        for node_name, _ in self.data_file.nodes.items():
-            if node_name == "virus_sequence_run_taxonomy":
-                continue
-            else:
-                tasks.append(
-                    asyncio.ensure_future(self.files_to_node_submissions(node_name))
-                )
-
         try:
-            results = loop.run_until_complete(asyncio.gather(*tasks))
-            loop.run_until_complete(
-                asyncio.gather(
-                    self.files_to_virus_sequence_run_taxonomy_submission(results[0])
-                )
-            )
-            if AsyncFileHelper.session:
-                loop.run_until_complete(asyncio.gather(AsyncFileHelper.close_session()))
+            loop.run_until_complete(self.get_submitting_data())
         finally:
             loop.close()
         end = time.strftime("%X")
 
+        # nodes are submitted in the order of `self.submitting_data` keys
+        self.metadata_helper.start_streaming(list(self.submitting_data))
         for k, v in self.submitting_data.items():
             print(f"Submitting {k} data...")
             for node in v:
                 node_record = {"type": k}
                 node_record.update(node)
                 self.metadata_helper.add_record_to_submit(node_record)
-            self.metadata_helper.batch_submit_records()
+        self.metadata_helper.batch_submit_records()
 
         print(f"Running time: From {start} to {end}")
 
+    async def get_submitting_data(self):
+        """
+        Get the submitting data of all the nodes. All the requests go through
+        the same aiohttp session
+        """
+        async with shared_async_session():
+            tasks = []
+            for node_name, _ in self.data_file.nodes.items():
+                if node_name == "virus_sequence_run_taxonomy":
+                    continue
+                tasks.append(
+                    asyncio.ensure_future(self.files_to_node_submissions(node_name))
+                )
+            results = await asyncio.gather(*tasks)
+            await self.files_to_virus_sequence_run_taxonomy_submission(results[0])
+
     async def files_to_virus_sequence_run_taxonomy_submission(
         self, submitting_accession_numbers
     ):
@@ -258,13 +314,25 @@ class NCBI(base.BaseETL):
 
         # Keep track accession_numbers having link to virus_sequence nodes
         accession_number_set = set()
+        batch = []
         for record in records:
             if record["acc"] in self.accession_number_filename_map:
-                accession_number = record["acc"]
-                print(f"Get from bigquery response {accession_number}")
-                success = await self._parse_big_query_response(record)
-                if success:
-                    accession_number_set.add(accession_number)
+                batch.append(record)
+            if len(batch) == INDEXD_LOOKUP_BATCH_SIZE:
+                accession_number_set.update(
+                    await self._parse_big_query_responses(batch)
+                )
+                batch = []
+        if batch:
+            accession_number_set.update(await self._parse_big_query_responses(batch))
+
+        print(
+            f"Get indexd records of {len(submitting_accession_numbers)} virus_sequence_run_taxonomy files"
+        )
+        indexd_records = await self.file_helper.async_find_by_names(
+            f"virus_sequence_run_taxonomy_{accession_number}.csv"
+            for accession_number in submitting_accession_numbers
+        )
 
         cmc_submitter_id = format_submitter_id("cmc_ncbi_covid19", {})
         for accession_number in submitting_accession_numbers:
@@ -287,23 +355,7 @@ class NCBI(base.BaseETL):
                 ]
 
             filename = f"virus_sequence_run_taxonomy_{accession_number}.csv"
-            print(f"Get indexd info of {filename}")
-            trying = True
-            while trying:
-                try:
-                    (
-                        did,
-                        rev,
-                        md5sum,
-                        filesize,
-                        file_name,
-                        authz,
-                    ) = await self.file_helper.async_find_by_name(filename=filename)
-                    trying = False
-                except Exception as e:
-                    print(
-                        f"Can not get indexd record of {filename}. Detail {e}. Retrying..."
-                    )
+            did, rev, md5sum, filesize, file_name, authz = indexd_records[filename]
 
             assert (
                 did
@@ -343,6 +395,15 @@ class NCBI(base.BaseETL):
                     f"Can not query peregine with {node_name}. Detail {e}. Retrying..."
                 )
 
+        ext = re.search("\.(.*)$", self.data_file.nodes[node_name][0]).group(1)
+        print(
+            f"Get indexd records of {len(submitting_accession_numbers)} {node_name} files"
+        )
+        indexd_records = await self.file_helper.async_find_by_names(
+            f"{node_name}_{accession_number}.{ext}"
+            for accession_number in submitting_accession_numbers
+        )
+
         for accession_number in submitting_accession_numbers:
             submitter_id = format_submitter_id(
                 node_name, {"accession_number": accession_number}
@@ -420,28 +481,8 @@ class NCBI(base.BaseETL):
             else:
                 raise Exception(f"ERROR: {node_name} does not exist")
 
-            ext = re.search("\.(.*)$", self.data_file.nodes[node_name][0]).group(1)
             filename = f"{node_name}_{accession_number}.{ext}"
-
-            print(f"Get indexd record of {filename}")
-
-            retrying = True
-            while retrying:
-                try:
-                    (
-                        did,
-                        rev,
-                        md5sum,
-                        filesize,
-                        file_name,
-                        authz,
-                    ) = await self.file_helper.async_find_by_name(filename=filename)
-                    retrying = False
-                except Exception as e:
-                    print(
-                        f"ERROR: Fail to query indexd for {filename}. Detail {e}. Retrying..."
-                    )
-                    await asyncio.sleep(5)
+            did, rev, md5sum, filesize, file_name, authz = indexd_records[filename]
 
             assert (
                 did
@@ -511,18 +552,33 @@ class NCBI(base.BaseETL):
             node_name
         )
 
+        bucket = self.data_file.bucket
+        key = self.data_file.nodes[node_name][0]
         s3 = boto3.resource("s3", config=Config(signature_version=UNSIGNED))
-        s3_object = s3.Object(self.data_file.bucket, self.data_file.nodes[node_name][0])
-        line_stream = codecs.getreader("utf-8")
-        n_lines = 0
-        for line in line_stream(s3_object.get()["Body"]):
-            r1 = re.findall("[SDE]RR\d+", line)
-            n_lines += 1
-            if n_lines % 10000 == 0:
-                print(f"Finish process row {n_lines} of file {node_name}")
-            if len(r1) == 0:
-                continue
-            read_accession_number = r1[0]
+        s3_object = s3.Object(bucket, key)
+
+        # reuse the accession numbers found by NCBI_FILE in the current
+        # version of the file, if available
+        accession_numbers = read_accession_manifest(bucket, key, s3_object.e_tag)
+        if accession_numbers is not None:
+            print(f"Using the accession manifest of file {node_name}")
+        else:
+            accession_numbers = set()
+            s3_response = s3_object.get()
+            line_stream = codecs.getreader("utf-8")
+            n_lines = 0
+            for line in line_stream(s3_response["Body"]):
+                match = ACCESSION_NUMBER_REGEX.search(line)
+                n_lines += 1
+                if n_lines % 10000 == 0:
+                    print(f"Finish process row {n_lines} of file {node_name}")
+                if match:
+                    accession_numbers.add(match.group(0))
+            write_accession_manifest(
+                bucket, key, s3_response["ETag"], accession_numbers
+            )
+
+        for read_accession_number in accession_numbers:
             if (
                 f"{node_name}_{read_accession_number}".lower()
                 not in existed_accession_numbers
@@ -533,8 +589,8 @@ class NCBI(base.BaseETL):
 
     def _get_response_from_big_query(self, accession_numbers):
         """
-        Get data from big query. The format of the response json is
-        described as below:
+        Get data from big query. Only the columns in `BIG_QUERY_COLUMNS` are
+        selected. The format of the response json is described as below:
         [{
             "acc": "DRR220591",
             "assay_type": "RNA-Seq",
@@ -575,29 +631,37 @@ class NCBI(base.BaseETL):
 
         assert accession_numbers != [], "accession_numbers is not empty"
 
-        start = 0
-        offset = 100
-        client = bigquery.Client()
-        while start < len(accession_numbers):
-            end = min(start + offset, len(accession_numbers))
-            stm = 'SELECT * FROM `nih-sra-datastore`.sra.metadata where consent = "public"'
-
-            stm = stm + f' and (acc = "{accession_numbers[start]}"'
-            for accession_number in accession_numbers[start + 1 : end]:
-                stm = stm + f' or acc = "{accession_number}"'
-            stm = stm + ")"
-
-            query_job = client.query(stm)
-
-            results = query_job.result()  # Waits for job to complete.
+        fetcher = BigQueryFetcher(
+            SRA_METADATA_TABLE,
+            BIG_QUERY_COLUMNS,
+            key_column="acc",
+            where='consent = "public"',
+            client=self.big_query_client,
+        )
+        yield from fetcher.fetch(list(accession_numbers))
 
-            for row in results:
-                yield dict(row)
-            start = end
+    async def _parse_big_query_responses(self, responses):
+        """
+        Parse a batch of big query responses. The indexd records of the
+        files are looked up concurrently.
 
-    async def _parse_big_query_response(self, response):
+        Return the accession numbers that were parsed successfully
         """
-        Parse the big query response and get indexd record
+        indexd_records = await self.file_helper.async_find_by_names(
+            self.accession_number_filename_map[response["acc"]]
+            for response in responses
+        )
+        parsed = []
+        for response in responses:
+            filename = self.accession_number_filename_map[response["acc"]]
+            if await self._parse_big_query_response(response, indexd_records[filename]):
+                parsed.append(response["acc"])
+        return parsed
+
+    async def _parse_big_query_response(self, response, indexd_record):
+        """
+        Parse the big query response, given the indexd record of its file
+        (as returned by `AsyncFileHelper.async_find_by_name`)
 
         Return True if success
 
@@ -611,16 +675,7 @@ class NCBI(base.BaseETL):
         sample["submitter_id"] = f"sample_{accession_number}"
         sample["projects"] = [{"code": self.project_code}]
 
-        for field in [
-            "ncbi_bioproject",
-            "ncbi_biosample",
-            "sample_accession",
-            "host_associated_environmental_package_sam",
-            "organism",
-            "collection_date",
-            "country_region",
-            "continent",
-        ]:
+        for field in SAMPLE_FIELDS:
             if field in SPECIAL_MAP_FIELDS:
                 old_name, dtype, handler = SPECIAL_MAP_FIELDS[field]
                 sample[field] = handler(response.get(old_name))
@@ -628,39 +683,7 @@ class NCBI(base.BaseETL):
                 sample[field] = str(response.get(field))
 
         virus_sequence["submitter_id"] = f"virus_sequence_{accession_number}"
-        for field in [
-            "assay_type",
-            "avgspotlen",
-            "bytes",
-            "center_name",
-            "consent",
-            "datastore_provider",
-            "datastore_region",
-            "description_sam",
-            "ena_checklist_sam",
-            "ena_first_public_run",
-            "ena_last_update_run",
-            "experiment",
-            "insdc_center_name_sam",
-            "insdc_first_public_sam",
-            "insdc_center_alias_sam",
-            "insdc_last_update_sam",
-            "investigation_type_sam",
-            "insdc_status_sam",
-            "instrument",
-            "library_name",
-            "libraryselection",
-            "librarysource",
-            "mbases",
-            "mbytes",
-            "platform",
-            "sra_accession_sam",
-            "sra_study",
-            "title_sam",
-            "release_date",
-            "data_format",
-            "librarylayout",
-        ]:
+        for field in VIRUS_SEQUENCE_FIELDS:
             if field in SPECIAL_MAP_FIELDS:
                 old_name, dtype, handler = SPECIAL_MAP_FIELDS[field]
                 virus_sequence[field] = handler(response.get(old_name))
@@ -676,24 +699,7 @@ class NCBI(base.BaseETL):
 
         virus_sequence["data_format"] = get_file_extension(virus_sequence["file_name"])
         filename = virus_sequence["file_name"]
-
-        retrying = True
-        while retrying:
-            try:
-                (
-                    did,
-                    rev,
-                    md5sum,
-                    filesize,
-                    file_name,
-                    authz,
-                ) = await self.file_helper.async_find_by_name(filename=filename)
-                retrying = False
-            except Exception as e:
-                print(
-                    f"ERROR: Fail to get indexd for {filename}. Detail {e}. Retrying..."
-                )
-                await asyncio.sleep(5)
+        did, rev, md5sum, filesize, file_name, authz = indexd_record
 
         if not did:
             print(
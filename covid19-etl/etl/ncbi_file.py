@@ -1,14 +1,20 @@
 import os
 from pathlib import Path
-import aiofiles as aiof
 import re
 import gzip
 import asyncio
+import itertools
 import time
 
 from etl import base
-from utils.async_file_helper import AsyncFileHelper
+from utils.async_file_helper import AsyncFileHelper, AsyncUploadQueue
+from utils.async_session_helper import shared_async_session
 from utils.metadata_helper import MetadataHelper
+from utils.ncbi_helper import (
+    ACCESSION_NUMBER_REGEX,
+    ShardWriter,
+    write_accession_manifest,
+)
 
 from botocore import UNSIGNED
 from botocore.config import Config
@@ -18,6 +24,16 @@ import codecs
 
 DATA_PATH = os.path.dirname(os.path.abspath(__file__))
 MAX_RETRIES = 5
+# number of lines read from S3 at once
+READ_BATCH_SIZE = 10000
+
+
+class UngroupedFileError(Exception):
+    """
+    The rows of an accession number are not grouped together in a data
+    file: its split file was already queued for upload, so it can't be
+    written to again
+    """
 
 
 class NCBI_FILE(base.BaseETL):
@@ -41,9 +57,12 @@ class NCBI_FILE(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         self.bucket = "sra-pub-sars-cov2-metadata-us-east-1"
+        # the split files are indexed by the workers of this queue
+        self.upload_queue = None
         self.nodes = {
             "virus_sequence_contig": ["contigs/contigs.json"],
             "virus_sequence_peptide": ["peptides/peptides.json"],
@@ -63,33 +82,45 @@ class NCBI_FILE(base.BaseETL):
 
         start = time.strftime("%X")
         loop = asyncio.get_event_loop()
-        tasks = []
-        for node_name, value in self.nodes.items():
-            if node_name == "virus_sequence_run_taxonomy":
-                continue
-            key = value[0]
-            headers = value[1] if len(value) > 1 else None
-
-            ext = re.search("\.(.*)$", key).group(1)
-            tasks.append(
-                asyncio.ensure_future(
-                    self.index_ncbi_data_file(node_name, ext, key, headers)
-                )
-            )
-
         try:
-            results = loop.run_until_complete(asyncio.gather(*tasks))
-
-            loop.run_until_complete(
-                asyncio.gather(self.index_virus_sequence_run_taxonomy_file(results[0]))
-            )
-            loop.run_until_complete(asyncio.gather(AsyncFileHelper.close_session()))
+            loop.run_until_complete(self.index_ncbi_data_files())
 
         finally:
             loop.close()
         end = time.strftime("%X")
         print(f"Running time: From {start} to {end}")
 
+    async def index_ncbi_data_files(self):
+        """
+        Split all the NCBI data files by accession number. The split files
+        are uploaded by the workers of `self.upload_queue` while the data
+        files are being parsed. All the requests go through the same
+        aiohttp session
+        """
+        async with shared_async_session():
+            self.upload_queue = AsyncUploadQueue(self.file_to_indexd)
+            self.upload_queue.start()
+            try:
+                tasks = []
+                for node_name, value in self.nodes.items():
+                    if node_name == "virus_sequence_run_taxonomy":
+                        continue
+                    key = value[0]
+                    headers = value[1] if len(value) > 1 else None
+
+                    ext = re.search("\.(.*)$", key).group(1)
+                    tasks.append(
+                        asyncio.ensure_future(
+                            self.index_ncbi_data_file(node_name, ext, key, headers)
+                        )
+                    )
+                results = await asyncio.gather(*tasks)
+
+                await self.index_virus_sequence_run_taxonomy_file(results[0])
+            finally:
+                # stop the upload workers even if the files can't be split
+                await self.upload_queue.close()
+
     async def index_virus_sequence_run_taxonomy_file(self, accession_numbers):
         """
         Chop the index virus sequence run taxonomy file into multiple smaller files
@@ -99,41 +130,43 @@ class NCBI_FILE(base.BaseETL):
             accession_numbers(set): a set of the interested accession numbers
         """
 
+        # split in a thread, so the upload workers can run in the meantime
+        shard_paths = await asyncio.get_event_loop().run_in_executor(
+            None, self.split_virus_sequence_run_taxonomy_file, accession_numbers
+        )
+        for path in shard_paths.values():
+            await self.upload_queue.put(Path(path))
+
+    def split_virus_sequence_run_taxonomy_file(self, accession_numbers):
+        """
+        Stream the gzip-compressed virus sequence run taxonomy file from S3,
+        decompressing it on the fly, and write the rows of the interested
+        accession numbers to one file per accession number.
+
+        The rows of an accession number are not necessarily consecutive, so
+        the files can only be indexed once the whole file is parsed.
+
+        Args:
+            accession_numbers(set): a set of the interested accession numbers
+
+        Returns:
+            dict: { <accession number>: <file path> }
+        """
         s3 = boto3.resource("s3", config=Config(signature_version=UNSIGNED))
         s3_object = s3.Object(self.bucket, self.nodes["virus_sequence_run_taxonomy"][0])
-        file_path = f"{DATA_PATH}/virus_sequence_run_taxonomy.gz"
-        s3_object.download_file(file_path)
-
-        results = {}
-        with gzip.open(file_path, "rb") as f:
-            line = f.readline()
-            if line:
-                header = line.decode("UTF-8")
-            while line:
-                row = line.decode("UTF-8")
-                words = row.split(",")
-                if (
-                    words
-                    and words[0] in accession_numbers
-                    or accession_numbers == {"*"}
-                ):
-                    if words[0] in results:
-                        results[words[0]].append(row)
-                    else:
-                        results[words[0]] = [row]
-
-                line = f.readline()
-
-        for accession_number, rows in results.items():
-            file_path = (
-                f"{DATA_PATH}/virus_sequence_run_taxonomy_{accession_number}.csv"
-            )
-            async with aiof.open(file_path, "w") as out:
-                await out.write(header)
-                for row in rows:
-                    await out.write(row)
-                    await out.flush()
-            await self.file_to_indexd(Path(file_path))
+        all_accession_numbers = accession_numbers == {"*"}
+        with gzip.open(s3_object.get()["Body"], "rt", encoding="utf-8") as f:
+            header = f.readline()
+            with ShardWriter(
+                f"{DATA_PATH}/virus_sequence_run_taxonomy_{{}}.csv", header=header
+            ) as writer:
+                for n_rows, row in enumerate(f, 1):
+                    accession_number = row.split(",", 1)[0]
+                    if all_accession_numbers or accession_number in accession_numbers:
+                        writer.write(accession_number, row)
+                    if n_rows % 100000 == 0:
+                        print(f"Finish process row {n_rows} of run taxonomy file")
+        return writer.paths
 
     async def index_ncbi_data_file(self, node_name, ext, key, headers=None):
         """
@@ -151,6 +184,8 @@ class NCBI_FILE(base.BaseETL):
         excluded_set = await self.get_existed_accession_numbers(node_name)
 
         line_stream = codecs.getreader("utf-8")
+        # Keep track the current opening file
+        f = None
         tries = 0
         while tries < MAX_RETRIES:
             try:
@@ -160,6 +195,10 @@ class NCBI_FILE(base.BaseETL):
 
                 # Maintain access number list
                 accession_numbers = set()
+                # All the accession numbers in the file, for the manifest
+                found_accession_numbers = set()
+                # The accession numbers whose files were queued for upload
+                queued_accession_numbers = set()
 
                 # Keep track current accession number
                 accession_number = None
@@ -169,46 +208,78 @@ class NCBI_FILE(base.BaseETL):
                 f = None
 
                 try:
-                    # Stream the data from s3 bucket by reading line by line
-                    for line in line_stream(s3_object.get()["Body"]):
-                        try:
-                            # Handle the line.
-                            f, accession_number = await self.parse_row(
-                                line,
-                                node_name,
-                                ext,
-                                headers,
-                                accession_number,
-                                n_rows,
-                                f,
-                                excluded_set,
-                            )
-                            accession_numbers.add(accession_number)
-                            n_rows += 1
-                            if n_rows % 10000 == 0:
-                                print(
-                                    f"Finish process row {n_rows} of file {node_name}"
+                    # Stream the data from s3 bucket by reading line by line.
+                    # The lines are read by batches in a thread, so the
+                    # upload workers can run while the next batch downloads
+                    s3_response = s3_object.get()
+                    line_iterator = line_stream(s3_response["Body"])
+                    loop = asyncio.get_event_loop()
+                    while True:
+                        lines = await loop.run_in_executor(
+                            None,
+                            list,
+                            itertools.islice(line_iterator, READ_BATCH_SIZE),
+                        )
+                        if not lines:
+                            break
+                        for line in lines:
+                            try:
+                                # Handle the line.
+                                f, accession_number = await self.parse_row(
+                                    line,
+                                    node_name,
+                                    ext,
+                                    headers,
+                                    accession_number,
+                                    n_rows,
+                                    f,
+                                    excluded_set,
+                                    found_accession_numbers,
+                                    queued_accession_numbers,
                                 )
-
-                        except Exception as e:
-                            print(f"ERROR: line {line}. Detail {e}")
-                            # close the file
-                            if f:
-                                f.close()
-                            await asyncio.sleep(10)
+                                accession_numbers.add(accession_number)
+                                n_rows += 1
+                                if n_rows % 10000 == 0:
+                                    print(
+                                        f"Finish process row {n_rows} of file {node_name}"
+                                    )
+
+                            except UngroupedFileError:
+                                raise
+                            except Exception as e:
+                                print(f"ERROR: line {line}. Detail {e}")
+                                # close the file
+                                if f:
+                                    f.close()
+                                await asyncio.sleep(10)
                 except Exception as e:
                     print(f"ERROR: Can not download {key}. Detail {e}")
                     raise
                 # Index the last file
                 if f:
                     f.close()
-                await self.file_to_indexd(
-                    Path(f"{DATA_PATH}/{node_name}_{accession_number}.{ext}")
+                    await self.upload_queue.put(
+                        Path(f"{DATA_PATH}/{node_name}_{accession_number}.{ext}")
+                    )
+                # Save the accession numbers so NCBI does not need to stream
+                # the file again
+                write_accession_manifest(
+                    self.bucket, key, s3_response["ETag"], found_accession_numbers
                 )
                 break
+            except UngroupedFileError:
+                # streaming the file again would not help
+                if f:
+                    f.close()
+                raise
             except Exception as e:
                 print(f"Can not stream {key} from s3. Retrying...")
                 tries += 1
+                if f:
+                    f.close()
+                # the next attempt writes the same files again: wait for the
+                # files of this attempt to be uploaded (and removed) first
+                await self.upload_queue.join()
         return accession_numbers
 
     async def get_existed_accession_numbers(self, node_name):
@@ -227,7 +298,17 @@ class NCBI_FILE(base.BaseETL):
         return set([record["submitter_id"].lower() for record in records])
 
     async def parse_row(
-        self, line, node_name, ext, headers, accession_number, n_rows, f, excluded_set
+        self,
+        line,
+        node_name,
+        ext,
+        headers,
+        accession_number,
+        n_rows,
+        f,
+        excluded_set,
+        found_accession_numbers,
+        queued_accession_numbers,
     ):
         """
         Parse a data row
@@ -241,6 +322,10 @@ class NCBI_FILE(base.BaseETL):
             n_rows(int): number of rows processed
             f(file): the opening file
             excluded_set(set): a set of accession number need to be ignored
+            found_accession_numbers(set): the accession number of the row is
+                added to this set
+            queued_accession_numbers(set): the accession numbers whose files
+                were queued for upload
 
         Returns:
             f(file): the opening file
@@ -248,7 +333,9 @@ class NCBI_FILE(base.BaseETL):
         """
 
         # Parse for the accession number
-        r1 = re.findall("[SDE]RR\d+", line)
+        r1 = ACCESSION_NUMBER_REGEX.findall(line)
+        if r1:
+            found_accession_numbers.add(r1[0])
         if len(r1) == 0 and n_rows == 0:
             return f, accession_number
         assert (
@@ -262,15 +349,21 @@ class NCBI_FILE(base.BaseETL):
         if read_accession_number in excluded_set:
             return f, accession_number
 
-        # If the line contains new accession_number, close the opening file, index it
-        # and open new file for the new accession_number
+        # If the line contains new accession_number, close the opening file, queue
+        # it for indexing and open new file for the new accession_number
         if not accession_number or read_accession_number != accession_number:
             if f:
                 f.close()
-                await self.file_to_indexd(
+                queued_accession_numbers.add(accession_number)
+                await self.upload_queue.put(
                     Path(f"{DATA_PATH}/{node_name}_{accession_number}.{ext}")
                 )
 
+            # the file may be being uploaded or removed: never reopen it
+            if read_accession_number in queued_accession_numbers:
+                raise UngroupedFileError(
+                    f"The rows of {read_accession_number} are not grouped together in the {node_name} file"
+                )
             accession_number = read_accession_number
             f = open(f"{DATA_PATH}/{node_name}_{accession_number}.{ext}", "w")
             if headers:
@@ -280,30 +373,30 @@ class NCBI_FILE(base.BaseETL):
 
     async def file_to_indexd(self, filepath):
         """Asynchornous call to index the data file"""
-        filename = os.path.basename(filepath)
-        retrying = True
-        while retrying:
-            try:
-                did, _, _, _, _, _ = await self.file_helper.async_find_by_name(filename)
-                retrying = False
-            except Exception as e:
-                print(
-                    f"ERROR: Fail to query indexd for {filename}. Detail {e}. Retrying..."
-                )
-                await asyncio.sleep(5)
+        await self.files_to_indexd([filepath])
 
-        if not did:
-            retrying = True
-            while retrying:
-                try:
-                    guid = await self.file_helper.async_upload_file(filepath)
-                    print(f"file {filepath.name} uploaded with guid: {guid}")
-                    retrying = False
-                except Exception as e:
-                    print(
-                        f"ERROR: Fail to upload file {filepath}. Detail {e}. Retrying..."
-                    )
-                    await asyncio.sleep(5)
-        else:
-            print(f"file {filepath.name} exists in indexd... skipping...")
-        os.remove(filepath)
+    async def files_to_indexd(self, filepaths):
+        """
+        Asynchronous call to index data files. The files that are already in
+        indexd are looked up concurrently, then the other files are uploaded
+        """
+        indexd_records = await self.file_helper.async_find_by_names(
+            os.path.basename(filepath) for filepath in filepaths
+        )
+        for filepath in filepaths:
+            did = indexd_records[os.path.basename(filepath)][0]
+            if not did:
+                retrying = True
+                while retrying:
+                    try:
+                        guid = await self.file_helper.async_upload_file(filepath)
+                        print(f"file {filepath.name} uploaded with guid: {guid}")
+                        retrying = False
+                    except Exception as e:
+                        print(
+                            f"ERROR: Fail to upload file {filepath}. Detail {e}. Retrying..."
+                        )
+                        await asyncio.sleep(5)
+            else:
+                print(f"file {filepath.name} exists in indexd... skipping...")
+            os.remove(filepath)
@@ -1,8 +1,8 @@
 import asyncio
+import itertools
 from pathlib import Path
 import re
 import json
-import requests
 import time
 import datetime
 from dateutil.parser import parse
@@ -14,10 +14,22 @@ import codecs
 
 from etl import base
 from utils.async_file_helper import AsyncFileHelper
+from utils.async_session_helper import shared_async_session
+from utils.local_state_helper import LocalState
 from utils.metadata_helper import MetadataHelper
 
 
 MAX_RETRIES = 5
+# number of manifest rows indexed between two checkpoints
+MANIFEST_BATCH_SIZE = 1000
+# number of indexd records created at the same time
+MAX_CONCURRENT_INDEXING = 20
+# size (in bytes) of the chunks read from the manifest
+MANIFEST_CHUNK_SIZE = 1024 * 1024
+# time (in seconds) to wait before retrying to create an indexd record
+INDEXING_RETRY_DELAY = 5
+# key of the checkpoint in the local state
+CHECKPOINT_STATE_KEY = "ncbi_manifest_checkpoint"
 
 
 def conform_data_format(data, field_name):
@@ -49,7 +61,6 @@ class NCBI_MANIFEST(base.BaseETL):
         self.sra_src_manifest = "sra-src/Manifest"
         self.program_name = "open"
         self.project_code = "ncbi-covid-19"
-        self.token = access_token
         self.last_submission_identifier = None
 
         self.file_helper = AsyncFileHelper(
@@ -64,57 +75,100 @@ class NCBI_MANIFEST(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
-    def read_ncbi_manifest(self, key):
-        """read the manifest"""
+    def get_manifest_object(self, key):
+        s3 = boto3.resource("s3", config=Config(signature_version=UNSIGNED))
+        return s3.Object(self.manifest_bucket, key)
+
+    def read_ncbi_manifest(self, key, etag, start_offset=0):
+        """
+        Read the manifest, starting at byte `start_offset`. If the stream
+        fails, it is restarted from the last row read, using an S3 Range
+        request. `etag` is the expected version of the manifest: reading
+        fails if the manifest changed.
+
+        Yields:
+            (offset, row) tuples, where offset is the byte offset after the
+            row and row is (guid, size, md5, authz, url, release_date)
+        """
         tries = 0
-        last_row_num = 0
-        while tries < MAX_RETRIES:
+        offset = start_offset
+        while True:
             try:
-                s3 = boto3.resource("s3", config=Config(signature_version=UNSIGNED))
-                s3_object = s3.Object(self.manifest_bucket, key)
-                line_stream = codecs.getreader("utf-8")
-                row_num = 0
-                for line in line_stream(s3_object.get()["Body"]):
-                    row_num = row_num + 1
-                    if row_num < last_row_num:
-                        continue
-                    if row_num % 1000 == 0:
-                        print(f"Processed {row_num} rows of {key}")
-                    words = line.split("\t")
-                    guid = conform_data_format(words[0].strip(), "guid")
-                    size = int(conform_data_format(words[2].strip(), "size"))
-                    md5 = conform_data_format(words[3].strip(), "md5")
-                    authz = f"/programs/{self.program_name}/project/{self.project_code}"
-                    url = conform_data_format(words[5].strip(), "url")
-                    release_date = parse(re.sub(r":[0-9]{3}", "", words[6].strip()))
-                    yield guid, size, md5, authz, url, release_date
-                break
+                response = self.get_manifest_object(key).get(
+                    Range=f"bytes={offset}-", IfMatch=etag
+                )
+                buffer = b""
+                for chunk in response["Body"].iter_chunks(MANIFEST_CHUNK_SIZE):
+                    lines = (buffer + chunk).split(b"\n")
+                    buffer = lines.pop()
+                    for line in lines:
+                        offset += len(line) + 1
+                        row = self.parse_manifest_row(line)
+                        if row:
+                            yield offset, row
+                if buffer:
+                    offset += len(buffer)
+                    row = self.parse_manifest_row(buffer)
+                    if row:
+                        yield offset, row
+                return
             except Exception as e:
-                print(f"Can not stream {key}. Retrying...")
-                time.sleep(30)
                 tries += 1
-                last_row_num = row_num
+                if tries == MAX_RETRIES:
+                    raise
+                print(
+                    f"Can not stream {key} from byte {offset}. Detail {e}. Retrying..."
+                )
+                time.sleep(30)
+
+    def parse_manifest_row(self, line):
+        """
+        Returns (guid, size, md5, authz, url, release_date), or None if the
+        row is invalid
+        """
+        if not line.strip():
+            return None
+        try:
+            words = line.decode("utf-8").split("\t")
+            guid = conform_data_format(words[0].strip(), "guid")
+            size = int(conform_data_format(words[2].strip(), "size"))
+            md5 = conform_data_format(words[3].strip(), "md5")
+            authz = f"/programs/{self.program_name}/project/{self.project_code}"
+            url = conform_data_format(words[5].strip(), "url")
+            release_date = parse(re.sub(r":[0-9]{3}", "", words[6].strip()))
+        except Exception as e:
+            print(f"ERROR: line {line}. Detail {e}")
+            return None
+        return guid, size, md5, authz, url, release_date
 
     def submit_metadata(self):
         start = time.strftime("%X")
 
         loop = asyncio.get_event_loop()
         try:
-            loop.run_until_complete(
-                asyncio.gather(self.index_manifest(self.sra_src_manifest))
-            )
-            future = AsyncFileHelper.close_session()
-            if future:
-                loop.run_until_complete(asyncio.gather(future))
-
+            loop.run_until_complete(self.index_manifest(self.sra_src_manifest))
         finally:
             loop.close()
         end = time.strftime("%X")
         print(f"Running time: From {start} to {end}")
 
     async def index_manifest(self, manifest):
+        # all the requests go through the same aiohttp session
+        async with shared_async_session():
+            await self._index_manifest(manifest)
+
+    async def _index_manifest(self, manifest):
+        """
+        Index the new rows of the manifest. The rows are read by batches,
+        and the rows of a batch are indexed concurrently. After each batch,
+        a checkpoint (byte offset in the manifest and last processed guid)
+        is saved to the local state, so a new run on the same version of
+        the manifest resumes where the previous run stopped. The checkpoint
+        is only saved if all the rows of the batch were indexed.
+        """
         query_string = (
             '{ project (first: 0, dbgap_accession_number: "'
             + self.project_code
@@ -131,46 +185,52 @@ class NCBI_MANIFEST(base.BaseETL):
         now = datetime.datetime.now()
         last_submission_date_time = now.strftime("%m/%d/%Y, %H:%M:%S")
 
-        for (guid, size, md5, authz, url, release_date) in self.read_ncbi_manifest(
-            manifest
-        ):
-            if (
-                not self.last_submission_identifier
-                or release_date > self.last_submission_identifier
-            ):
-                filename = url.split("/")[-1]
-                retrying = True
-
-                while retrying:
-                    try:
-                        did, _, _, _, _, _ = await self.file_helper.async_find_by_name(
-                            filename
-                        )
-                        retrying = False
-                    except Exception as e:
-                        print(
-                            f"ERROR: Fail to query indexd for {filename}. Detail {e}. Retrying..."
-                        )
-                        await asyncio.sleep(5)
+        s3_object = self.get_manifest_object(manifest)
+        etag = s3_object.e_tag
+        local_state = LocalState(self.metadata_helper.project_id)
+        checkpoint = json.loads(local_state.get(CHECKPOINT_STATE_KEY, "{}"))
+        offset = 0
+        if checkpoint.get("etag") == etag:
+            offset = checkpoint["offset"]
+            print(
+                f"Resuming from byte {offset} of {manifest} (last guid: {checkpoint['last_guid']})"
+            )
 
-                if did:
-                    print(f"{filename} was already indexed")
-                    continue
+        if offset < s3_object.content_length:
+            rows = self.read_ncbi_manifest(manifest, etag, offset)
+            loop = asyncio.get_event_loop()
 
-                print(f"start to index {filename}")
-                retries = 0
-                while retries < MAX_RETRIES:
-                    try:
-                        await self.file_helper.async_index_record(
-                            guid, size, filename, url, authz, md5
-                        )
-                        break
-                    except Exception as e:
-                        retries += 1
-                        print(
-                            f"ERROR: Fail to create new indexd record for {guid}. Detail {e}. Retrying..."
-                        )
-                        await asyncio.sleep(5)
+            def read_batch():
+                return list(itertools.islice(rows, MANIFEST_BATCH_SIZE))
+
+            n_rows = 0
+            # read the next batch in a thread while the current batch is
+            # being indexed
+            next_batch = loop.run_in_executor(None, read_batch)
+            while True:
+                batch = await next_batch
+                if not batch:
+                    break
+                next_batch = loop.run_in_executor(None, read_batch)
+                await self.index_rows(
+                    [
+                        row
+                        for _, row in batch
+                        if not self.last_submission_identifier
+                        or row[5] > self.last_submission_identifier
+                    ]
+                )
+                n_rows += len(batch)
+                offset, (last_guid, *_) = batch[-1]
+                local_state.set(
+                    CHECKPOINT_STATE_KEY,
+                    json.dumps(
+                        {"etag": etag, "offset": offset, "last_guid": last_guid}
+                    ),
+                )
+                print(f"Processed {n_rows} rows of {manifest}")
+        else:
+            print(f"All the rows of {manifest} were already processed")
 
         headers = {
             "content-type": "application/json",
@@ -181,8 +241,60 @@ class NCBI_MANIFEST(base.BaseETL):
             "dbgap_accession_number": self.project_code,
             "last_submission_identifier": last_submission_date_time,
         }
-        res = requests.put(
+        res = self.session.put(
             "{}/api/v0/submission/{}".format(self.base_url, self.program_name),
             headers=headers,
             data=json.dumps(record),
         )
+
+    async def index_rows(self, rows):
+        """
+        Index manifest rows concurrently: the existing records are looked up
+        together, then the missing ones are created by up to
+        `MAX_CONCURRENT_INDEXING` requests at a time.
+        """
+        # only keep the first row of each file
+        rows_by_filename = {}
+        for row in rows:
+            rows_by_filename.setdefault(row[4].split("/")[-1], row)
+        existing = await self.file_helper.async_find_by_names(rows_by_filename)
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_INDEXING)
+
+        async def _index(filename, guid, size, md5, authz, url):
+            async with semaphore:
+                print(f"start to index {filename}")
+                retries = 0
+                while True:
+                    try:
+                        await self.file_helper.async_index_record(
+                            guid, size, filename, url, authz, md5
+                        )
+                        return
+                    except Exception as e:
+                        retries += 1
+                        print(
+                            f"ERROR: Fail to create new indexd record for {guid}. Detail {e}. Retrying..."
+                        )
+                        if retries == MAX_RETRIES:
+                            raise
+                        await asyncio.sleep(INDEXING_RETRY_DELAY)
+
+        tasks = []
+        guids = []
+        for filename, (guid, size, md5, authz, url, _) in rows_by_filename.items():
+            if existing[filename][0]:
+                print(f"{filename} was already indexed")
+                continue
+            tasks.append(_index(filename, guid, size, md5, authz, url))
+            guids.append(guid)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        failed = [
+            guid for guid, res in zip(guids, results) if isinstance(res, Exception)
+        ]
+        if failed:
+            # the batch's checkpoint must not be saved, so the next run
+            # indexes these rows again
+            raise Exception(
+                f"Unable to create the indexd records for {len(failed)} files: {failed}"
+            )
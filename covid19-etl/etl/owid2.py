@@ -8,6 +8,12 @@ from etl import base
 from utils.metadata_helper import MetadataHelper
 
 
+DATA_URL = "https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/owid-covid-data.csv"
+RAW_FILENAME = "owid-covid-data.csv"
+# size (in bytes) of the chunks downloaded at once
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
 def format_location_submitter_id(country):
     """summary_location_<country>"""
     submitter_id = "summary_location_{}".format(country)
@@ -31,12 +37,9 @@ def format_summary_summary_socio_demographic(location_submitter_id, date):
     )
 
 
-class OWID2(base.BaseETL):
+class OWID2(base.StagedETL):
     def __init__(self, base_url, access_token, s3_bucket):
         super().__init__(base_url, access_token, s3_bucket)
-        self.summary_locations = []
-        self.summary_clinicals = []
-        self.summary_socio_demographics = []
 
         self.program_name = "open"
         self.project_code = "OWID"
@@ -45,6 +48,9 @@ class OWID2(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            submit_max_in_flight=4,
+            skip_unchanged_records=True,
+            session=self.session,
         )
 
         self.expected_csv_headers = [
@@ -93,42 +99,27 @@ class OWID2(base.BaseETL):
             k: self.expected_csv_headers.index(k) for k in self.expected_csv_headers
         }
 
-    def files_to_submissions(self):
+    def fetch(self):
         """
-        Reads CSV files and converts the data to Sheepdog records
+        Downloads the CSV file to the snapshot
         """
-        url = "https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/owid-covid-data.csv"
-        self.parse_file(url)
-
-    def insert_row_value(self, row_value):
-        summary_location_list = []
-        (
-            summary_location,
-            summary_clinical,
-            summary_socio_demographic,
-        ) = row_value
-        summary_location_submitter_id = summary_location["submitter_id"]
-        if summary_location_submitter_id not in summary_location_list:
-            self.summary_locations.append(summary_location)
-            summary_location_list.append(summary_location_submitter_id)
-
-        self.summary_clinicals.append(summary_clinical)
-        self.summary_socio_demographics.append(summary_socio_demographic)
+        print("Getting data from {}".format(DATA_URL))
+        with closing(self.get(DATA_URL, stream=True)) as r:
+            self.snapshot.write_file(
+                RAW_FILENAME, r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            )
 
-    def parse_file(self, url):
+    def transform(self, writer):
         """
-        Converts a CSV file to data we can submit via Sheepdog. Stores the
-        records to submit in `self.location_data` and `self.time_series_data`.
-        Ignores any records that are already in Sheepdog (relies on unique
-        `submitter_id` to check)
+        Converts the CSV file in the snapshot to data we can submit via
+        Sheepdog, and writes the records with `writer`
 
         Args:
-            url (str): URL at which the CSV file is available
+            writer (RecordWriter): writer of the transformed records
         """
-        print("Getting data from {}".format(url))
-
-        with closing(self.get(url, stream=True)) as r:
-            f = (line.decode("utf-8") for line in r.iter_lines())
+        with self.snapshot.open_file(
+            RAW_FILENAME, "r", encoding="utf-8", newline=""
+        ) as f:
             reader = csv.reader(f, delimiter=",", quotechar='"')
 
             headers = next(reader)
@@ -149,12 +140,22 @@ class OWID2(base.BaseETL):
             for row in reader:
                 res = self.parse_row(pre_row, row)
                 if res is not None:
-                    self.insert_row_value(res)
+                    self.write_row_value(writer, res)
                 pre_row = row
             if pre_row is not None:
                 res = self.parse_row(pre_row, None)
                 if res is not None:
-                    self.insert_row_value(res)
+                    self.write_row_value(writer, res)
+
+    def write_row_value(self, writer, row_value):
+        (
+            summary_location,
+            summary_clinical,
+            summary_socio_demographic,
+        ) = row_value
+        writer.write(dict(summary_location, type="summary_location"))
+        writer.write(dict(summary_clinical, type="summary_clinical"))
+        writer.write(dict(summary_socio_demographic, type="summary_socio_demographic"))
 
     def create_clinical(self, row, date, summary_location_submitter_id):
         summary_clinical_submitter_id = format_summary_clinical_submitter_id(
@@ -301,31 +302,3 @@ class OWID2(base.BaseETL):
                 pre_row, pre_date, summary_location_submitter_id
             ),
         )
-
-    def submit_metadata(self):
-        """
-        Converts the data in `self.time_series_data` to Sheepdog records.
-        `self.location_data already contains Sheepdog records. Batch submits
-        all records in `self.location_data` and `self.time_series_data`
-        """
-
-        # Commented
-        # Only required for one time submission of summary_location
-        print("Submitting summary_location data")
-        for loc in self.summary_locations:
-            loc_record = {"type": "summary_location"}
-            loc_record.update(loc)
-            self.metadata_helper.add_record_to_submit(loc_record)
-        self.metadata_helper.batch_submit_records()
-        print("Submitting summary_clinical data")
-        for sc in self.summary_clinicals:
-            sc_record = {"type": "summary_clinical"}
-            sc_record.update(sc)
-            self.metadata_helper.add_record_to_submit(sc_record)
-        self.metadata_helper.batch_submit_records()
-        print("Submitting summary_socio_demographic data")
-        for sc in self.summary_socio_demographics:
-            sc_record = {"type": "summary_socio_demographic"}
-            sc_record.update(sc)
-            self.metadata_helper.add_record_to_submit(sc_record)
-        self.metadata_helper.batch_submit_records()
@@ -53,6 +53,7 @@ class SSR(base.BaseETL):
             program_name=self.program_name,
             project_code=self.project_code,
             access_token=access_token,
+            session=self.session,
         )
 
         # self.records = { <node ID>: { <submitter_id: { <data> } } }
@@ -1,6 +1,7 @@
 import os
 
-from importlib import import_module
+from etl import load_job
+from utils.job_runner import JOB_RUNNER_MAX_WORKERS, JobRunner
 
 if __name__ == "__main__":
     base_url = "http://revproxy-service"
@@ -15,6 +16,8 @@ if __name__ == "__main__":
         raise Exception(
             "Need JOB_NAME environment variable (specification on which ETL job to run)"
         )
+    # several jobs can be run at once: "JOB_NAME=IDPH_VACCINE,IDPH_VACCINE_TO_S3"
+    job_names = [name.strip() for name in job_name.split(",") if name.strip()]
 
     s3_bucket = os.environ.get("S3_BUCKET")
     if not s3_bucket:
@@ -22,12 +25,17 @@ if __name__ == "__main__":
             "WARNING: Missing S3_BUCKET environment variable - ETL jobs that push data to S3 will fail"
         )
 
-    job_module = job_name.lower()
-    job_class = job_name.upper()
+    if len(job_names) > 1:
+        max_workers = int(os.environ.get("MAX_PARALLEL_JOBS", JOB_RUNNER_MAX_WORKERS))
+        statuses = JobRunner(
+            job_names, base_url, token, s3_bucket, max_workers=max_workers
+        ).run()
+        failed = [name for name, status in statuses.items() if status != "succeeded"]
+        if failed:
+            raise Exception(f"Jobs {failed} did not succeed")
+    else:
+        etl = load_job(job_names[0])
 
-    etl_module = import_module(f"etl.{job_module}")
-    etl = getattr(etl_module, job_class)
-
-    job = etl(base_url, token, s3_bucket)
-    job.files_to_submissions()
-    job.submit_metadata()
+        job = etl(base_url, token, s3_bucket)
+        job.files_to_submissions()
+        job.submit_metadata()
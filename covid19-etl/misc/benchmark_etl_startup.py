@@ -0,0 +1,115 @@
+"""
+Measures the startup time of each ETL job: the time it takes to import
+the job's class in a new Python process, as `main.py` does. Compares
+loading the job from the lazy registry ("lazy") with importing all the
+ETL modules first, like `etl/__init__.py` used to do ("eager").
+
+Usage: python misc/benchmark_etl_startup.py [<JOB_NAME> ...]
+"""
+
+
+import os
+import statistics
+import subprocess
+import sys
+
+CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
+ETL_ROOT = os.path.join(CURRENT_DIR, "..")
+sys.path.insert(0, ETL_ROOT)
+from etl import get_job_module_path, list_jobs
+
+
+##########
+# config #
+##########
+
+# number of processes started per job and mode; the median time is shown
+REPEATS = 5
+
+# third-party packages that are slow to import
+HEAVY_PACKAGES = [
+    "aiohttp",
+    "boto3",
+    "gen3",
+    "geopandas",
+    "google.cloud.bigquery",
+    "numpy",
+    "pandas",
+    "xlrd",
+]
+
+LAZY_CODE = """
+from etl import load_job
+load_job("{job_name}")
+"""
+
+EAGER_CODE = """
+from importlib import import_module
+from etl import get_job_module_path, list_jobs
+for name in list_jobs():
+    try:
+        import_module(get_job_module_path(name))
+    except Exception:
+        pass
+import_module("{module_path}")
+"""
+
+TIMING_CODE = """
+import sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+heavy = [p for p in {heavy_packages} if p in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+
+def measure(code):
+    """
+    Runs `code` in a new Python process. Returns the time the code took to
+    run, in seconds, and the heavy packages it imported.
+    """
+    res = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ETL_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if res.returncode != 0:
+        raise Exception(res.stderr.strip().splitlines()[-1])
+    elapsed, _, heavy = res.stdout.strip().splitlines()[-1].partition(" ")
+    return float(elapsed), heavy
+
+
+def benchmark(job_name):
+    results = {}
+    for mode, code in [
+        ("lazy", LAZY_CODE.format(job_name=job_name)),
+        ("eager", EAGER_CODE.format(module_path=get_job_module_path(job_name))),
+    ]:
+        timing_code = TIMING_CODE.format(code=code, heavy_packages=HEAVY_PACKAGES)
+        runs = [measure(timing_code) for _ in range(REPEATS)]
+        results[mode] = (statistics.median(t for t, _ in runs), runs[0][1])
+    return results
+
+
+if __name__ == "__main__":
+    job_names = [name.upper() for name in sys.argv[1:]] or list_jobs()
+    print(
+        "{:<28} {:>9} {:>9} {:>8}  {}".format(
+            "job", "eager (s)", "lazy (s)", "speedup", "heavy imports (lazy)"
+        )
+    )
+    for job_name in job_names:
+        try:
+            results = benchmark(job_name)
+        except Exception as e:
+            print(f"{job_name:<28} unable to import: {e}")
+            continue
+        eager, _ = results["eager"]
+        lazy, heavy = results["lazy"]
+        print(
+            "{:<28} {:>9.3f} {:>9.3f} {:>7.1f}x  {}".format(
+                job_name, eager, lazy, eager / lazy, heavy or "-"
+            )
+        )
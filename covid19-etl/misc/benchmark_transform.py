@@ -0,0 +1,54 @@
+"""
+Runs the transform stage of a staged ETL (see `etl.base.StagedETL`)
+offline, against the raw data captured by the last fetch stage of the job,
+and shows how long it takes. The transformed records are written to a
+temporary folder: the job's snapshot is not modified.
+
+Usage: python misc/benchmark_transform.py <JOB_NAME>
+"""
+
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+CURRENT_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(CURRENT_DIR, ".."))
+from etl import load_job
+from utils.snapshot_helper import RecordWriter, Snapshot
+
+
+##########
+# config #
+##########
+
+# number of times the transform stage is run; the median time is shown
+REPEATS = 3
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        raise Exception("Usage: python misc/benchmark_transform.py <JOB_NAME>")
+    job_name = sys.argv[1].upper()
+
+    job = load_job(job_name)("fake_url", "fake_token", "fake_bucket")
+    if not job.snapshot.is_done("fetch"):
+        raise Exception(
+            f"No fetched data in {job.snapshot.path}: run the {job_name} job first"
+        )
+
+    durations = []
+    for _ in range(REPEATS):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with RecordWriter(Snapshot(job_name, path=tmp_dir)) as writer:
+                start = time.perf_counter()
+                job.transform(writer)
+                durations.append(time.perf_counter() - start)
+    counts = ", ".join(f"{n} {node_type}" for node_type, n in writer.counts.items())
+    print(
+        "{}: transform in {:.2f}s (median of {} runs) - {} records".format(
+            job_name, statistics.median(durations), REPEATS, counts or "no"
+        )
+    )
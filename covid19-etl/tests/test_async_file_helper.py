@@ -0,0 +1,111 @@
+import asyncio
+
+from mock import patch
+import pytest
+
+from utils.async_file_helper import AsyncFileHelper, AsyncUploadQueue
+from utils.async_session_helper import get_async_session, shared_async_session
+
+
+def test_async_find_by_names():
+    helper = AsyncFileHelper("base_url", "program", "project", "access_token")
+    in_flight = [0]
+    max_in_flight = [0]
+    failed = set()
+
+    async def mock_find_by_name(filename):
+        in_flight[0] += 1
+        max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        await asyncio.sleep(0.01)
+        in_flight[0] -= 1
+        if filename == "file_3" and filename not in failed:
+            # fail once: the lookup is retried
+            failed.add(filename)
+            raise Exception("indexd error")
+        if filename == "file_5":
+            return None, None, None, None, "", None
+        return f"did_{filename}", "rev", "md5", 1, filename, []
+
+    filenames = [f"file_{i}" for i in range(20)] + ["file_0"]
+    with patch.object(
+        helper, "async_find_by_name", side_effect=mock_find_by_name
+    ), patch("utils.async_file_helper.INDEXD_RETRY_DELAY", 0):
+        records = asyncio.run(helper.async_find_by_names(filenames, max_concurrency=4))
+
+    assert list(records) == filenames[:20]
+    assert records["file_3"][0] == "did_file_3"
+    assert records["file_5"][0] is None
+    assert 1 < max_in_flight[0] <= 4
+
+
+def test_async_upload_queue(tmp_path):
+    uploaded = []
+    in_flight = [0]
+    max_in_flight = [0]
+    max_waiting = [0]
+
+    async def mock_upload(path):
+        in_flight[0] += 1
+        max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        await asyncio.sleep(0.01)
+        in_flight[0] -= 1
+        uploaded.append(path)
+
+    async def produce():
+        queue = AsyncUploadQueue(mock_upload, n_workers=3, max_size=2)
+        queue.start()
+        for i in range(20):
+            path = tmp_path / f"file_{i}"
+            path.write_text("data")
+            await queue.put(path)
+            # back-pressure: the producer waits when the queue is full
+            max_waiting[0] = max(max_waiting[0], queue.queue.qsize())
+        await queue.close()
+        return queue
+
+    queue = asyncio.run(produce())
+    assert sorted(uploaded) == sorted(tmp_path / f"file_{i}" for i in range(20))
+    assert queue.n_uploaded == 20 and queue.uploaded_bytes == 80
+    assert 1 < max_in_flight[0] <= 3
+    assert max_waiting[0] <= 2
+
+
+def test_async_upload_queue_join(tmp_path):
+    uploaded = []
+
+    async def mock_upload(path):
+        await asyncio.sleep(0.01)
+        uploaded.append(path)
+
+    async def produce():
+        queue = AsyncUploadQueue(mock_upload, n_workers=2)
+        queue.start()
+        try:
+            for i in range(5):
+                path = tmp_path / f"file_{i}"
+                path.write_text("data")
+                await queue.put(path)
+            # all the files queued so far are uploaded when `join` returns
+            await queue.join()
+            assert len(uploaded) == 5
+            raise Exception("failed")
+        finally:
+            await queue.close()
+
+    # the workers are stopped when producing the files fails
+    with pytest.raises(Exception, match="failed"):
+        asyncio.run(produce())
+    assert len(uploaded) == 5
+
+
+def test_shared_async_session():
+    async def run():
+        async with shared_async_session(limit=10, limit_per_host=5) as session:
+            # all the helpers use the same session and connection pool
+            assert AsyncFileHelper.get_session() is session
+            assert get_async_session() is session
+            assert session.connector.limit == 10
+            assert session.connector.limit_per_host == 5
+        assert session.closed
+
+    asyncio.run(run())
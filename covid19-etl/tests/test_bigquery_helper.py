@@ -0,0 +1,77 @@
+import re
+import time
+from types import SimpleNamespace
+
+from utils.bigquery_helper import BigQueryFetcher
+
+
+class LocalBigQueryClient:
+    """
+    Stand-in for `bigquery.Client`, backed by rows in memory. Only supports
+    the queries generated by `BigQueryFetcher`.
+
+    Args:
+        rows (list(dict)): content of the table
+        latency (float): time (in seconds) each query takes
+    """
+
+    def __init__(self, rows, latency=0):
+        self.rows = rows
+        self.latency = latency
+        self.queries = []
+
+    def get_table(self, table):
+        columns = dict.fromkeys(c for row in self.rows for c in row)
+        return SimpleNamespace(schema=[SimpleNamespace(name=c) for c in columns])
+
+    def query(self, query, job_config=None):
+        self.queries.append(query)
+        match = re.match(
+            r"SELECT (.*) FROM `.*` WHERE (.* AND )?(\w+) IN UNNEST", query
+        )
+        columns = match.group(1).split(", ")
+        key_column = match.group(3)
+        keys = set(job_config.query_parameters[0].values)
+
+        def result():
+            time.sleep(self.latency)
+            return [
+                {c: row.get(c) for c in columns}
+                for row in self.rows
+                if row.get(key_column) in keys
+            ]
+
+        return SimpleNamespace(result=result)
+
+
+def test_big_query_fetcher():
+    rows = [
+        {"acc": f"SRR{i}", "consent": "public", "mbases": i, "unused": "x"}
+        for i in range(100)
+    ]
+    client = LocalBigQueryClient(rows, latency=0.05)
+    fetcher = BigQueryFetcher(
+        "project.dataset.table",
+        ["mbases", "not_in_table"],
+        key_column="acc",
+        where='consent = "public"',
+        client=client,
+        chunk_size=10,
+        max_concurrent_jobs=4,
+    )
+    keys = [f"SRR{i}" for i in range(0, 100, 2)] + ["SRR1000"]
+
+    start = time.time()
+    results = list(fetcher.fetch(keys))
+    duration = time.time() - start
+
+    # only the existing requested columns are selected, for the requested
+    # keys, in the order of the keys
+    assert results == [{"acc": f"SRR{i}", "mbases": i} for i in range(0, 100, 2)]
+    assert len(client.queries) == 6
+    assert client.queries[0] == (
+        "SELECT acc, mbases FROM `project.dataset.table` "
+        'WHERE consent = "public" AND acc IN UNNEST(@keys)'
+    )
+    # the chunks are queried concurrently
+    assert duration < 6 * 0.05
@@ -0,0 +1,20 @@
+from etl.dsfsi import normalize_date
+from utils.date_helper import get_unified_date_format, parse_date_with_formats
+
+
+def test_get_unified_date_format():
+    assert get_unified_date_format("1/2/20") == "2020-01-02"
+    assert get_unified_date_format("12/31/2021") == "2021-12-31"
+
+
+def test_parse_date_with_formats():
+    formats = ("%Y-%m-%d", "%m/%d/%Y")
+    assert parse_date_with_formats("03/14/2020", formats).day == 14
+    assert parse_date_with_formats("not a date", formats) is None
+    # cached results are returned for the same input
+    assert parse_date_with_formats("2020-03-14", formats) is parse_date_with_formats(
+        "2020-03-14", formats
+    )
+
+    assert normalize_date("Returned 14-Mar-20") == "2020-03-14"
+    assert normalize_date("NA") is None
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from mock import patch
+
+from etl.idph import IDPH, MAX_CONCURRENT_REQUESTS
+
+
+class MockResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def __bool__(self):
+        return True
+
+    def json(self):
+        return self.data
+
+
+def test_fetch_json():
+    etl = IDPH("base_url", "access_token", "s3_bucket")
+    lock = threading.Lock()
+    in_flight = [0]
+    max_in_flight = [0]
+
+    def mock_get(url, headers=None):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return MockResponse({"url": url})
+
+    urls = [f"url_{i}" for i in range(50)]
+    with patch.object(etl, "get", side_effect=mock_get):
+        data = etl.fetch_json(urls)
+
+    # the results are in the same order as the URLs
+    assert [d["url"] for d in data] == urls
+    assert 1 < max_in_flight[0] <= MAX_CONCURRENT_REQUESTS
@@ -34,3 +34,11 @@ def test_import():
         assert hasattr(
             job, "submit_metadata"
         ), f"ETL {job_name} is missing submit_metadata() method"
+
+
+def test_job_registry():
+    from etl import list_jobs, load_job
+    from etl.stoplight import STOPLIGHT
+
+    assert "STOPLIGHT" in list_jobs() and "BASE" not in list_jobs()
+    assert load_job("stoplight") is STOPLIGHT
@@ -0,0 +1,90 @@
+from mock import MagicMock, patch
+
+from etl.jhu import JHU, LAST_DATE_STATE_KEY
+
+
+GLOBAL_HEADERS = "Province/State,Country/Region,Lat,Long"
+US_CONFIRMED_HEADERS = "UID,iso2,iso3,code3,FIPS,Admin2,Province_State,Country_Region,Lat,Long_,Combined_Key"
+US_DEATHS_HEADERS = f"{US_CONFIRMED_HEADERS},Population"
+
+
+def get_test_etl(recovered_dates, guppy_last_date, not_found=None):
+    """
+    Returns a JHU ETL whose confirmed and deaths files have data until
+    1/24/20, and whose recovered file has data for `recovered_dates`. The
+    `not_found` file returns a 404 error page.
+    """
+    all_dates = ["1/22/20", "1/23/20", "1/24/20"]
+    files = {
+        "confirmed_global": (GLOBAL_HEADERS, all_dates),
+        "deaths_global": (GLOBAL_HEADERS, all_dates),
+        "recovered_global": (GLOBAL_HEADERS, recovered_dates),
+        "confirmed_US": (US_CONFIRMED_HEADERS, all_dates),
+        "deaths_US": (US_DEATHS_HEADERS, all_dates),
+    }
+
+    def mock_get(url, **kwargs):
+        file_name = url.split("time_series_covid19_")[-1][: -len(".csv")]
+        headers, dates = files[file_name]
+        lines = [",".join([headers] + dates)]
+        if file_name == not_found:
+            lines = ["404: Not Found"]
+        if headers == GLOBAL_HEADERS:
+            values = [str(i + 1) for i in range(len(dates))]
+            lines.append(",".join(["", "France", "46", "2"] + values))
+        response = MagicMock()
+        response.iter_lines.return_value = (line.encode() for line in lines)
+        return response
+
+    etl = JHU("base_url", "access_token", "s3_bucket")
+    etl.get = mock_get
+    etl.metadata_helper = MagicMock(project_id="open-JHU")
+    etl.metadata_helper.get_existing_data_jhu.return_value = (set(), guppy_last_date)
+    return etl
+
+
+def get_submitted_clinicals(etl):
+    return {
+        call.args[0]["date"]: call.args[0]
+        for call in etl.metadata_helper.add_record_to_submit.call_args_list
+        if call.args[0]["type"] == "summary_clinical"
+    }
+
+
+def test_lagging_file(tmp_path):
+    with patch("utils.local_state_helper.STATE_DIR", str(tmp_path)):
+        # the recovered file does not have data for the last date yet
+        etl = get_test_etl(["1/22/20", "1/23/20"], guppy_last_date="")
+        etl.files_to_submissions()
+        etl.submit_metadata()
+        assert "recovered" not in get_submitted_clinicals(etl)["2020-01-24"]
+
+        # the latest date in Guppy is after the last date of the recovered
+        # file, but the next run processes the dates the recovered file
+        # was missing
+        etl = get_test_etl(["1/22/20", "1/23/20", "1/24/20"], "2020-01-24")
+        etl.files_to_submissions()
+        assert etl.last_date == "2020-01-23"
+        etl.submit_metadata()
+        clinicals = get_submitted_clinicals(etl)
+        assert sorted(clinicals) == ["2020-01-24"]
+        assert clinicals["2020-01-24"]["recovered"] == 3
+        assert clinicals["2020-01-24"]["confirmed"] == 3
+
+
+def test_file_not_found(tmp_path):
+    with patch("utils.local_state_helper.STATE_DIR", str(tmp_path)):
+        etl = get_test_etl(["1/22/20", "1/23/20"], guppy_last_date="")
+        etl.files_to_submissions()
+        etl.submit_metadata()
+        assert etl.local_state.get(LAST_DATE_STATE_KEY) == "2020-01-23"
+
+        # the new dates of the missing file would not be processed by the
+        # next run if the saved date moved
+        etl = get_test_etl(
+            ["1/22/20", "1/23/20", "1/24/20"], "2020-01-24", not_found="deaths_global"
+        )
+        etl.files_to_submissions()
+        etl.submit_metadata()
+        assert etl.incomplete
+        assert etl.local_state.get(LAST_DATE_STATE_KEY) == "2020-01-23"
@@ -0,0 +1,41 @@
+import pytest
+
+from utils.jhu_helper import TimeSeriesParser
+
+
+def test_time_series_parser():
+    headers = ["Province/State", "Country/Region", "1/22/20", "1/23/20", "12/1/21"]
+    rows = [
+        ["", "France", "1", "", "3.0"],
+        [],  # empty rows are ignored
+        ["", "Italy", "4", "5"],  # incomplete row
+    ]
+    parser = TimeSeriesParser(headers, 2)
+    assert parser.dates == ["2020-01-22", "2020-01-23", "2021-12-01"]
+
+    parsed = [
+        (row[1], parser.to_dict(values, missing))
+        for row, values, missing in parser.iter_rows(iter(rows), chunk_size=1)
+    ]
+    assert parsed == [
+        ("France", {"2020-01-22": 1, "2021-12-01": 3}),
+        ("Italy", {"2020-01-22": 4, "2020-01-23": 5}),
+    ]
+    assert all(type(v) == int for _, d in parsed for v in d.values())
+
+
+def test_time_series_parser_invalid_value():
+    parser = TimeSeriesParser(["Country/Region", "1/22/20"], 1)
+    with pytest.raises(ValueError):
+        list(parser.iter_rows(iter([["France", "abc"]])))
+
+
+def test_time_series_parser_after_date():
+    headers = ["Country/Region", "1/22/20", "1/23/20", "1/24/20"]
+    parser = TimeSeriesParser(headers, 1, after_date="2020-01-22")
+    assert parser.dates == ["2020-01-23", "2020-01-24"]
+    _, values, missing = next(parser.iter_rows(iter([["France", "1", "2", "3"]])))
+    assert parser.to_dict(values, missing) == {"2020-01-23": 2, "2020-01-24": 3}
+
+    parser = TimeSeriesParser(headers, 1, after_date="2020-01-24")
+    assert parser.dates == []
@@ -1,9 +1,11 @@
 import csv
+import gzip
+import hashlib
 import json
-from mock import patch
-import pytest
 import os
 
+from botocore.exceptions import ClientError
+
 from etl.jhu_to_s3 import JHU_TO_S3
 from etl.jhu_to_s3_global import JHU_TO_S3_GLOBAL
 from utils.country_codes_utils import get_codes_dictionary, get_codes_for_country_name
@@ -15,16 +17,6 @@ INPUT_DATA_DIR = os.path.join(
 OUTPUT_DATA_DIR = os.path.join(
     os.path.dirname(__file__), "test_data/test_jhu_to_s3_output"
 )
-FILES_TO_DELETE = set()
-
-
-@pytest.fixture(scope="function")
-def clean_up():
-    yield
-    global FILES_TO_DELETE
-    for file in FILES_TO_DELETE:
-        os.remove(file)
-    FILES_TO_DELETE = set()
 
 
 def get_test_etl(etl_class):
@@ -44,10 +36,22 @@ def get_test_etl(etl_class):
 
     class MockS3Client:
         def __init__(self):
-            self.upload_file_calls = []
+            self.objects = {}  # { <s3 path>: <body> }
+            self.put_object_calls = []
 
-        def upload_file(self, abs_path, s3_bucket, s3_path):
-            self.upload_file_calls.append(abs_path)
+        def head_object(self, Bucket, Key):
+            if Key not in self.objects:
+                raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+            return {"ETag": '"{}"'.format(hashlib.md5(self.objects[Key]).hexdigest())}
+
+        def put_object(self, Bucket, Key, Body, ContentType, **kwargs):
+            self.objects[Key] = Body
+            self.put_object_calls.append(Key)
+            assert ContentType == "application/json"
+            assert kwargs["ContentEncoding"] == "gzip"
+
+        def get_json(self, s3_path):
+            return json.loads(gzip.decompress(self.objects[s3_path]))
 
     etl = etl_class("base_url", "access_token", "s3_bucket")
     etl.get = lambda *args, **kwargs: mock_get(args)
@@ -55,7 +59,7 @@ def get_test_etl(etl_class):
     return etl
 
 
-def test_jhu_to_s3_global(clean_up):
+def test_jhu_to_s3_global():
     # check which locations we have data for
     codes_dict = get_codes_dictionary()
     all_locations = {
@@ -91,11 +95,8 @@ def test_jhu_to_s3_global(clean_up):
 
     etl = get_test_etl(JHU_TO_S3_GLOBAL)
 
-    # run the ETL.
-    # do not delete files after uploading, so we can check what's in them
-    with patch("etl.jhu_to_s3.os.remove") as mock_remove:
-        mock_remove.side_effect = lambda f: FILES_TO_DELETE.add(f)
-        etl.files_to_submissions()
+    # run the ETL
+    etl.files_to_submissions()
 
     # check that the ETL generated and uploded data for all the locations we
     # have data for
@@ -104,13 +105,11 @@ def test_jhu_to_s3_global(clean_up):
         "state": set(),
         "county": set(),
     }
-    uploaded_file = ""
-    for uploaded_file in etl.s3_client.upload_file_calls:
+    for uploaded_file in etl.s3_client.put_object_calls:
         parts = uploaded_file.split("/")
         data_level = parts[-2]
         location_id = os.path.splitext(parts[-1])[0]
         uploaded_locations[data_level].add(location_id)
-    uploaded_files_dir = "/".join(uploaded_file.split("/")[:-3])
 
     assert all_locations["country"] == uploaded_locations["country"]
     assert all_locations["state"] == uploaded_locations["state"]
@@ -131,17 +130,13 @@ def test_jhu_to_s3_global(clean_up):
             output_file = file + "_global" if data_level == "county" else file
             with open(os.path.join(dir, output_file)) as f:
                 expected_data = json.loads(f.read())
-            with open(
-                os.path.join(uploaded_files_dir, "time_series", data_level, file)
-            ) as f:
-                uploaded_data = json.loads(f.read())
+            uploaded_data = etl.s3_client.get_json(
+                os.path.join("time_series", data_level, file)
+            )
             assert expected_data == uploaded_data
 
-    # submit the rest of the files.
-    # do not delete files after uploading, so we can check what's in them
-    with patch("etl.jhu_to_s3.os.remove") as mock_remove:
-        mock_remove.side_effect = lambda f: FILES_TO_DELETE.add(f)
-        etl.submit_metadata()
+    # submit the rest of the files
+    etl.submit_metadata()
 
     # check that the ETL generated and uploaded the expected map_data
     dir = os.path.join(OUTPUT_DATA_DIR, "map_data")
@@ -151,12 +146,11 @@ def test_jhu_to_s3_global(clean_up):
         print(f"Checking map_data/{file}")
         with open(os.path.join(dir, file)) as f:
             expected_data = json.loads(f.read())
-        with open(os.path.join(uploaded_files_dir, "map_data", file)) as f:
-            uploaded_data = json.loads(f.read())
+        uploaded_data = etl.s3_client.get_json(os.path.join("map_data", file))
         assert expected_data == uploaded_data
 
 
-def test_jhu_to_s3_illinois(clean_up):
+def test_jhu_to_s3_illinois():
     # check which locations we have data for
     all_illinois_counties = set()
     for filename in [
@@ -176,24 +170,19 @@ def test_jhu_to_s3_illinois(clean_up):
                         fips = str(int(float(row["FIPS"])))
                         all_illinois_counties.add(fips)
 
-    # run the ETL.
-    # do not delete files after uploading, so we can check what's in them
+    # run the ETL
     etl = get_test_etl(JHU_TO_S3)
-    with patch("etl.jhu_to_s3.os.remove") as mock_remove:
-        mock_remove.side_effect = lambda f: FILES_TO_DELETE.add(f)
-        etl.files_to_submissions()
-        etl.submit_metadata()
+    etl.files_to_submissions()
+    etl.submit_metadata()
 
     # check that the ETL generated and uploded data for all the locations we
     # have data for
     uploaded_counties = set()
-    uploaded_file = ""
-    for uploaded_file in etl.s3_client.upload_file_calls:
+    for uploaded_file in etl.s3_client.put_object_calls:
         parts = uploaded_file.split("/")
         location_id = os.path.splitext(parts[-1])[0]
         if not location_id.endswith("_latest"):
             uploaded_counties.add(location_id)
-    uploaded_files_dir = "/".join(uploaded_file.split("/")[:-3])
     assert all_illinois_counties == uploaded_counties
 
     # check that the ETL generated the expected time_series data
@@ -204,8 +193,7 @@ def test_jhu_to_s3_illinois(clean_up):
         print(f"Checking time_series/county/{file}")
         with open(os.path.join(dir, file)) as f:
             expected_data = json.loads(f.read())
-        with open(os.path.join(uploaded_files_dir, "time_series/county", file)) as f:
-            uploaded_data = json.loads(f.read())
+        uploaded_data = etl.s3_client.get_json(os.path.join("time_series/county", file))
         assert expected_data == uploaded_data
 
     # compile the totals from the deprecated `jhu_geojson_latest.json` file to
@@ -242,9 +230,8 @@ def test_jhu_to_s3_illinois(clean_up):
     print(f"Checking map_data/{file}")
     with open(os.path.join(dir, file)) as f:
         expected_data = json.loads(f.read())
-    with open(os.path.join(uploaded_files_dir, "map_data", file)) as f:
-        uploaded_data = json.loads(f.read())
-        uploaded_total = uploaded_data.pop("totals")
+    uploaded_data = etl.s3_client.get_json(os.path.join("map_data", file))
+    uploaded_total = uploaded_data.pop("totals")
     assert expected_data == uploaded_data
     # totals must be compared with a margin to allow for "<5" strings that
     # could represent any real values between 0 and 4
@@ -254,3 +241,8 @@ def test_jhu_to_s3_illinois(clean_up):
             <= uploaded_total[data_type]
             <= expected_totals[data_type] + margin[data_type]
         )
+
+    # unchanged files are not uploaded again
+    etl.s3_client.put_object_calls = []
+    etl.submit_metadata()
+    assert etl.s3_client.put_object_calls == []
@@ -0,0 +1,55 @@
+from mock import patch
+import pytest
+
+from utils.job_runner import JobRunner, get_job_graph
+
+
+def fake_run_job(job_name, base_url, access_token, s3_bucket):
+    with open(s3_bucket, "a") as f:
+        f.write(f"{job_name}\n")
+    if job_name == "IDPH_VACCINE":
+        raise Exception("failed")
+
+
+def test_get_job_graph():
+    graph = get_job_graph(["idph_vaccine_to_s3", "idph_vaccine", "ncbi"])
+    assert graph == {
+        "IDPH_VACCINE_TO_S3": {"IDPH_VACCINE"},
+        "IDPH_VACCINE": set(),
+        # dependencies that are not in the jobs to run are ignored
+        "NCBI": set(),
+    }
+
+
+def test_job_runner(tmp_path):
+    log_path = str(tmp_path / "jobs.log")
+    statuses = JobRunner(
+        ["IDPH_VACCINE_TO_S3", "IDPH_VACCINE", "STOPLIGHT"],
+        "fake_url",
+        "fake_token",
+        log_path,
+        max_workers=2,
+        target=fake_run_job,
+    ).run()
+
+    # the job that depends on a failed job is not run
+    assert statuses == {
+        "IDPH_VACCINE": "failed",
+        "STOPLIGHT": "succeeded",
+        "IDPH_VACCINE_TO_S3": "skipped",
+    }
+    with open(log_path) as f:
+        assert sorted(f.read().split()) == ["IDPH_VACCINE", "STOPLIGHT"]
+
+
+def test_get_job_graph_cycle():
+    class JOB_A:
+        dependencies = ["JOB_B"]
+
+    class JOB_B:
+        dependencies = ["JOB_A"]
+
+    jobs = {"JOB_A": JOB_A, "JOB_B": JOB_B}
+    with patch("utils.job_runner.load_job", jobs.get):
+        with pytest.raises(Exception, match="cycle"):
+            get_job_graph(list(jobs))
@@ -0,0 +1,312 @@
+import json
+import threading
+import time
+
+from mock import patch
+import pytest
+
+from utils.local_state_helper import RecordHashIndex
+from utils.metadata_helper import AdaptiveBatchSize, MetadataHelper, iter_json_array
+
+
+class MockResponse(object):
+    def __init__(self, status_code=200, text=""):
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+def get_test_helper(**kwargs):
+    helper = MetadataHelper("base_url", "program", "project", "access_token", **kwargs)
+    helper.submit_batch_size = 2
+    helper.max_submit_batch_size = 2
+    return helper
+
+
+def test_split_records_by_node_type():
+    helper = get_test_helper()
+    records = [
+        {"type": "summary_location", "submitter_id": "l1"},
+        {"type": "summary_location", "submitter_id": "l2"},
+        {"type": "summary_clinical", "submitter_id": "c1"},
+        {"type": "summary_location", "submitter_id": "l3"},
+    ]
+    groups = helper.split_records_by_node_type(records)
+    assert [
+        (node_type, [r["submitter_id"] for r in group]) for node_type, group in groups
+    ] == [
+        ("summary_location", ["l1", "l2"]),
+        ("summary_clinical", ["c1"]),
+        ("summary_location", ["l3"]),
+    ]
+
+
+def test_adaptive_batch_size():
+    batch_size = AdaptiveBatchSize(initial=100, maximum=200, target_latency=10)
+    batch_size.record_success(100, 1)
+    assert batch_size.value == 150
+    batch_size.record_success(10, 1)  # not a full batch: no change
+    assert batch_size.value == 150
+    batch_size.record_success(150, 1)
+    assert batch_size.value == 200  # capped at the maximum
+    batch_size.record_success(200, 11)  # too slow
+    assert batch_size.value == 100
+    batch_size.record_failure()
+    assert batch_size.value == 50
+
+
+class MockSheepdog(object):
+    """
+    Records the submitted batches. Checks that batches of different node
+    types are never in flight at the same time, unless `allow_mixed_types`.
+    """
+
+    def __init__(self, allow_mixed_types=False):
+        self.allow_mixed_types = allow_mixed_types
+        self.lock = threading.Lock()
+        self.in_flight = []
+        self.max_in_flight = 0
+        self.submitted = []  # [(<node type>, <submitter_ids>), ...]
+
+    def put(self, url, headers, data, timeout):
+        records = json.loads(data)
+        node_type = records[0]["type"]
+        with self.lock:
+            assert self.allow_mixed_types or all(t == node_type for t in self.in_flight)
+            self.in_flight.append(node_type)
+            self.max_in_flight = max(self.max_in_flight, len(self.in_flight))
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight.remove(node_type)
+            self.submitted.append((node_type, [r["submitter_id"] for r in records]))
+        return MockResponse()
+
+
+def test_concurrent_batch_submission():
+    helper = get_test_helper(submit_max_in_flight=3)
+    sheepdog = MockSheepdog()
+
+    for i in range(10):
+        helper.add_record_to_submit({"type": "summary_location", "submitter_id": i})
+    for i in range(10):
+        helper.add_record_to_submit({"type": "summary_clinical", "submitter_id": i})
+
+    with patch.object(helper.session, "put") as put:
+        put.side_effect = sheepdog.put
+        helper.batch_submit_records()
+
+    assert put.call_count == 10
+    assert sheepdog.max_in_flight == 3
+    # all the parent records are submitted before the child records
+    assert [t for t, _ in sheepdog.submitted] == ["summary_location"] * 5 + [
+        "summary_clinical"
+    ] * 5
+    assert helper.records_to_submit == []
+
+
+def test_streaming_submission():
+    helper = get_test_helper(submit_max_in_flight=3)
+    helper.start_streaming(["summary_location", "summary_clinical"])
+    sheepdog = MockSheepdog(allow_mixed_types=True)
+
+    with patch.object(helper.session, "put") as put:
+        put.side_effect = sheepdog.put
+        for i in range(5):
+            helper.add_record_to_submit(
+                {"type": "summary_location", "submitter_id": f"l{i}"}
+            )
+            helper.add_record_to_submit(
+                {"type": "summary_clinical", "submitter_id": f"c{i}"}
+            )
+            # records are submitted as soon as a batch is full
+            assert all(
+                len(buffer) < helper.submit_batch_size
+                for buffer in helper.streaming_buffers.values()
+            )
+        assert put.call_count > 0
+        helper.batch_submit_records()
+
+    assert sorted(i for t, ids in sheepdog.submitted for i in ids) == sorted(
+        [f"l{i}" for i in range(5)] + [f"c{i}" for i in range(5)]
+    )
+    # each child record is submitted after its parent record
+    order = [i for _, ids in sheepdog.submitted for i in ids]
+    for i in range(5):
+        assert order.index(f"l{i}") < order.index(f"c{i}")
+
+
+def test_batch_split_on_server_error():
+    helper = get_test_helper()
+    helper.submit_batch_size = 4
+    helper.max_submit_batch_size = 4
+    submitted_batches = []
+
+    def mock_put(url, headers, data, timeout):
+        records = json.loads(data)
+        if len(records) > 1:
+            return MockResponse(504, "Gateway Timeout")
+        submitted_batches.append(records)
+        return MockResponse()
+
+    for i in range(4):
+        helper.add_record_to_submit({"type": "summary_clinical", "submitter_id": i})
+
+    with patch.object(helper.session, "put") as put, patch(
+        "utils.metadata_helper.time.sleep"
+    ):
+        put.side_effect = mock_put
+        helper.batch_submit_records()
+
+    # the failing batches were split until they could be submitted
+    assert [r[0]["submitter_id"] for r in submitted_batches] == [0, 1, 2, 3]
+    assert helper.get_submit_batch_size("summary_clinical").value < 4
+
+
+def test_record_hash_index(tmp_path):
+    index = RecordHashIndex("open-test", path=str(tmp_path / "state.sqlite"))
+    records = [
+        {"type": "summary_location", "submitter_id": "l1"},
+        {"type": "summary_location", "submitter_id": "l2"},
+        {"type": "summary_clinical", "submitter_id": "l1", "date": "2021-01-01"},
+    ]
+    index.update(records[:2])
+    changed = {"type": "summary_location", "submitter_id": "l2", "code": 1}
+    new = [{"type": "summary_location", "submitter_id": f"n{i}"} for i in range(3)]
+
+    # the hashes are queried by chunks, and by node type: the
+    # summary_clinical record with the same submitter_id is new
+    with patch("utils.local_state_helper.HASH_QUERY_CHUNK_SIZE", 2):
+        assert (
+            index.filter_changed(records + [changed] + new)
+            == [
+                records[2],
+                changed,
+            ]
+            + new
+        )
+
+
+def test_skip_unchanged_records(tmp_path):
+    helper = get_test_helper(skip_unchanged_records=True)
+    helper.record_hash_index = RecordHashIndex(
+        helper.project_id, path=str(tmp_path / "state.sqlite")
+    )
+    records = [
+        {"type": "summary_clinical", "submitter_id": "c1", "date": "2021-01-01"},
+        {"type": "summary_clinical", "submitter_id": "c2", "date": "2021-01-02"},
+    ]
+
+    with patch.object(helper.session, "put") as put:
+        put.return_value = MockResponse()
+        helper.add_records_to_submit(records)
+        helper.batch_submit_records()
+        assert put.call_count == 1
+
+        # identical records (in a different key order) are not submitted
+        # again; new and updated records are
+        helper.add_records_to_submit(
+            [
+                {
+                    "date": "2021-01-01",
+                    "submitter_id": "c1",
+                    "type": "summary_clinical",
+                },
+                {
+                    "type": "summary_clinical",
+                    "submitter_id": "c2",
+                    "date": "2021-02-02",
+                },
+                {
+                    "type": "summary_clinical",
+                    "submitter_id": "c3",
+                    "date": "2021-01-03",
+                },
+            ]
+        )
+        helper.batch_submit_records()
+        assert put.call_count == 2
+        submitted = json.loads(put.call_args[1]["data"])
+        assert [r["submitter_id"] for r in submitted] == ["c2", "c3"]
+
+
+def test_delete_nodes():
+    helper = get_test_helper()
+    ids = {"summary_clinical": [f"c{i}" for i in range(25)], "summary_location": []}
+    deleted = []
+
+    def mock_query_peregrine(query_string):
+        node = query_string.split("(")[0].strip(" {\n")
+        offset = int(query_string.split("offset: ")[1].split(",")[0])
+        page = ids[node][offset : offset + 10]
+        return {"data": {node: [{"id": i} for i in page]}}
+
+    def mock_delete(url, headers):
+        deleted.extend(url.split("/")[-1].split(","))
+        return MockResponse()
+
+    nodes = ["summary_clinical", "summary_location"]
+    with patch("utils.metadata_helper.DELETE_PAGE_SIZE", 10), patch.object(
+        helper, "query_peregrine", side_effect=mock_query_peregrine
+    ), patch.object(helper.session, "delete", side_effect=mock_delete):
+        # dry run: only count
+        assert helper.delete_nodes(nodes, dry_run=True) == {
+            "summary_clinical": 25,
+            "summary_location": 0,
+        }
+        assert deleted == []
+
+        helper.delete_nodes(nodes, batch_size=4)
+    assert sorted(deleted) == sorted(ids["summary_clinical"])
+
+
+def test_iter_json_array():
+    data = [
+        {"submitter_id": f"loc_{i}", "value": i, "nested": {"a": [1, 2]}}
+        for i in range(100)
+    ]
+    text = json.dumps(data, indent=2)
+    for chunk_size in [1, 7, 1000, len(text)]:
+        chunks = (text[i : i + chunk_size] for i in range(0, len(text), chunk_size))
+        assert list(iter_json_array(chunks)) == data
+
+    assert list(iter_json_array(iter(["[", " ]"]))) == []
+    assert list(iter_json_array(iter(["[12", "3, 4]"]))) == [123, 4]
+    with pytest.raises(Exception, match="Incomplete"):
+        list(iter_json_array(iter(['[{"a": 1}, {"b"'])))
+    with pytest.raises(Exception, match="Expected a JSON array"):
+        list(iter_json_array(iter(['{"a": 1}'])))
+
+
+def test_submitter_id_index(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    helper = get_test_helper()
+    guppy_records = [{"submitter_id": "l1"}, {"submitter_id": "l2"}]
+    with patch.object(
+        helper, "stream_from_guppy", return_value=iter(guppy_records)
+    ) as stream:
+        index = helper.get_submitter_id_index("summary_location", path=path)
+        assert stream.call_count == 1
+    assert "l1" in index and "l3" not in index
+
+    # submitted records are added to the index
+    with patch.object(helper.session, "put") as put:
+        put.return_value = MockResponse()
+        helper.add_record_to_submit({"type": "summary_location", "submitter_id": "l3"})
+        helper.batch_submit_records()
+    assert "l3" in index
+
+    # the index is persisted: no need to query Guppy again until it's stale
+    helper = get_test_helper()
+    with patch.object(helper, "stream_from_guppy", return_value=iter([])) as stream:
+        index = helper.get_submitter_id_index("summary_location", path=path)
+        assert stream.call_count == 0
+        assert sorted(index) == ["l1", "l2", "l3"]
+
+    # stale index: refreshed from Guppy
+    helper = get_test_helper()
+    with patch.object(helper, "stream_from_guppy", return_value=iter([])) as stream:
+        index = helper.get_submitter_id_index("summary_location", max_age=-1, path=path)
+        assert stream.call_count == 1
+        assert len(index) == 0
@@ -0,0 +1,49 @@
+import asyncio
+
+from mock import AsyncMock, patch
+import pytest
+
+from etl.ncbi_file import NCBI_FILE, UngroupedFileError
+
+
+def test_parse_row_ungrouped_accession_number(tmp_path):
+    """
+    A split file that was already queued for upload must not be reopened
+    when its accession number appears again later in the data file.
+    """
+    etl = NCBI_FILE("base_url", "access_token", "s3_bucket")
+    etl.upload_queue = AsyncMock()
+
+    async def parse_rows(lines):
+        f, accession_number = None, None
+        found_accession_numbers = set()
+        queued_accession_numbers = set()
+        try:
+            for n_rows, line in enumerate(lines):
+                f, accession_number = await etl.parse_row(
+                    line,
+                    "virus_sequence_blastn",
+                    "tsv",
+                    None,
+                    accession_number,
+                    n_rows,
+                    f,
+                    set(),
+                    found_accession_numbers,
+                    queued_accession_numbers,
+                )
+        finally:
+            if f:
+                f.close()
+
+    with patch("etl.ncbi_file.DATA_PATH", str(tmp_path)):
+        asyncio.run(parse_rows(["SRR1\ta\n", "SRR1\tb\n", "SRR2\tc\n"]))
+        assert (tmp_path / "virus_sequence_blastn_SRR1.tsv").read_text() == (
+            "SRR1\ta\nSRR1\tb\n"
+        )
+
+        with pytest.raises(UngroupedFileError):
+            asyncio.run(parse_rows(["SRR1\ta\n", "SRR2\tb\n", "SRR1\tc\n"]))
+        # the queued file was not overwritten
+        assert (tmp_path / "virus_sequence_blastn_SRR1.tsv").read_text() == "SRR1\ta\n"
+    assert etl.upload_queue.put.await_count == 3
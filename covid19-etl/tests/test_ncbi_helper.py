@@ -0,0 +1,91 @@
+from io import BytesIO
+
+from mock import patch
+import pytest
+
+from utils.ncbi_helper import (
+    ACCESSION_NUMBER_REGEX,
+    AccessionFilenameIndex,
+    ShardWriter,
+    read_accession_manifest,
+    write_accession_manifest,
+)
+
+
+def test_accession_number_regex():
+    line = '{"acc": "SRR11177792", "contig": "NODE_1"}'
+    assert ACCESSION_NUMBER_REGEX.findall(line) == ["SRR11177792"]
+    assert ACCESSION_NUMBER_REGEX.search("no accession number") is None
+
+
+def test_accession_manifest(tmp_path):
+    with patch("utils.local_state_helper.STATE_DIR", str(tmp_path)):
+        key = "contigs/contigs.json"
+        assert read_accession_manifest("bucket", key, '"etag1"') is None
+
+        write_accession_manifest("bucket", key, '"etag1"', {"SRR2", "SRR1"})
+        assert read_accession_manifest("bucket", key, '"etag1"') == ["SRR1", "SRR2"]
+
+        # the file changed since the manifest was written
+        assert read_accession_manifest("bucket", key, '"etag2"') is None
+
+
+def test_shard_writer(tmp_path):
+    rows = [("SRR1", "a"), ("SRR2", "b"), ("SRR3", "c"), ("SRR1", "d"), ("SRR3", "e")]
+    with ShardWriter(
+        str(tmp_path / "shard_{}.csv"), header="h\n", max_open_files=2
+    ) as writer:
+        for key, value in rows:
+            writer.write(key, f"{value}\n")
+            assert len(writer.open_files) <= 2
+
+    # the files closed to make room for other ones were reopened in append
+    # mode when more rows were written to them
+    assert sorted(writer.paths) == ["SRR1", "SRR2", "SRR3"]
+    assert (tmp_path / "shard_SRR1.csv").read_text() == "h\na\nd\n"
+    assert (tmp_path / "shard_SRR2.csv").read_text() == "h\nb\n"
+    assert (tmp_path / "shard_SRR3.csv").read_text() == "h\nc\ne\n"
+
+
+class MockManifestObject:
+    def __init__(self, rows, e_tag):
+        self.body = "".join("\t".join(row) + "\n" for row in rows).encode()
+        self.e_tag = e_tag
+        self.n_reads = 0
+
+    def get(self, IfMatch=None):
+        assert IfMatch == self.e_tag
+        self.n_reads += 1
+        return {"Body": BytesIO(self.body)}
+
+
+def test_accession_filename_index(tmp_path):
+    rows = [
+        ["0", "SRR1.fastq", "x", "x", "x", "sra/SRR1/SRR1.1"],
+        ["1", "no_accession", "x", "x", "x", "sra/none"],
+        ["2", "SRR2.bam", "x", "x", "x", "sra/SRR2"],
+        ["invalid row"],
+    ]
+    path = str(tmp_path / "index.sqlite")
+    s3_object = MockManifestObject(rows, '"etag1"')
+    index = AccessionFilenameIndex("bucket", "key", path=path, s3_object=s3_object)
+    assert s3_object.n_reads == 0  # the index is built on first access
+    assert index["SRR1"] == "SRR1.fastq"
+    assert "SRR2" in index and "SRR3" not in index
+    assert len(index) == 2
+    with pytest.raises(KeyError):
+        index["SRR3"]
+    index.close()
+
+    # the manifest did not change: the index is not built again
+    index = AccessionFilenameIndex("bucket", "key", path=path, s3_object=s3_object)
+    assert index.get("SRR2") == "SRR2.bam"
+    assert s3_object.n_reads == 1
+    index.close()
+
+    # the manifest changed: the index is rebuilt
+    s3_object = MockManifestObject(rows[2:3], '"etag2"')
+    index = AccessionFilenameIndex("bucket", "key", path=path, s3_object=s3_object)
+    assert "SRR1" not in index and index["SRR2"] == "SRR2.bam"
+    assert s3_object.n_reads == 1
+    index.close()
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+from mock import MagicMock, patch
+import pytest
+
+from etl.ncbi_manifest import CHECKPOINT_STATE_KEY, NCBI_MANIFEST
+from utils.local_state_helper import LocalState
+
+
+def get_row(i):
+    return "\t".join(
+        [
+            f"dg.63D5/{i:08d}-0000-0000-0000-000000000000",
+            f"SRR{i}",
+            "100",
+            "0" * 32,
+            "",
+            f"s3://bucket/SRR{i}",
+            "2020-06-04 00:00:00",
+        ]
+    )
+
+
+class MockBody(object):
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+
+    def iter_chunks(self, chunk_size):
+        chunk_size = 50  # small chunks, to split rows between chunks
+        for start in range(0, len(self.data), chunk_size):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise Exception("Connection reset")
+            yield self.data[start : start + chunk_size]
+
+
+class MockS3Object(object):
+    def __init__(self, data, fail_first_request=True):
+        self.data = data
+        self.ranges = []
+        self.e_tag = '"etag"'
+        self.content_length = len(data)
+        self.fail_first_request = fail_first_request
+
+    def get(self, Range, IfMatch):
+        assert IfMatch == '"etag"'
+        start = int(Range.split("=")[1].rstrip("-"))
+        self.ranges.append(start)
+        # the first request fails in the middle of the stream
+        fail = self.fail_first_request and len(self.ranges) == 1
+        return {"Body": MockBody(self.data[start:], 200 if fail else None)}
+
+
+def test_read_ncbi_manifest():
+    data = "\n".join(get_row(i) for i in range(10)).encode("utf-8") + b"\n"
+    s3_object = MockS3Object(data)
+    etl = NCBI_MANIFEST("base_url", "access_token", "s3_bucket")
+
+    with patch.object(etl, "get_manifest_object", return_value=s3_object), patch(
+        "etl.ncbi_manifest.time.sleep"
+    ):
+        rows = list(etl.read_ncbi_manifest("manifest", '"etag"'))
+        # the stream was restarted where it failed, not from the beginning
+        assert len(s3_object.ranges) == 2 and s3_object.ranges[1] > 0
+        assert [row[4] for _, row in rows] == [f"s3://bucket/SRR{i}" for i in range(10)]
+        assert rows[-1][0] == len(data)
+
+        # resume from an offset
+        offset = rows[4][0]
+        resumed = list(etl.read_ncbi_manifest("manifest", '"etag"', offset))
+        assert [row for _, row in resumed] == [row for _, row in rows[5:]]
+
+
+def test_index_manifest_failed_batch(tmp_path):
+    data = "\n".join(get_row(i) for i in range(10)).encode("utf-8") + b"\n"
+    s3_object = MockS3Object(data, fail_first_request=False)
+    etl = NCBI_MANIFEST("base_url", "access_token", "s3_bucket")
+    etl.metadata_helper = MagicMock(project_id="open-ncbi")
+    etl.metadata_helper.query_peregrine.side_effect = Exception("no project")
+    etl.session = MagicMock()
+
+    async def mock_find_by_names(filenames):
+        return {filename: (None,) * 6 for filename in filenames}
+
+    async def mock_index_record(guid, size, filename, url, authz, md5):
+        if filename == "SRR7":  # in the second batch
+            raise Exception("indexd error")
+
+    etl.file_helper.async_find_by_names = mock_find_by_names
+    etl.file_helper.async_index_record = mock_index_record
+
+    with patch("utils.local_state_helper.STATE_DIR", str(tmp_path)), patch.object(
+        etl, "get_manifest_object", return_value=s3_object
+    ), patch("etl.ncbi_manifest.MANIFEST_BATCH_SIZE", 5), patch(
+        "etl.ncbi_manifest.INDEXING_RETRY_DELAY", 0
+    ):
+        with pytest.raises(Exception, match="Unable to create the indexd records"):
+            asyncio.run(etl._index_manifest("manifest"))
+
+        # only the checkpoint of the first batch was saved
+        checkpoint = json.loads(LocalState("open-ncbi").get(CHECKPOINT_STATE_KEY))
+        assert checkpoint["last_guid"].startswith("dg.63D5/00000004")
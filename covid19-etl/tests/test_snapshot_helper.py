@@ -0,0 +1,75 @@
+from mock import MagicMock, patch
+import pytest
+
+from etl.base import StagedETL
+from utils.snapshot_helper import Snapshot
+
+
+class FakeStagedETL(StagedETL):
+    def __init__(self):
+        super().__init__("fake_url", "fake_token", "fake_bucket")
+        self.metadata_helper = MagicMock()
+        self.n_fetches = 0
+        self.n_transforms = 0
+
+    def fetch(self):
+        self.n_fetches += 1
+        self.snapshot.write_file("raw.csv", [b"a,1\n", b"b,2\n"])
+
+    def transform(self, writer):
+        self.n_transforms += 1
+        with self.snapshot.open_file("raw.csv", "r") as f:
+            for line in f:
+                name, value = line.strip().split(",")
+                writer.write({"type": "summary_location", "submitter_id": name})
+                writer.write(
+                    {"type": "summary_clinical", "submitter_id": f"{name}_{value}"}
+                )
+
+
+def test_record_writer(tmp_path):
+    snapshot = Snapshot("test", path=str(tmp_path))
+    with snapshot.record_writer() as writer:
+        writer.write({"type": "b", "submitter_id": "b1"})
+        writer.write({"type": "a", "submitter_id": "a1"})
+        writer.write({"type": "b", "submitter_id": "b2"})
+    assert writer.node_types == ["b", "a"]
+    assert writer.counts == {"b": 2, "a": 1}
+    assert [r["submitter_id"] for r in snapshot.read_records("b")] == ["b1", "b2"]
+
+    # records are not saved if the transform fails
+    with pytest.raises(Exception):
+        with snapshot.record_writer() as writer:
+            writer.write({"type": "c", "submitter_id": "c1"})
+            raise Exception("failed")
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "records_a.jsonl",
+        "records_b.jsonl",
+    ]
+
+
+def test_staged_etl(tmp_path):
+    with patch("utils.local_state_helper.STATE_DIR", str(tmp_path)):
+        etl = FakeStagedETL()
+        etl.files_to_submissions()
+        etl.metadata_helper.batch_submit_records.side_effect = Exception("failed")
+        with pytest.raises(Exception):
+            etl.submit_metadata()
+
+        # the load is retried without fetching and transforming the data again
+        etl = FakeStagedETL()
+        etl.files_to_submissions()
+        assert etl.n_fetches == 0 and etl.n_transforms == 0
+        etl.submit_metadata()
+        etl.metadata_helper.start_streaming.assert_called_once_with(
+            ["summary_location", "summary_clinical"]
+        )
+        submitted = [
+            c.args[0] for c in etl.metadata_helper.add_record_to_submit.call_args_list
+        ]
+        assert [r["submitter_id"] for r in submitted] == ["a", "b", "a_1", "b_2"]
+
+        # the next run fetches new data
+        etl = FakeStagedETL()
+        etl.files_to_submissions()
+        assert etl.n_fetches == 1 and etl.n_transforms == 1
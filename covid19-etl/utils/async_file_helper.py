@@ -1,11 +1,27 @@
-from aiohttp import ClientSession
+import asyncio
+import os
+import time
+
 import requests
 
+from utils.async_session_helper import close_async_session, get_async_session
 
-class AsyncFileHelper:
-    """Asynchronous file helper class"""
 
-    session = None
+# number of indexd lookups in flight at the same time
+MAX_CONCURRENT_INDEXD_REQUESTS = 50
+# delay (in seconds) before retrying a failed indexd lookup
+INDEXD_RETRY_DELAY = 5
+# number of files uploaded at the same time by an AsyncUploadQueue
+UPLOAD_WORKERS = 8
+# number of files waiting to be uploaded before producers are blocked
+UPLOAD_QUEUE_SIZE = 100
+
+
+class AsyncFileHelper:
+    """
+    Asynchronous file helper class. The requests go through the aiohttp
+    session shared by the async helpers (see `utils.async_session_helper`)
+    """
 
     def __init__(self, base_url, program_name, project_code, access_token):
         self.base_url = base_url
@@ -15,14 +31,11 @@ class AsyncFileHelper:
 
     @classmethod
     def get_session(cls):
-        if cls.session is None:
-            cls.session = ClientSession()
-        return cls.session
+        return get_async_session()
 
     @classmethod
     def close_session(cls):
-        if cls.session is not None:
-            return cls.session.close()
+        return close_async_session()
 
     async def async_find_by_name(self, filename):
         """Asynchronous call to fine the indexd record given a filename"""
@@ -45,6 +58,49 @@ class AsyncFileHelper:
                 return did, rev, md5sum, size, filename, authz
             return None, None, None, None, "", None
 
+    async def async_find_by_names(
+        self, filenames, max_concurrency=MAX_CONCURRENT_INDEXD_REQUESTS
+    ):
+        """
+        Finds the indexd records of many filenames concurrently, with at
+        most `max_concurrency` requests in flight, instead of one after the
+        other. Failed lookups are retried until they succeed.
+
+        Args:
+            filenames (iterable(str)): filenames to look up
+            max_concurrency (int): maximum number of requests in flight
+
+        Returns:
+            dict: { <filename>: (did, rev, md5sum, size, filename, authz) }
+            as returned by `async_find_by_name`. The values are
+            (None, None, None, None, "", None) for files that are not in
+            indexd
+        """
+
+        async def _find(filename):
+            while True:
+                try:
+                    return await self.async_find_by_name(filename)
+                except Exception as e:
+                    print(
+                        f"ERROR: Fail to query indexd for {filename}. Detail {e}. Retrying..."
+                    )
+                    await asyncio.sleep(INDEXD_RETRY_DELAY)
+
+        # `max_concurrency` workers consume the filenames, instead of one
+        # task per filename, so memory does not grow with the number of files
+        filenames = list(dict.fromkeys(filenames))  # deduplicate, keep order
+        remaining = iter(filenames)
+        records = {}
+
+        async def _worker():
+            for filename in remaining:
+                records[filename] = await _find(filename)
+
+        n_workers = min(max_concurrency, len(filenames))
+        await asyncio.gather(*(_worker() for _ in range(n_workers)))
+        return {filename: records[filename] for filename in filenames}
+
     async def async_update_authz(self, did, rev):
         """Asynchronous update authz field for did"""
 
@@ -80,9 +136,9 @@ class AsyncFileHelper:
 
         async def _async_upload_file(path, url):
             with open(path, "rb") as data:
-                async with ClientSession() as session:
-                    async with session.put(url, data=data) as r:
-                        return r.status
+                session = AsyncFileHelper.get_session()
+                async with session.put(url, data=data) as r:
+                    return r.status
 
         basename = path.name
         presigned_url, guid = await self.async_get_presigned_url(basename)
@@ -109,3 +165,101 @@ class AsyncFileHelper:
             headers=self.headers,
         ) as r:
             r.raise_for_status()
+
+
+class AsyncUploadQueue:
+    """
+    Producer/consumer pipeline to upload files while they are produced:
+    producers `put` the paths of finished files in a queue, and
+    `n_workers` workers upload them concurrently with the `upload`
+    coroutine function. When `max_size` files are waiting, `put` blocks
+    until a worker is available, so producers can't get too far ahead.
+
+    Usage:
+        queue = AsyncUploadQueue(upload)
+        queue.start()
+        await queue.put(path)
+        ...
+        await queue.close()  # waits for the uploads and prints a summary
+
+    `close` must be called even if producing the files fails, to stop the
+    workers.
+
+    Args:
+        upload (coroutine function): called with each path
+        n_workers (int): number of files uploaded at the same time
+        max_size (int): number of files waiting before `put` blocks
+    """
+
+    def __init__(self, upload, n_workers=UPLOAD_WORKERS, max_size=UPLOAD_QUEUE_SIZE):
+        self.upload = upload
+        self.n_workers = n_workers
+        self.max_size = max_size
+        self.queue = None
+        self.workers = []
+        self.error = None
+        self.n_uploaded = 0
+        self.uploaded_bytes = 0
+        self.start_time = None
+
+    def start(self):
+        # the queue must be created in the running event loop
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.workers = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.n_workers)
+        ]
+        self.start_time = time.time()
+
+    async def put(self, path):
+        if self.error:
+            raise self.error
+        await self.queue.put(path)
+
+    async def join(self):
+        """
+        Waits for all the files queued so far to be uploaded, for example
+        before writing the same files again. Raises the first upload error.
+        """
+        await self.queue.join()
+        if self.error:
+            raise self.error
+
+    async def _worker(self):
+        while True:
+            path = await self.queue.get()
+            try:
+                if path is None:  # no more files
+                    return
+                if self.error:
+                    continue  # drain the queue
+                # get the size first: `upload` may remove the file
+                size = os.path.getsize(path)
+                await self.upload(path)
+                self.n_uploaded += 1
+                self.uploaded_bytes += size
+            except Exception as e:
+                print(f"ERROR: Fail to upload {path}. Detail {e}")
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    async def close(self):
+        """
+        Waits for all the queued files to be uploaded, stops the workers
+        and prints the upload throughput. Raises the first upload error.
+        """
+        for _ in self.workers:
+            await self.queue.put(None)
+        await asyncio.gather(*self.workers)
+        duration = time.time() - self.start_time
+        print(
+            "Uploaded {} files ({:.1f} MB) in {:.2f}s ({:.2f} MB/s, {:.1f} files/s)".format(
+                self.n_uploaded,
+                self.uploaded_bytes / 1024 / 1024,
+                duration,
+                self.uploaded_bytes / 1024 / 1024 / max(duration, 0.001),
+                self.n_uploaded / max(duration, 0.001),
+            )
+        )
+        if self.error:
+            raise self.error
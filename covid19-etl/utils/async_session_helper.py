@@ -0,0 +1,92 @@
+from contextlib import asynccontextmanager
+
+
+# maximum number of connections open at the same time, in total and per host
+AIOHTTP_LIMIT = 100
+AIOHTTP_LIMIT_PER_HOST = 50
+# time (in seconds) DNS resolutions are cached for
+AIOHTTP_DNS_CACHE_TTL = 300
+# time (in seconds) idle connections are kept alive for reuse
+AIOHTTP_KEEPALIVE_TIMEOUT = 30
+
+# aiohttp session shared by all the async helpers
+_session = None
+
+
+def create_async_session(
+    limit=AIOHTTP_LIMIT,
+    limit_per_host=AIOHTTP_LIMIT_PER_HOST,
+    dns_cache_ttl=AIOHTTP_DNS_CACHE_TTL,
+    keepalive_timeout=AIOHTTP_KEEPALIVE_TIMEOUT,
+):
+    """
+    Returns an `aiohttp.ClientSession` whose connections are kept alive and
+    reused across requests, with DNS caching. The number of connections is
+    limited, so high-concurrency runs queue their requests instead of
+    exhausting sockets. Must be called from a coroutine.
+
+    Args:
+        limit (int): maximum number of connections in total
+        limit_per_host (int): maximum number of connections per host
+        dns_cache_ttl (int): time (in seconds) DNS resolutions are cached for
+        keepalive_timeout (int): time (in seconds) idle connections are kept
+            alive for
+
+    Returns:
+        aiohttp.ClientSession
+    """
+    # imported on first use: most jobs import this module (through
+    # `MetadataHelper`) but never open an async session
+    from aiohttp import ClientSession, TCPConnector
+
+    connector = TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=dns_cache_ttl,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return ClientSession(connector=connector)
+
+
+def get_async_session():
+    """
+    Returns the shared session, created with the default limits if it is not
+    open yet. Must be called from a coroutine.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = create_async_session()
+    return _session
+
+
+async def close_async_session():
+    global _session
+    if _session is not None:
+        session = _session
+        _session = None
+        await session.close()
+
+
+@asynccontextmanager
+async def shared_async_session(**kwargs):
+    """
+    Opens the session shared by the async helpers for the duration of the
+    context, and closes it at the end:
+
+        async with shared_async_session():
+            ...
+
+    Args:
+        kwargs: arguments of `create_async_session`
+
+    Yields:
+        aiohttp.ClientSession
+    """
+    global _session
+    await close_async_session()
+    _session = create_async_session(**kwargs)
+    try:
+        yield _session
+    finally:
+        await close_async_session()
@@ -0,0 +1,113 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+
+# number of keys queried by each BigQuery job
+BIGQUERY_CHUNK_SIZE = 5000
+# number of BigQuery jobs running at the same time
+BIGQUERY_MAX_CONCURRENT_JOBS = 4
+
+
+class BigQueryFetcher:
+    """
+    Fetches the rows of a BigQuery table that match a list of keys. The keys
+    are passed to a parameterized `<key column> IN UNNEST(@keys)` query, by
+    chunks of `chunk_size` keys, and up to `max_concurrent_jobs` chunks are
+    queried at the same time. Only the requested columns that exist in the
+    table are selected.
+
+    Args:
+        table (str): "<project>.<dataset>.<table>"
+        columns (list(str)): columns to select
+        key_column (str): column to match the keys against
+        where (str): additional SQL condition, such as 'consent = "public"'
+        client (bigquery.Client): BigQuery client (default: a new
+            `bigquery.Client`)
+        chunk_size (int): number of keys per query
+        max_concurrent_jobs (int): number of queries running at the same time
+    """
+
+    def __init__(
+        self,
+        table,
+        columns,
+        key_column,
+        where=None,
+        client=None,
+        chunk_size=BIGQUERY_CHUNK_SIZE,
+        max_concurrent_jobs=BIGQUERY_MAX_CONCURRENT_JOBS,
+    ):
+        self.table = table
+        self.columns = columns
+        self.key_column = key_column
+        self.where = where
+        # imported when a fetcher is created rather than with this module:
+        # google-cloud-bigquery is slow to import
+        from google.cloud import bigquery
+
+        self.bigquery = bigquery
+        self.client = client or bigquery.Client()
+        self.chunk_size = chunk_size
+        self.max_concurrent_jobs = max_concurrent_jobs
+
+    def get_query(self):
+        """
+        Returns the parameterized SQL query. The columns that do not exist
+        in the table are not selected.
+        """
+        table_columns = set(
+            field.name for field in self.client.get_table(self.table).schema
+        )
+        missing = [c for c in self.columns if c not in table_columns]
+        if missing:
+            print(f"WARNING: columns {missing} are not in table {self.table}")
+        columns = [self.key_column] + [
+            c for c in self.columns if c in table_columns and c != self.key_column
+        ]
+        conditions = [f"{self.key_column} IN UNNEST(@keys)"]
+        if self.where:
+            conditions.insert(0, self.where)
+        return "SELECT {} FROM `{}` WHERE {}".format(
+            ", ".join(columns), self.table, " AND ".join(conditions)
+        )
+
+    def query_chunk(self, query, keys):
+        job_config = self.bigquery.QueryJobConfig(
+            query_parameters=[self.bigquery.ArrayQueryParameter("keys", "STRING", keys)]
+        )
+        start = time.time()
+        rows = [
+            dict(row)
+            for row in self.client.query(query, job_config=job_config).result()
+        ]
+        print(
+            "  BigQuery: {} rows for {} keys in {:.2f}s".format(
+                len(rows), len(keys), time.time() - start
+            )
+        )
+        return rows
+
+    def fetch(self, keys):
+        """
+        Args:
+            keys (list(str)): keys to query
+
+        Yields:
+            dict: the rows that match the keys, chunk by chunk in the order
+            of the keys. Only `max_concurrent_jobs` chunks are fetched ahead
+            of the consumer, which bounds memory usage
+        """
+        query = self.get_query()
+        chunks = (
+            keys[start : start + self.chunk_size]
+            for start in range(0, len(keys), self.chunk_size)
+        )
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_jobs) as executor:
+            in_flight = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(self.query_chunk, query, chunk))
+                if len(in_flight) >= self.max_concurrent_jobs:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
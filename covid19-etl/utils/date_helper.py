@@ -0,0 +1,61 @@
+"""
+Date parsing shared by the ETLs. The same few thousand date strings are
+parsed over and over (once per location or once per row), so the parsing
+results are cached.
+"""
+
+
+from functools import lru_cache
+import datetime
+
+
+# maximum number of results cached by each parsing function
+DATE_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date_str, fmt):
+    """
+    Cached version of `datetime.datetime.strptime`. The returned object is
+    shared between callers, which is fine since datetimes are immutable.
+    """
+    return datetime.datetime.strptime(date_str, fmt)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date_with_formats(date_str, formats):
+    """
+    Args:
+        date_str (str): date to parse
+        formats (tuple(str)): formats to try
+
+    Returns:
+        datetime.datetime: the date parsed with the last format that
+        matches, or None if no format matches
+    """
+    parsed_date = None
+    for fmt in formats:
+        try:
+            parsed_date = datetime.datetime.strptime(date_str, fmt)
+        except ValueError:
+            pass
+    return parsed_date
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def get_unified_date_format(date):
+    """
+    Converts a "<month>/<day>/<year>" date, where the month and day may
+    not be zero-padded and the year may only have 2 digits, to "%Y-%m-%d".
+    """
+    month, day, year = date.split("/")
+
+    # format all the dates the same way
+    if len(year) == 2:
+        year = "20{}".format(year)
+    if len(month) == 1:
+        month = "0{}".format(month)
+    if len(day) == 1:
+        day = "0{}".format(day)
+
+    return "-".join((year, month, day))
@@ -1,10 +1,12 @@
 import requests
 
+from utils.session_helper import create_session
 
-def upload_file(path, url):
+
+def upload_file(path, url, session=None):
     with open(path, "rb") as data:
         try:
-            r = requests.put(url, data=data)
+            r = (session or requests).put(url, data=data)
             r.raise_for_status()
         except requests.exceptions.HTTPError as err:
             print(err)
@@ -13,15 +15,18 @@ def upload_file(path, url):
 
 
 class FileHelper:
-    def __init__(self, base_url, program_name, project_code, access_token):
+    def __init__(
+        self, base_url, program_name, project_code, access_token, session=None
+    ):
         self.base_url = base_url
         self.program_name = program_name
         self.project_code = project_code
         self.headers = {"Authorization": f"Bearer {access_token}"}
+        self.session = session or create_session()
 
     def find_by_name(self, filename):
         url = f"{self.base_url}/index/index?file_name={filename}"
-        r = requests.get(url)
+        r = self.session.get(url)
         data = r.json()
         if data["records"]:
             assert (
@@ -41,7 +46,7 @@ class FileHelper:
             "uploader": None,
         }
         try:
-            r = requests.put(url, json=body_json, headers=self.headers)
+            r = self.session.put(url, json=body_json, headers=self.headers)
             r.raise_for_status()
         except requests.exceptions.HTTPError as err:
             print(err)
@@ -49,14 +54,14 @@ class FileHelper:
     def get_presigned_url(self, filename):
         upload_url = f"{self.base_url}/user/data/upload"
         body_json = {"file_name": filename}
-        r = requests.post(upload_url, json=body_json, headers=self.headers)
+        r = self.session.post(upload_url, json=body_json, headers=self.headers)
         data = r.json()
         return data["url"], data["guid"]
 
     def upload_file(self, path):
         basename = path.name
         presigned_url, guid = self.get_presigned_url(basename)
-        upload_status = upload_file(path, presigned_url)
+        upload_status = upload_file(path, presigned_url, self.session)
         if upload_status == requests.codes.ok:
             return guid
         return None
@@ -1,6 +1,8 @@
 import datetime
 import re
 
+from utils.date_helper import parse_date
+
 
 def format_submitter_id(node, args):
     """
@@ -61,7 +63,7 @@ def idph_get_date(date_json):
 def check_date_format(date):
     # will throw an error if the date format is not as expected
     # (international date format)
-    datetime.datetime.strptime(date, "%Y-%m-%d")
+    parse_date(date, "%Y-%m-%d")
 
 
 def remove_time_from_date_time(str_datetime):
@@ -88,6 +90,4 @@ def get_date_from_str(date_str):
     """
     Receives a date string in %Y-%m-%d format and returns a 'datetime.date' object
     """
-    return datetime.datetime.strptime(
-        remove_time_from_date_time(date_str), "%Y-%m-%d"
-    ).date()
+    return parse_date(remove_time_from_date_time(date_str), "%Y-%m-%d").date()
@@ -0,0 +1,129 @@
+"""
+Parsing of the JHU time series CSV files. In these files, each row is a
+location and each column after the location columns is a date, in the
+same order for every row.
+"""
+
+
+import numpy as np
+
+from utils.date_helper import get_unified_date_format
+
+
+# number of rows parsed at once. Bounds the memory used by the raw strings
+# of the rows being parsed
+PARSE_CHUNK_SIZE = 500
+
+
+class TimeSeriesParser:
+    """
+    Parses the date columns of a JHU time series CSV file. The header dates
+    are converted once for the whole file, and the values of a chunk of
+    rows are converted to integers in a single NumPy operation instead of
+    one `int(float(...))` call per cell.
+
+    If `after_date` is set, only the date columns after this date are
+    parsed. The dates in the headers are assumed to be sorted.
+
+    Args:
+        headers (list(str)): CSV file headers (first row of the file)
+        dates_start (int): index of the first date column
+        after_date (str): only parse the dates after this date, in
+            "%Y-%m-%d" format
+    """
+
+    def __init__(self, headers, dates_start, after_date=None):
+        self.headers = headers
+        dates = [get_unified_date_format(h) for h in headers[dates_start:]]
+        skipped = 0
+        if after_date:
+            while skipped < len(dates) and dates[skipped] <= after_date:
+                skipped += 1
+        self.dates_start = dates_start + skipped
+        self.dates = dates[skipped:]
+
+    def parse_values(self, rows):
+        """
+        Args:
+            rows (list(list(str))): rows of data
+
+        Returns:
+            (np.ndarray, np.ndarray) tuple:
+                - int array of shape (<number of rows>, <number of dates>)
+                - bool array of the same shape, True where the value is empty
+        """
+        n_dates = len(self.dates)
+        cells = []
+        for row in rows:
+            row_cells = row[self.dates_start : self.dates_start + n_dates]
+            # pad incomplete rows with empty values
+            row_cells += [""] * (n_dates - len(row_cells))
+            cells.extend(row_cells)
+        try:
+            # empty values are parsed as NaN
+            values = np.array([c or "nan" for c in cells], dtype=float).reshape(
+                len(rows), n_dates
+            )
+            missing = np.isnan(values)
+            values[missing] = 0
+            return values.astype(np.int64), missing
+        except ValueError:
+            # find the culprit to show a helpful error
+            for row in rows:
+                for i, value in enumerate(row[self.dates_start :]):
+                    try:
+                        float(value or 0)
+                    except ValueError:
+                        print(
+                            'Unable to convert {} to int for "{}" at {}'.format(
+                                value, row[: self.dates_start], self.dates[i]
+                            )
+                        )
+            raise
+
+    def iter_rows(self, reader, chunk_size=PARSE_CHUNK_SIZE):
+        """
+        Parses the rows of a CSV reader by chunks. Empty rows are ignored.
+
+        Args:
+            reader (iterator): CSV reader, after the headers
+            chunk_size (int): number of rows parsed at once
+
+        Yields:
+            (list(str), np.ndarray, np.ndarray) tuple for each row: the row
+            itself, and the row's slices of the arrays returned by
+            `parse_values`
+        """
+        chunk = []
+        for row in reader:
+            if not row:  # ignore empty rows
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield from self._iter_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._iter_chunk(chunk)
+
+    def _iter_chunk(self, rows):
+        values, missing = self.parse_values(rows)
+        for i, row in enumerate(rows):
+            yield row, values[i], missing[i]
+
+    def to_dict(self, values, missing):
+        """
+        Args:
+            values (np.ndarray): a row's values, as yielded by `iter_rows`
+            missing (np.ndarray): a row's missing values mask
+
+        Returns:
+            (dict): { "date1": <value>, "date2": <value> }, ignoring the
+            empty values. Values are Python ints
+        """
+        return {
+            date: value
+            for date, value, is_missing in zip(
+                self.dates, values.tolist(), missing.tolist()
+            )
+            if not is_missing
+        }
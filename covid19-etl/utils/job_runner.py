@@ -0,0 +1,142 @@
+"""
+Runs a set of ETL jobs in parallel. Each ETL class lists the jobs that
+must complete before it runs in its `dependencies` attribute; a job is
+started as soon as all its dependencies in the set succeeded, so the
+whole set takes about as long as its longest chain of dependencies.
+
+Each job runs in its own process: the ETLs keep state at the process
+level (event loops, async sessions), so processes are not reused between
+jobs. The jobs share the same access token and the same local state (see
+`utils.local_state_helper`).
+"""
+
+
+import multiprocessing
+from multiprocessing.connection import wait
+import time
+
+from etl import load_job
+
+
+# number of jobs running at the same time
+JOB_RUNNER_MAX_WORKERS = 4
+
+
+def run_job(job_name, base_url, access_token, s3_bucket):
+    etl = load_job(job_name)
+    job = etl(base_url, access_token, s3_bucket)
+    job.files_to_submissions()
+    job.submit_metadata()
+
+
+def get_job_graph(job_names):
+    """
+    Returns { <job name>: <set of the names of the jobs it depends on> }.
+    Dependencies that are not in `job_names` are ignored: they are assumed
+    to have run already.
+
+    Raises an exception if the dependencies contain a cycle.
+    """
+    job_names = [name.upper() for name in job_names]
+    graph = {}
+    for job_name in job_names:
+        dependencies = set(d.upper() for d in load_job(job_name).dependencies)
+        for dependency in sorted(dependencies - set(job_names)):
+            print(
+                f"{job_name} depends on {dependency}, which is not in the jobs to run"
+            )
+        graph[job_name] = dependencies & set(job_names)
+
+    # check that the jobs can be sorted (Kahn's algorithm)
+    remaining = {name: set(dependencies) for name, dependencies in graph.items()}
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise Exception(
+                f"The dependencies of jobs {sorted(remaining)} contain a cycle"
+            )
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+    return graph
+
+
+class JobRunner:
+    """
+    Runs a set of ETL jobs, up to `max_workers` at the same time, in the
+    order of their dependencies. If a job fails, the jobs that depend on it
+    are skipped, and the other jobs still run.
+
+    Args:
+        job_names (list(str)): names of the jobs to run
+        base_url (str): base URL of the Gen3 commons
+        access_token (str): access token used by all the jobs
+        s3_bucket (str): bucket used by the jobs that push data to S3
+        max_workers (int): number of jobs running at the same time
+        target (function): function run for each job, with the same
+            arguments as `run_job`
+    """
+
+    def __init__(
+        self,
+        job_names,
+        base_url,
+        access_token,
+        s3_bucket,
+        max_workers=JOB_RUNNER_MAX_WORKERS,
+        target=run_job,
+    ):
+        self.graph = get_job_graph(job_names)
+        self.base_url = base_url
+        self.access_token = access_token
+        self.s3_bucket = s3_bucket
+        self.max_workers = max_workers
+        self.target = target
+
+    def run(self):
+        """
+        Returns { <job name>: <status> }, where status is one of
+        ["succeeded", "failed", "skipped"].
+        """
+        start = time.time()
+        statuses = {}
+        pending = dict(self.graph)
+        running = {}  # { <process sentinel>: (<job name>, <process>, <start>) }
+        while pending or running:
+            for job_name, dependencies in list(pending.items()):
+                if any(statuses.get(d) in ["failed", "skipped"] for d in dependencies):
+                    print(f"Skipping {job_name}: a job it depends on did not succeed")
+                    statuses[job_name] = "skipped"
+                    del pending[job_name]
+                elif (
+                    all(statuses.get(d) == "succeeded" for d in dependencies)
+                    and len(running) < self.max_workers
+                ):
+                    print(f"Starting {job_name}")
+                    process = multiprocessing.Process(
+                        target=self.target,
+                        args=(
+                            job_name,
+                            self.base_url,
+                            self.access_token,
+                            self.s3_bucket,
+                        ),
+                        name=job_name,
+                    )
+                    process.start()
+                    running[process.sentinel] = (job_name, process, time.time())
+                    del pending[job_name]
+            if not running:
+                continue
+            for sentinel in wait(list(running)):
+                job_name, process, job_start = running.pop(sentinel)
+                process.join()
+                statuses[job_name] = "succeeded" if process.exitcode == 0 else "failed"
+                print(
+                    "{} {} in {} secs".format(
+                        job_name, statuses[job_name], int(time.time() - job_start)
+                    )
+                )
+        print(f"Ran {len(statuses)} jobs in {int(time.time() - start)} secs")
+        return statuses
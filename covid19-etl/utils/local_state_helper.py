@@ -0,0 +1,264 @@
+"""
+State persisted on the local disk between ETL runs. The files are stored in
+the folder set by the `ETL_STATE_DIR` environment variable (by default
+`~/.covid19-etl`). If the folder is not persisted between runs, the ETLs
+still work; they just can't skip the work they already did.
+"""
+
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+STATE_DIR = os.environ.get(
+    "ETL_STATE_DIR", os.path.join(os.path.expanduser("~"), ".covid19-etl")
+)
+STATE_DB_FILENAME = "etl_state.sqlite"
+# time (in seconds) to wait for the database to be unlocked, when ETLs
+# running in parallel write to it at the same time
+STATE_DB_TIMEOUT = 60
+# number of submitter_ids whose record hashes are queried at once. Stays
+# under the default SQLite limit of 999 variables per query
+HASH_QUERY_CHUNK_SIZE = 500
+
+
+def get_state_path(filename):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, filename)
+
+
+def connect_state_db(path=None):
+    return sqlite3.connect(
+        path or get_state_path(STATE_DB_FILENAME), timeout=STATE_DB_TIMEOUT
+    )
+
+
+def get_record_hash(record):
+    """
+    Returns a hash of a Sheepdog record that does not depend on the order
+    of the keys in the record.
+    """
+    serialized = json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+class RecordHashIndex:
+    """
+    Hashes of the records submitted to Sheepdog for a project, stored in a
+    local SQLite database. Used to skip records that are identical to the
+    ones submitted by a previous run.
+
+    Note: if records are deleted or updated in Sheepdog outside of the ETL,
+    the index must be cleared (delete the database file) so the records are
+    submitted again.
+    """
+
+    def __init__(self, project_id, path=None):
+        self.project_id = project_id
+        self.connection = connect_state_db(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS record_hash (
+                project_id TEXT,
+                node_type TEXT,
+                submitter_id TEXT,
+                hash TEXT,
+                PRIMARY KEY (project_id, node_type, submitter_id)
+            )"""
+        )
+        self.connection.commit()
+
+    def get_hashes(self, node_type, submitter_ids):
+        """
+        Returns { <submitter_id>: <hash> } for the specified records that
+        were already submitted. The hashes are queried by chunks of
+        `HASH_QUERY_CHUNK_SIZE` submitter_ids instead of one at a time.
+        """
+        submitter_ids = list(submitter_ids)
+        hashes = {}
+        for start in range(0, len(submitter_ids), HASH_QUERY_CHUNK_SIZE):
+            chunk = submitter_ids[start : start + HASH_QUERY_CHUNK_SIZE]
+            hashes.update(
+                self.connection.execute(
+                    "SELECT submitter_id, hash FROM record_hash WHERE project_id = ? AND node_type = ? AND submitter_id IN ({})".format(
+                        ", ".join("?" * len(chunk))
+                    ),
+                    [self.project_id, node_type] + chunk,
+                )
+            )
+        return hashes
+
+    def filter_changed(self, records):
+        """
+        Returns the records that are new or that changed since they were
+        last submitted.
+        """
+        submitter_ids_by_type = {}
+        for record in records:
+            submitter_ids_by_type.setdefault(record.get("type"), set()).add(
+                record.get("submitter_id")
+            )
+        hashes = {
+            node_type: self.get_hashes(node_type, submitter_ids)
+            for node_type, submitter_ids in submitter_ids_by_type.items()
+        }
+        return [
+            record
+            for record in records
+            if hashes[record.get("type")].get(record.get("submitter_id"))
+            != get_record_hash(record)
+        ]
+
+    def update(self, records):
+        """
+        Stores the hashes of records that were successfully submitted.
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO record_hash VALUES (?, ?, ?, ?)",
+            [
+                (
+                    self.project_id,
+                    record.get("type"),
+                    record.get("submitter_id"),
+                    get_record_hash(record),
+                )
+                for record in records
+            ],
+        )
+        self.connection.commit()
+
+
+class LocalState:
+    """
+    Key/value state of an ETL for a project, stored in a local SQLite
+    database. For example, the last date processed by the ETL.
+    """
+
+    def __init__(self, project_id, path=None):
+        self.project_id = project_id
+        self.connection = connect_state_db(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS etl_state (
+                project_id TEXT,
+                key TEXT,
+                value TEXT,
+                PRIMARY KEY (project_id, key)
+            )"""
+        )
+        self.connection.commit()
+
+    def get(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM etl_state WHERE project_id = ? AND key = ?",
+            (self.project_id, key),
+        ).fetchone()
+        return row[0] if row else default
+
+    def set(self, key, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO etl_state VALUES (?, ?, ?)",
+            (self.project_id, key, value),
+        )
+        self.connection.commit()
+
+
+class SubmitterIdIndex:
+    """
+    Set of the submitter_ids of the existing records of a node type in a
+    project, kept in memory for O(1) membership checks and stored in a
+    local SQLite database between runs. The index is refreshed from the
+    source of truth (Guppy) only when it is stale, and submitter_ids are
+    added to it as records are submitted.
+
+    Note: if records are deleted from Sheepdog outside of the ETL, the index
+    must be cleared (delete the database file) so the records are submitted
+    again.
+    """
+
+    def __init__(self, project_id, node_type, path=None):
+        self.project_id = project_id
+        self.node_type = node_type
+        self.connection = connect_state_db(path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS submitter_id (
+                project_id TEXT,
+                node_type TEXT,
+                submitter_id TEXT,
+                PRIMARY KEY (project_id, node_type, submitter_id)
+            )"""
+        )
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS submitter_id_refresh (
+                project_id TEXT,
+                node_type TEXT,
+                refreshed_at REAL,
+                PRIMARY KEY (project_id, node_type)
+            )"""
+        )
+        self.connection.commit()
+        self.submitter_ids = set(
+            row[0]
+            for row in self.connection.execute(
+                "SELECT submitter_id FROM submitter_id WHERE project_id = ? AND node_type = ?",
+                (self.project_id, self.node_type),
+            )
+        )
+
+    def __contains__(self, submitter_id):
+        return submitter_id in self.submitter_ids
+
+    def __iter__(self):
+        return iter(self.submitter_ids)
+
+    def __len__(self):
+        return len(self.submitter_ids)
+
+    def is_stale(self, max_age):
+        """
+        Returns True if the index was never refreshed, or was last refreshed
+        more than `max_age` seconds ago.
+        """
+        row = self.connection.execute(
+            "SELECT refreshed_at FROM submitter_id_refresh WHERE project_id = ? AND node_type = ?",
+            (self.project_id, self.node_type),
+        ).fetchone()
+        return row is None or time.time() - row[0] > max_age
+
+    def refresh(self, submitter_ids):
+        """
+        Replaces the content of the index with the specified submitter_ids.
+        """
+        self.submitter_ids = set(submitter_ids)
+        self.connection.execute(
+            "DELETE FROM submitter_id WHERE project_id = ? AND node_type = ?",
+            (self.project_id, self.node_type),
+        )
+        self._insert(self.submitter_ids)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO submitter_id_refresh VALUES (?, ?, ?)",
+            (self.project_id, self.node_type, time.time()),
+        )
+        self.connection.commit()
+
+    def add(self, submitter_ids):
+        """
+        Adds submitter_ids to the index, for example the ones of records
+        that were just submitted.
+        """
+        new_ids = set(submitter_ids) - self.submitter_ids
+        if not new_ids:
+            return
+        self.submitter_ids.update(new_ids)
+        self._insert(new_ids)
+        self.connection.commit()
+
+    def _insert(self, submitter_ids):
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO submitter_id VALUES (?, ?, ?)",
+            [
+                (self.project_id, self.node_type, submitter_id)
+                for submitter_id in submitter_ids
+            ],
+        )
@@ -1,50 +1,285 @@
-from aiohttp import ClientSession
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait,
+)
+import codecs
 import datetime
 import json
-from math import ceil
-from time import sleep
+import random
+import threading
+import time
 from dateutil.parser import parse
 
 import requests
 
+from utils.async_session_helper import get_async_session
+from utils.local_state_helper import RecordHashIndex, SubmitterIdIndex
+from utils.session_helper import create_session
+
 MAX_RETRIES = 5
 
+# Sheepdog requests that take longer than this (in seconds) are considered
+# timed out
+SUBMIT_TIMEOUT = 300
+# batches submitted faster than this (in seconds) can be made bigger;
+# batches submitted slower than this are made smaller
+SUBMIT_TARGET_LATENCY = 30
+MAX_SUBMIT_BATCH_SIZE = 1000
+
+# the local index of existing submitter_ids is downloaded from Guppy again
+# when it is older than this (in seconds). In between, the submitted
+# records are added to it
+SUBMITTER_ID_INDEX_MAX_AGE = 7 * 24 * 3600
+# Guppy index containing the submitter_ids of each node type
+GUPPY_INDEX_TYPES = {"summary_location": "location"}
+
+# size (in bytes) of the chunks read from streamed Guppy downloads
+GUPPY_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# number of ids queried from Peregrine at once when listing the records
+# to delete
+DELETE_PAGE_SIZE = 1000
+# number of ids deleted per Sheepdog request, and number of requests sent
+# at the same time
+DELETE_BATCH_SIZE = 200
+DELETE_MAX_WORKERS = 8
+
+
+def get_backoff_delay(tries, base=1, cap=60):
+    """
+    Exponential backoff with full jitter: a random delay between 0 and
+    `base * 2^tries` seconds, capped at `cap` seconds. The jitter prevents
+    concurrent retries from hitting the server at the same time.
+    """
+    return random.uniform(0, min(cap, base * 2**tries))
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally decodes a JSON array, so that its items can be processed
+    while it is downloaded, without holding the whole array in memory.
+
+    Args:
+        chunks (iterator(str)): consecutive pieces of the JSON array
+
+    Yields:
+        the items of the array, decoded
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            # skip whitespace and separators
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise Exception(f"Expected a JSON array, got: {buffer[:100]}")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # incomplete item: wait for the next chunk
+            if end == len(buffer):
+                # the item may be incomplete (for example a number): an
+                # item is always followed by "," or "]"
+                break
+            yield item
+            pos = end
+        buffer = buffer[pos:]
+    raise Exception(f"Incomplete JSON array. End of the data: {buffer[-100:]}")
+
+
+class AdaptiveBatchSize:
+    """
+    Size of the batches of records submitted to Sheepdog. It grows while
+    submissions are faster than the target latency, and is halved when they
+    are slower, time out or fail with a server error. Thread-safe, so it can
+    be shared by concurrent submissions.
+    """
+
+    def __init__(self, initial, maximum, target_latency):
+        self.value = initial
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.lock = threading.Lock()
+
+    def record_success(self, batch_size, latency):
+        with self.lock:
+            if latency > self.target_latency:
+                self.value = max(1, self.value // 2)
+            elif batch_size >= self.value:
+                # only grow after a full batch: a smaller (last) batch does
+                # not tell us anything about the current size
+                self.value = min(
+                    self.maximum, max(self.value + 1, int(self.value * 1.5))
+                )
+
+    def record_failure(self):
+        with self.lock:
+            self.value = max(1, self.value // 2)
+
+
+class BatchSubmission:
+    """
+    State of an ongoing Sheepdog submission: the batches in flight and the
+    progress counters. Batches are submitted by a pool of
+    `max_in_flight` threads.
+    """
+
+    def __init__(self, submit_batch, max_in_flight, on_success=None):
+        self.submit_batch = submit_batch
+        self.max_in_flight = max_in_flight
+        self.on_success = on_success
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.in_flight = {}  # { <future>: <node type> }
+        self.n_dispatched = 0
+        self.n_submitted = 0
+        self.n_skipped = 0
+        self.latencies = []
+        self.start = time.time()
+
+    def wait(self, node_types=None, return_when=ALL_COMPLETED):
+        """
+        Waits for the batches in flight (only the batches of `node_types` if
+        specified) and reports progress. Raises an error if a batch could
+        not be submitted.
+        """
+        futures = [
+            future
+            for future, node_type in self.in_flight.items()
+            if node_types is None or node_type in node_types
+        ]
+        if not futures:
+            return
+        done, _ = wait(futures, return_when=return_when)
+        for future in done:
+            del self.in_flight[future]
+            records, latency = future.result()  # raises if submission failed
+            if self.on_success:
+                self.on_success(records)
+            self.n_submitted += len(records)
+            self.latencies.append(latency)
+            print(
+                "Submission progress: {}/{} ({} {} records in {:.2f}s)".format(
+                    self.n_submitted,
+                    self.n_dispatched,
+                    len(records),
+                    records[0].get("type"),
+                    latency,
+                )
+            )
+
+    def dispatch(self, records, batch_size, wait_for_node_types=None):
+        """
+        Starts submitting a batch of records, once the batches of
+        `wait_for_node_types` in flight are submitted and there is room for
+        one more batch in flight.
+        """
+        self.wait(node_types=wait_for_node_types)
+        while len(self.in_flight) >= self.max_in_flight:
+            self.wait(return_when=FIRST_COMPLETED)
+
+        def _submit():
+            return records, self.submit_batch(records, batch_size)
+
+        self.n_dispatched += len(records)
+        self.in_flight[self.executor.submit(_submit)] = records[0].get("type")
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+        if self.n_skipped:
+            print(
+                "  Skipped {} records that did not change since the last submission".format(
+                    self.n_skipped
+                )
+            )
+        if self.latencies:
+            print(
+                "  Submitted {} records in {} batches in {:.2f}s (batch latency: avg {:.2f}s, max {:.2f}s)".format(
+                    self.n_submitted,
+                    len(self.latencies),
+                    time.time() - self.start,
+                    sum(self.latencies) / len(self.latencies),
+                    max(self.latencies),
+                )
+            )
+
 
 class MetadataHelper:
-    def __init__(self, base_url, program_name, project_code, access_token):
-        # Note: if we end up having too much data, Sheepdog submissions may
-        # time out. We'll have to use a smaller batch size and hope that's enough
+    def __init__(
+        self,
+        base_url,
+        program_name,
+        project_code,
+        access_token,
+        submit_max_in_flight=1,
+        skip_unchanged_records=False,
+        session=None,
+    ):
+        # Initial size of the batches submitted to Sheepdog. The size is then
+        # adapted for each node type: small records can be submitted in much
+        # bigger batches, while heavy records that make Sheepdog submissions
+        # time out are submitted in smaller batches
         self.submit_batch_size = 100
+        self.max_submit_batch_size = MAX_SUBMIT_BATCH_SIZE
+        self.submit_target_latency = SUBMIT_TARGET_LATENCY
+        self.submit_timeout = SUBMIT_TIMEOUT
+        self.submit_batch_sizes = {}  # { <node type>: AdaptiveBatchSize }
+        # number of batches submitted to Sheepdog at the same time. Batches
+        # of different node types are never in flight together, so parent
+        # records are always submitted before their children
+        self.submit_max_in_flight = submit_max_in_flight
+        # if True, records identical to the ones submitted by a previous run
+        # are not submitted again
+        self.skip_unchanged_records = skip_unchanged_records
+        self.record_hash_index = None
+        self.submitter_id_indexes = {}  # { <node type>: SubmitterIdIndex }
 
         self.base_url = base_url
         self.program_name = program_name
         self.project_code = project_code
 
         self.headers = {"Authorization": "bearer " + access_token}
+        # HTTP session shared with the ETL, so connections are reused
+        self.session = session or create_session()
         self.project_id = "{}-{}".format(self.program_name, self.project_code)
 
         self.records_to_submit = []
+        # streaming mode: { <node type>: [<record>, ...] } in submission order
+        self.streaming_buffers = None
+        self.submission = None  # BatchSubmission in progress
 
     def get_existing_data_jhu(self):
         """
         Queries Guppy for the existing `summary_location` and
-        `summary_clinical` data. Returns the list of all the existing
-        summary_location submitter_ids, and the latest submitted date
-        as a string:
+        `summary_clinical` data. Returns the index of all the existing
+        summary_location submitter_ids (see `get_submitter_id_index`), and
+        the latest submitted date as a string:
         (
-            [
+            SubmitterIdIndex({
                 "summary_location_submitter_id1",
                 "summary_location_submitter_id2",
                 ...
-            ],
+            }),
             "2020-11-02"
         )
         """
         _filter = {"=": {"project_id": self.project_id}}
 
-        print("Getting existing summary_location submitter_ids from Guppy...")
-        res = self.download_from_guppy("location", ["submitter_id"], _filter)
-        summary_locations = [r["submitter_id"] for r in res]
+        summary_locations = self.get_submitter_id_index("summary_location")
 
         print("Getting the latest summary_clinical date from Guppy...")
         query_string = """query ($filter: JSON) {
@@ -115,60 +350,278 @@ class MetadataHelper:
             print(f"INFO: no existing location data in Guppy for {self.project_id}")
         return None
 
+    def start_streaming(self, node_order):
+        """
+        Switches to streaming mode: instead of keeping all the records in
+        memory until `batch_submit_records` is called, the records are
+        submitted as soon as a batch is full, so memory usage is bounded by
+        the batch size rather than the dataset size. `batch_submit_records`
+        must still be called at the end to submit the remaining records.
+
+        Args:
+            node_order (list(str)): node types in the order they must be
+                submitted (parents before children). A batch is only
+                submitted after all the records of the previous node types
+                that were added before it are submitted. Node types that are
+                not listed are submitted after the listed ones.
+        """
+        self.streaming_buffers = {node_type: [] for node_type in node_order}
+
     def add_record_to_submit(self, record):
-        self.records_to_submit.append(record)
+        if self.streaming_buffers is None:
+            self.records_to_submit.append(record)
+            return
+
+        node_type = record.get("type")
+        if node_type not in self.streaming_buffers:
+            self.streaming_buffers[node_type] = []
+        buffer = self.streaming_buffers[node_type]
+        buffer.append(record)
+        if len(buffer) >= self.get_submit_batch_size(node_type).value:
+            self.flush_streaming_buffer(node_type)
 
     def add_records_to_submit(self, records):
-        self.records_to_submit.extend(records)
+        for record in records:
+            self.add_record_to_submit(record)
 
-    def batch_submit_records(self):
+    def flush_streaming_buffer(self, node_type):
         """
-        Submits Sheepdog records in batch
+        Submits the records of `node_type` buffered in streaming mode, after
+        the buffered records of the parent node types.
         """
-        if not self.records_to_submit:
-            print("  Nothing new to submit")
-            return
-        print(
-            "  Submitting {} records in batches of {}".format(
-                len(self.records_to_submit), self.submit_batch_size
+        node_order = list(self.streaming_buffers)
+        parent_types = node_order[: node_order.index(node_type)]
+        for parent_type in parent_types:
+            if self.streaming_buffers[parent_type]:
+                self.flush_streaming_buffer(parent_type)
+        records = self.streaming_buffers[node_type]
+        self.streaming_buffers[node_type] = []
+        self.submit_records(records, wait_for_node_types=parent_types)
+
+    def get_submission(self):
+        if not self.submission:
+            if self.skip_unchanged_records and not self.record_hash_index:
+                self.record_hash_index = RecordHashIndex(self.project_id)
+            self.submission = BatchSubmission(
+                self.submit_batch,
+                self.submit_max_in_flight,
+                on_success=self.on_batch_submitted,
             )
-        )
+        return self.submission
 
-        n_batches = ceil(len(self.records_to_submit) / self.submit_batch_size)
-        for i in range(n_batches):
-            records = self.records_to_submit[
-                i * self.submit_batch_size : (i + 1) * self.submit_batch_size
-            ]
+    def on_batch_submitted(self, records):
+        """
+        Updates the local indexes once a batch of records is submitted.
+        """
+        if self.record_hash_index:
+            self.record_hash_index.update(records)
+        index = self.submitter_id_indexes.get(records[0].get("type"))
+        if index is not None:
+            index.add(record["submitter_id"] for record in records)
+
+    def get_submitter_id_index(
+        self, node_type, max_age=SUBMITTER_ID_INDEX_MAX_AGE, path=None
+    ):
+        """
+        Returns the index of the submitter_ids of the existing records of
+        `node_type` in the project. The index is stored locally between
+        runs, and only downloaded from Guppy again if it is older than
+        `max_age` seconds. The records submitted by this helper are added
+        to the index.
+
+        Args:
+            node_type (str): one of the keys of `GUPPY_INDEX_TYPES`
+            max_age (int): maximum age (in seconds) of the local index
+            path (str): path to the local database (default: in the state
+                folder)
+
+        Returns:
+            SubmitterIdIndex: set-like object
+        """
+        if node_type in self.submitter_id_indexes:
+            return self.submitter_id_indexes[node_type]
+
+        index = SubmitterIdIndex(self.project_id, node_type, path=path)
+        if index.is_stale(max_age):
+            print(f"Getting existing {node_type} submitter_ids from Guppy...")
+            res = self.stream_from_guppy(
+                GUPPY_INDEX_TYPES[node_type],
+                ["submitter_id"],
+                {"=": {"project_id": self.project_id}},
+            )
+            index.refresh(r["submitter_id"] for r in res)
+        else:
+            print(
+                f"Using the local index of existing {node_type} submitter_ids ({len(index)} submitter_ids)"
+            )
+        self.submitter_id_indexes[node_type] = index
+        return index
+
+    def submit_records(self, records, wait_for_node_types=()):
+        """
+        Starts submitting records of a single node type, in batches. The
+        size of each batch depends on how fast the previous batches of the
+        same node type were submitted.
+
+        Args:
+            records (list(dict)): Sheepdog records of a single node type
+            wait_for_node_types (list(str)): only start submitting the
+                records once the batches of these node types in flight are
+                submitted
+        """
+        submission = self.get_submission()
+        if self.record_hash_index:
+            n_records = len(records)
+            records = self.record_hash_index.filter_changed(records)
+            submission.n_skipped += n_records - len(records)
+        if not records:
+            return
+
+        batch_size = self.get_submit_batch_size(records[0].get("type"))
+        i = 0
+        while i < len(records):
+            batch = records[i : i + batch_size.value]
+            i += len(batch)
+            submission.dispatch(batch, batch_size, wait_for_node_types)
 
-            tries = 0
-            while tries < MAX_RETRIES:
-                response = requests.put(
-                    "{}/api/v0/submission/{}/{}".format(
-                        self.base_url, self.program_name, self.project_code
-                    ),
+    def split_records_by_node_type(self, records):
+        """
+        Splits the records into consecutive groups of records of the same
+        node type.
+
+        Args:
+            records (list(dict)): Sheepdog records, in submission order
+
+        Returns:
+            list((str, list(dict))): (node type, records) tuples, in
+                submission order
+        """
+        groups = []
+        for record in records:
+            node_type = record.get("type")
+            if not groups or groups[-1][0] != node_type:
+                groups.append((node_type, []))
+            groups[-1][1].append(record)
+        return groups
+
+    def get_submit_batch_size(self, node_type):
+        if node_type not in self.submit_batch_sizes:
+            self.submit_batch_sizes[node_type] = AdaptiveBatchSize(
+                initial=self.submit_batch_size,
+                maximum=self.max_submit_batch_size,
+                target_latency=self.submit_target_latency,
+            )
+        return self.submit_batch_sizes[node_type]
+
+    def submit_batch(self, records, batch_size):
+        """
+        Submits a batch of records to Sheepdog, retrying on failure with
+        jittered exponential backoff. If the request times out or fails with
+        a server error, the batch size is reduced and the batch is split in
+        half before retrying.
+
+        Args:
+            records (list(dict)): Sheepdog records to submit
+            batch_size (AdaptiveBatchSize): batch size to update depending
+                on how the submission goes
+
+        Returns:
+            float: time (in seconds) taken by the successful request(s)
+        """
+        url = "{}/api/v0/submission/{}/{}".format(
+            self.base_url, self.program_name, self.project_code
+        )
+        tries = 0
+        while True:
+            start = time.time()
+            try:
+                response = self.session.put(
+                    url,
                     headers=self.headers,
                     data=json.dumps(records),
+                    timeout=self.submit_timeout,
                 )
-                if response.status_code != 200:
-                    tries += 1
-                    sleep(5)
-                else:
-                    print("Submission progress: {}/{}".format(i + 1, n_batches))
-                    break
-            if tries == MAX_RETRIES:
-                if "Entity is not unique" in response.text:
-                    print(f"Couldn't submit the following records:\n {records}")
-                raise Exception(
-                    "Unable to submit to Sheepdog: {}\n{}".format(
-                        response.status_code, response.text
+            except requests.exceptions.Timeout:
+                response = None
+            latency = time.time() - start
+
+            if response is not None and response.status_code == 200:
+                batch_size.record_success(len(records), latency)
+                return latency
+
+            if response is None or response.status_code >= 500:
+                batch_size.record_failure()
+                if len(records) > 1:
+                    print(
+                        "  {} while submitting {} records: splitting the batch".format(
+                            "Timeout" if response is None else response.status_code,
+                            len(records),
+                        )
                     )
+                    time.sleep(get_backoff_delay(tries))
+                    middle = len(records) // 2
+                    return self.submit_batch(
+                        records[:middle], batch_size
+                    ) + self.submit_batch(records[middle:], batch_size)
+
+            tries += 1
+            if tries == MAX_RETRIES:
+                break
+            time.sleep(get_backoff_delay(tries))
+
+        if response is None:
+            raise Exception(
+                "Unable to submit to Sheepdog: timed out after {}s".format(
+                    self.submit_timeout
                 )
+            )
+        if "Entity is not unique" in response.text:
+            print(f"Couldn't submit the following records:\n {records}")
+        raise Exception(
+            "Unable to submit to Sheepdog: {}\n{}".format(
+                response.status_code, response.text
+            )
+        )
 
-        self.records_to_submit = []
+    def batch_submit_records(self):
+        """
+        Submits Sheepdog records in batch. Up to `self.submit_max_in_flight`
+        batches are submitted concurrently; all the batches of a node type
+        must be submitted before the batches of the next node type are sent,
+        so the order in which the records were added is respected across
+        node types. In streaming mode, only the remaining buffered records
+        are submitted.
+
+        If `self.skip_unchanged_records` is True, records that are identical
+        to the ones submitted by a previous run are not submitted again.
+        """
+        if self.streaming_buffers is not None:
+            for node_type in list(self.streaming_buffers):
+                self.flush_streaming_buffer(node_type)
+        else:
+            if self.records_to_submit:
+                print(
+                    "  Submitting {} records ({} batches in flight)".format(
+                        len(self.records_to_submit), self.submit_max_in_flight
+                    )
+                )
+            for _, records in self.split_records_by_node_type(self.records_to_submit):
+                # node order barrier: wait until all the records of the
+                # previous node type are submitted
+                self.get_submission().wait()
+                self.submit_records(records)
+            self.records_to_submit = []
+
+        if not self.submission or not self.submission.n_dispatched:
+            print("  Nothing new to submit")
+        if self.submission:
+            submission = self.submission
+            self.submission = None
+            submission.close()
 
     def query_peregrine(self, query_string):
         url = f"{self.base_url}/api/v0/submission/graphql"
-        response = requests.post(
+        response = self.session.post(
             url,
             json={"query": query_string, "variables": None},
             headers=self.headers,
@@ -187,29 +640,29 @@ class MetadataHelper:
     async def async_query_peregrine(self, query_string):
         async def _post_request(headers, query_string):
             url = f"{self.base_url}/api/v0/submission/graphql"
-            async with ClientSession() as session:
-                async with session.post(
-                    url,
-                    json={"query": query_string, "variables": None},
-                    headers=headers,
-                ) as response:
-                    try:
-                        response.raise_for_status()
-                    except Exception:
-                        print(f"Unable to query Peregrine.\nQuery: {query_string}")
-                        raise
-                    try:
-                        response = await response.json()
-                    except Exception:
-                        print(f"Peregrine did not return JSON: {response.text}")
-                        raise
-                    return response
+            session = get_async_session()
+            async with session.post(
+                url,
+                json={"query": query_string, "variables": None},
+                headers=headers,
+            ) as response:
+                try:
+                    response.raise_for_status()
+                except Exception:
+                    print(f"Unable to query Peregrine.\nQuery: {query_string}")
+                    raise
+                try:
+                    response = await response.json()
+                except Exception:
+                    print(f"Peregrine did not return JSON: {response.text}")
+                    raise
+                return response
 
         return await _post_request(self.headers, query_string)
 
     def query_guppy(self, query_string, variables=None):
         url = f"{self.base_url}/guppy/graphql"
-        response = requests.post(
+        response = self.session.post(
             url,
             json={"query": query_string, "variables": variables},
             headers=self.headers,
@@ -228,28 +681,56 @@ class MetadataHelper:
             raise
 
     def download_from_guppy(self, _type, fields=None, filter=None):
+        return list(self.stream_from_guppy(_type, fields, filter))
+
+    def stream_from_guppy(self, _type, fields=None, filter=None, sort=None):
+        """
+        Downloads all the records of a Guppy index that match the filter.
+        Unlike GraphQL queries, the download endpoint is not limited to the
+        first 10000 records. The response is streamed and decoded
+        incrementally, so the records are yielded as they are received and
+        memory usage does not depend on the number of records.
+
+        Args:
+            _type (str): Guppy index type, such as "location"
+            fields (list(str)): fields to return (default: all)
+            filter (dict): Guppy filter
+            sort (list(dict)): Guppy sort, such as [{"date": "desc"}]
+
+        Yields:
+            dict: Guppy records
+        """
         body = {"type": _type, "accessibility": "accessible"}
         if fields:
             body["fields"] = fields
         if filter:
             body["filter"] = filter
+        if sort:
+            body["sort"] = sort
 
         url = f"{self.base_url}/guppy/download"
-        response = requests.post(
+        response = self.session.post(
             url,
             json=body,
             headers=self.headers,
+            stream=True,
         )
-        try:
-            response.raise_for_status()
-        except Exception:
-            print(f"Unable to download from Guppy.\nBody: {body}")
-            raise
-        try:
-            return response.json()
-        except Exception:
-            print(f"Guppy did not return JSON: {response.status_code} {response.text}")
-            raise
+        with response:
+            try:
+                response.raise_for_status()
+            except Exception:
+                print(f"Unable to download from Guppy.\nBody: {body}")
+                raise
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            chunks = (
+                decoder.decode(chunk)
+                for chunk in response.iter_content(chunk_size=GUPPY_STREAM_CHUNK_SIZE)
+            )
+            try:
+                yield from iter_json_array(chunks)
+            except Exception:
+                print(f"Guppy did not return a JSON array: {response.status_code}")
+                raise
 
     def get_last_submission(self):
         """Returns a datetime"""
@@ -278,7 +759,7 @@ class MetadataHelper:
             "last_submission_identifier": last_submission_date_time,
         }
         try:
-            res = requests.put(
+            res = self.session.put(
                 "{}/api/v0/submission/{}".format(self.base_url, self.program_name),
                 headers=headers,
                 data=json.dumps(record),
@@ -287,82 +768,97 @@ class MetadataHelper:
             print(f"Unable to update last_submission_identifier. Detail {ex}")
             raise
 
-    def delete_nodes(self, ordered_node_list):
-        # copy of Gen3Submission.delete_nodes
-        # TODO: once https://github.com/uc-cdis/gen3sdk-python/pull/72 is
-        # merged, just use the SDK (need this PR so we can use an
-        # access_token directly).
-        import itertools
-
-        batch_size = 200
-        verbose = True
+    def get_node_ids(self, node):
+        """
+        Returns the ids of all the records of a node type in the project,
+        paging through Peregrine `DELETE_PAGE_SIZE` ids at a time. The ids
+        are sorted so the pages are stable.
+        """
+        ids = []
+        while True:
+            query_string = f"""{{
+                {node} (
+                    first: {DELETE_PAGE_SIZE},
+                    offset: {len(ids)},
+                    order_by_asc: "id",
+                    project_id: "{self.project_id}"
+                ) {{
+                    id
+                }}
+            }}"""
+            res = self.query_peregrine(query_string)
+            page = [x["id"] for x in res["data"][node]]
+            ids.extend(page)
+            if len(page) < DELETE_PAGE_SIZE:
+                return ids
+
+    def delete_records(self, uuids):
+        api_url = "{}/api/v0/submission/{}/{}/entities".format(
+            self.base_url, self.program_name, self.project_code
+        )
+        response = self.session.delete(
+            "{}/{}".format(api_url, ",".join(uuids)),
+            headers=self.headers,
+        )
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            print("\n{}\nFailed to delete uuids: {}".format(response.text, uuids))
+            raise
+        return len(uuids)
+
+    def delete_nodes(
+        self,
+        ordered_node_list,
+        dry_run=False,
+        max_workers=DELETE_MAX_WORKERS,
+        batch_size=DELETE_BATCH_SIZE,
+    ):
+        """
+        Deletes all the records of the specified node types in the project.
+        The ids of each node type are listed once, then deleted in batches
+        of `batch_size` ids, `max_workers` batches at a time. Node types
+        are deleted one after the other, in the specified order (children
+        before parents).
+
+        Args:
+            ordered_node_list (list(str)): node types to delete
+            dry_run (bool): only count the records that would be deleted
+            max_workers (int): number of batches deleted at the same time
+            batch_size (int): number of ids deleted per request
+
+        Returns:
+            dict: { <node type>: <number of records (to be) deleted> }
+        """
+        counts = {}
         for node in ordered_node_list:
-            if verbose:
-                print(node, end="", flush=True)
-            first_uuid = ""
-            while True:
-                query_string = f"""{{
-                    {node} (first: {batch_size}, project_id: "{self.project_id}") {{
-                        id
-                    }}
-                }}"""
-                res = self.query_peregrine(query_string)
-                uuids = [x["id"] for x in res["data"][node]]
-                if len(uuids) == 0:
-                    break  # all done
-                if first_uuid == uuids[0]:
-                    raise Exception("Failed to delete. Exiting")
-                first_uuid = uuids[0]
-                if verbose:
-                    print(".", end="", flush=True)
-
-                    # copy of Gen3Submission.delete_records
-                    api_url = "{}/api/v0/submission/{}/{}/entities".format(
-                        self.base_url, self.program_name, self.project_code
-                    )
-                    for i in itertools.count():
-                        uuids_to_delete = uuids[batch_size * i : batch_size * (i + 1)]
-                        if len(uuids_to_delete) == 0:
-                            break
-                        output = requests.delete(
-                            "{}/{}".format(api_url, ",".join(uuids_to_delete)),
-                            headers=self.headers,
+            start = time.time()
+            uuids = self.get_node_ids(node)
+            counts[node] = len(uuids)
+            if dry_run:
+                print(f"{node}: {len(uuids)} records would be deleted")
+                continue
+            print(f"{node}: deleting {len(uuids)} records")
+
+            batches = [
+                uuids[i : i + batch_size] for i in range(0, len(uuids), batch_size)
+            ]
+            n_deleted = 0
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for n in executor.map(self.delete_records, batches):
+                    n_deleted += n
+                    duration = time.time() - start
+                    print(
+                        "  Deletion progress: {}/{} ({:.0f} records/s)".format(
+                            n_deleted, len(uuids), n_deleted / max(duration, 0.001)
                         )
-                        try:
-                            output.raise_for_status()
-                        except requests.exceptions.HTTPError:
-                            print(
-                                "\n{}\nFailed to delete uuids: {}".format(
-                                    output.text, uuids_to_delete
-                                )
-                            )
-                            raise
-
-            if verbose:
-                print()
-
-    def get_existing_summary_locations(self):
-        print("Getting current 'location' records from Guppy...")
-        query_string = """query ($filter: JSON) {
-            location (
-                filter: $filter,
-                first: 10000,
-                accessibility: accessible
-            ) {
-                submitter_id
-            }
-        }"""
-
-        variables = {"filter": {"=": {"project_id": self.project_id}}}
-        query_res = self.query_guppy(query_string, variables)
-
-        if "data" not in query_res or "location" not in query_res["data"]:
-            raise Exception(
-                f"Did not receive any data from Guppy. Query result for the query - {query_string} with variables - {variables} is \n\t {query_res}"
+                    )
+            print(
+                "  Deleted {} {} records in {:.2f}s".format(
+                    n_deleted, node, time.time() - start
+                )
             )
+        return counts
 
-        location_list = query_res["data"]["location"]
-        assert (
-            type(location_list) == list
-        ), f"Did not receive a list of locations from Guppy. Received: {query_res}"
-        return [location["submitter_id"] for location in location_list]
+    def get_existing_summary_locations(self):
+        return self.get_submitter_id_index("summary_location")
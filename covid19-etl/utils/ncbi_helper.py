@@ -0,0 +1,261 @@
+"""
+Helpers shared by the NCBI ETLs. NCBI_FILE splits the NCBI metadata files
+by accession number, and NCBI then needs the list of accession numbers in
+the same files: instead of streaming each file from S3 a second time, the
+accession numbers found by the splitter are saved to an accession manifest
+in the local state folder, identified by the ETag of the source file.
+The accession number to filename map of the SRA manifest is likewise
+stored in a local SQLite index, rebuilt only when the manifest changes.
+"""
+
+
+from botocore import UNSIGNED
+from botocore.config import Config
+import boto3
+import codecs
+from collections import OrderedDict
+import json
+import os
+import re
+import sqlite3
+import time
+
+from utils.local_state_helper import get_state_path
+
+
+ACCESSION_NUMBER_REGEX = re.compile(r"[SDE]RR\d+")
+
+# maximum number of shard files open at the same time
+MAX_OPEN_SHARDS = 256
+# write buffer size (in bytes) of each open shard file
+SHARD_BUFFER_SIZE = 64 * 1024
+# number of manifest rows inserted into the accession index at once
+ACCESSION_INDEX_BATCH_SIZE = 10000
+
+
+def get_accession_manifest_path(key):
+    return get_state_path("ncbi_accessions_{}.json".format(key.replace("/", "_")))
+
+
+def read_accession_manifest(bucket, key, etag):
+    """
+    Returns the accession numbers found in an S3 object, or None if there
+    is no manifest for the current version (ETag) of the object.
+    """
+    try:
+        with open(get_accession_manifest_path(key)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if manifest.get("bucket") != bucket or manifest.get("etag") != etag:
+        return None
+    return manifest["accession_numbers"]
+
+
+def write_accession_manifest(bucket, key, etag, accession_numbers):
+    """
+    Saves the accession numbers found in a version (ETag) of an S3 object.
+    """
+    manifest = {
+        "bucket": bucket,
+        "key": key,
+        "etag": etag,
+        "accession_numbers": sorted(accession_numbers),
+    }
+    # write to a temporary file first, so a concurrent reader never reads
+    # an incomplete manifest
+    path = get_accession_manifest_path(key)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class ShardWriter:
+    """
+    Splits rows into one file per key (for example per accession number).
+    Writes are buffered, and at most `max_open_files` files are kept open:
+    the least recently used file is closed when another one needs to be
+    opened, and reopened in append mode if more rows are written to it.
+    Memory usage does not depend on the number of rows or keys.
+
+    Args:
+        path_template (str): path of the file of each key, with a "{}"
+            placeholder for the key
+        header (str): first line of each file
+        max_open_files (int): maximum number of files open at the same time
+    """
+
+    def __init__(self, path_template, header=None, max_open_files=MAX_OPEN_SHARDS):
+        self.path_template = path_template
+        self.header = header
+        self.max_open_files = max_open_files
+        self.open_files = OrderedDict()  # { <key>: <file> } in LRU order
+        self.paths = {}  # { <key>: <path> } for all the keys written to
+
+    def write(self, key, row):
+        f = self.open_files.get(key)
+        if f is not None:
+            self.open_files.move_to_end(key)
+        else:
+            if len(self.open_files) >= self.max_open_files:
+                _, lru_file = self.open_files.popitem(last=False)
+                lru_file.close()
+            is_new = key not in self.paths
+            if is_new:
+                self.paths[key] = self.path_template.format(key)
+            # a file created by a previous run is overwritten
+            f = open(
+                self.paths[key], "w" if is_new else "a", buffering=SHARD_BUFFER_SIZE
+            )
+            if is_new and self.header:
+                f.write(self.header)
+            self.open_files[key] = f
+        f.write(row)
+
+    def close(self):
+        """
+        Closes all the files. Returns { <key>: <path> } for all the files
+        that were written.
+        """
+        for f in self.open_files.values():
+            f.close()
+        self.open_files = OrderedDict()
+        return self.paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AccessionFilenameIndex:
+    """
+    Read-only map { <accession number>: <filename> } of the SRA manifest,
+    stored in a local SQLite database instead of in memory. The database
+    is opened on first access, and rebuilt from the manifest in S3 only
+    if the ETag of the manifest changed since it was built, so creating
+    the map does not read anything from S3.
+
+    Args:
+        bucket (str): bucket of the manifest
+        key (str): key of the manifest
+        path (str): path of the database (default: in the local state
+            folder, named after the key)
+        s3_object (boto3 S3 Object): manifest object (default: an
+            unsigned `boto3` Object for `bucket` and `key`)
+    """
+
+    def __init__(self, bucket, key, path=None, s3_object=None):
+        self.bucket = bucket
+        self.key = key
+        self.path = path or get_state_path(
+            "ncbi_accession_filenames_{}.sqlite".format(key.replace("/", "_"))
+        )
+        self.s3_object = s3_object
+        self.connection = None
+
+    def get_s3_object(self):
+        if self.s3_object is None:
+            s3 = boto3.resource("s3", config=Config(signature_version=UNSIGNED))
+            self.s3_object = s3.Object(self.bucket, self.key)
+        return self.s3_object
+
+    def get_etag(self, connection):
+        try:
+            row = connection.execute(
+                "SELECT value FROM manifest WHERE key = 'etag'"
+            ).fetchone()
+        except sqlite3.OperationalError:  # the database is empty
+            return None
+        return row[0] if row else None
+
+    def open(self):
+        """
+        Opens the database, after rebuilding it if the manifest changed.
+        """
+        if self.connection is not None:
+            return self.connection
+        etag = self.get_s3_object().e_tag
+        connection = sqlite3.connect(self.path)
+        if self.get_etag(connection) != etag:
+            connection.close()
+            self.build(etag)
+            connection = sqlite3.connect(self.path)
+        self.connection = connection
+        return connection
+
+    def build(self, etag):
+        """
+        Builds the database from the manifest. The database is built in a
+        temporary file first, so an interrupted build does not leave an
+        incomplete index behind.
+        """
+        print(f"Building the accession number index of {self.bucket}/{self.key}")
+        start = time.time()
+        tmp_path = f"{self.path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = sqlite3.connect(tmp_path)
+        connection.execute("CREATE TABLE manifest (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute(
+            """CREATE TABLE accession_filename (
+                accession_number TEXT PRIMARY KEY,
+                filename TEXT
+            ) WITHOUT ROWID"""
+        )
+        line_stream = codecs.getreader("utf-8")
+        body = self.get_s3_object().get(IfMatch=etag)["Body"]
+        batch = []
+        for line in line_stream(body):
+            words = line.split("\t")
+            if len(words) < 6:
+                continue
+            match = ACCESSION_NUMBER_REGEX.search(words[5])
+            if match:
+                batch.append((match.group(), words[1]))
+            if len(batch) == ACCESSION_INDEX_BATCH_SIZE:
+                self._insert(connection, batch)
+                batch = []
+        self._insert(connection, batch)
+        connection.execute("INSERT INTO manifest VALUES ('etag', ?)", (etag,))
+        connection.commit()
+        connection.close()
+        os.replace(tmp_path, self.path)
+        print(f"  Built the index in {int(time.time() - start)} secs")
+
+    def _insert(self, connection, batch):
+        # the last row of an accession number wins, like in a dict
+        connection.executemany(
+            "INSERT OR REPLACE INTO accession_filename VALUES (?, ?)", batch
+        )
+
+    def get(self, accession_number, default=None):
+        row = (
+            self.open()
+            .execute(
+                "SELECT filename FROM accession_filename WHERE accession_number = ?",
+                (accession_number,),
+            )
+            .fetchone()
+        )
+        return row[0] if row else default
+
+    def __contains__(self, accession_number):
+        return self.get(accession_number) is not None
+
+    def __getitem__(self, accession_number):
+        filename = self.get(accession_number)
+        if filename is None:
+            raise KeyError(accession_number)
+        return filename
+
+    def __len__(self):
+        return (
+            self.open().execute("SELECT COUNT(*) FROM accession_filename").fetchone()[0]
+        )
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
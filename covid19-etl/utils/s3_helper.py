@@ -0,0 +1,175 @@
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+
+# number of objects uploaded to S3 at the same time
+S3_MAX_WORKERS = 16
+# the files are updated daily: browsers can cache them for an hour
+S3_CACHE_CONTROL = "public, max-age=3600"
+
+
+def get_md5(body):
+    return hashlib.md5(body).hexdigest()
+
+
+def compress(body, content_encoding):
+    """
+    Compresses `body` with the `content_encoding` algorithm (only "gzip"
+    is supported). The output only depends on the input (no timestamp in
+    the gzip header), so unchanged files can be detected by comparing the
+    MD5 of the compressed content.
+    """
+    if content_encoding == "gzip":
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    raise Exception(f"Unsupported content encoding '{content_encoding}'")
+
+
+def read_object(s3_client, s3_bucket, s3_path):
+    """
+    Returns the content of an object in S3, decompressed according to its
+    `ContentEncoding`.
+    """
+    res = s3_client.get_object(Bucket=s3_bucket, Key=s3_path)
+    body = res["Body"].read()
+    if res.get("ContentEncoding"):
+        if res["ContentEncoding"] == "gzip":
+            body = gzip.decompress(body)
+    return body
+
+
+class S3Publisher:
+    """
+    Uploads objects to S3 from memory, with a pool of `max_workers`
+    threads, instead of writing each object to a local file, uploading it
+    and deleting it.
+
+    If `skip_unchanged` is True, the MD5 of each object is compared to the
+    ETag of the object already in the bucket, and objects whose content did
+    not change are not uploaded again. This works because objects uploaded
+    with a single `put_object` call have their MD5 as ETag.
+
+    If `content_encoding` is set ("gzip"), objects are compressed before
+    they are uploaded, and their `Content-Encoding` is set so that
+    browsers decompress them transparently.
+
+    Call `wait()` to wait for all the uploads to finish; it raises the
+    first upload error, if any.
+
+    Args:
+        s3_client (boto3 S3 client): client to upload with. boto3 clients
+            are thread-safe
+        s3_bucket (str): bucket to upload to
+        max_workers (int): number of objects uploaded at the same time
+        skip_unchanged (bool): whether to skip unchanged objects
+        content_encoding (str): compression of the uploaded objects - one
+            of [None, "gzip"]
+        cache_control (str): `Cache-Control` header of the uploaded objects
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        s3_bucket,
+        max_workers=S3_MAX_WORKERS,
+        skip_unchanged=True,
+        content_encoding=None,
+        cache_control=S3_CACHE_CONTROL,
+    ):
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.skip_unchanged = skip_unchanged
+        self.content_encoding = content_encoding
+        self.cache_control = cache_control
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+        self.lock = threading.Lock()
+        self.n_uploaded = 0
+        self.n_skipped = 0
+        self.uploaded_bytes = 0
+        self.uncompressed_bytes = 0
+        self.start = time.time()
+
+    def get_etag(self, s3_path):
+        """
+        Returns the ETag of an object in the bucket, without quotes, or
+        None if the object does not exist.
+        """
+        try:
+            response = self.s3_client.head_object(Bucket=self.s3_bucket, Key=s3_path)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ["404", "NoSuchKey"]:
+                return None
+            raise
+        return response["ETag"].strip('"')
+
+    def _upload(self, s3_path, body, content_type):
+        uncompressed_size = len(body)
+        if self.content_encoding:
+            body = compress(body, self.content_encoding)
+        if self.skip_unchanged and self.get_etag(s3_path) == get_md5(body):
+            with self.lock:
+                self.n_skipped += 1
+            return
+        kwargs = {}
+        if self.content_encoding:
+            kwargs["ContentEncoding"] = self.content_encoding
+        if self.cache_control:
+            kwargs["CacheControl"] = self.cache_control
+        self.s3_client.put_object(
+            Bucket=self.s3_bucket,
+            Key=s3_path,
+            Body=body,
+            ContentType=content_type,
+            **kwargs,
+        )
+        with self.lock:
+            self.n_uploaded += 1
+            self.uploaded_bytes += len(body)
+            self.uncompressed_bytes += uncompressed_size
+
+    def publish(self, s3_path, body, content_type="application/octet-stream"):
+        """
+        Schedules the upload of an object.
+
+        Args:
+            s3_path (str): key of the object in the bucket
+            body (bytes): uncompressed content of the object
+            content_type (str): MIME type of the object
+        """
+        self.futures.append(
+            self.executor.submit(self._upload, s3_path, body, content_type)
+        )
+
+    def publish_json(self, s3_path, data):
+        """
+        Schedules the upload of JSON data. Whitespace is eliminated to make
+        the files smaller.
+        """
+        body = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        self.publish(s3_path, body, content_type="application/json")
+
+    def wait(self):
+        """
+        Waits for all the scheduled uploads to finish.
+        """
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.futures = []
+            self.executor.shutdown(wait=True)
+        print(
+            "  Uploaded {} objects ({} KB, {} KB uncompressed), skipped {} unchanged objects in {} secs".format(
+                self.n_uploaded,
+                self.uploaded_bytes // 1024,
+                self.uncompressed_bytes // 1024,
+                self.n_skipped,
+                int(time.time() - self.start),
+            )
+        )
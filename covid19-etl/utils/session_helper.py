@@ -0,0 +1,47 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# number of connections kept alive per host. Must be at least the number
+# of threads that use the session concurrently, or connections are
+# discarded and opened again
+HTTP_POOL_SIZE = 20
+HTTP_MAX_RETRIES = 3
+
+
+def create_session(pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES):
+    """
+    Returns a `requests.Session` that keeps connections alive and reuses
+    them across requests, instead of opening a new TCP+TLS connection for
+    each call to `requests.get/post/put`.
+
+    Connection errors are retried for all methods, since the request was
+    not sent. Server errors are only retried for idempotent methods; the
+    callers handle retries of other requests (for example, Sheepdog
+    submissions are retried with smaller batches).
+
+    Args:
+        pool_size (int): maximum number of connections kept alive per host
+        max_retries (int): maximum number of retries done by the adapter
+
+    Returns:
+        requests.Session
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=0,
+        status=max_retries,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["HEAD", "GET", "OPTIONS"],
+        backoff_factor=0.5,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
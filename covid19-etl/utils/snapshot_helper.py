@@ -0,0 +1,164 @@
+"""
+On-disk snapshots of the intermediate data of the ETLs that are split into
+fetch, transform and load stages (see `etl.base.StagedETL`). The raw files
+downloaded by the fetch stage and the records generated by the transform
+stage are stored in the local state folder, so a failed load can be retried
+without downloading and parsing the data again, and the transform stage can
+be run and benchmarked offline against the last fetched data.
+"""
+
+
+import json
+import os
+import shutil
+import time
+
+from utils.local_state_helper import get_state_path
+
+
+# snapshots older than this (in seconds) are discarded instead of being
+# used to retry a failed run: the source data may have changed since
+SNAPSHOT_MAX_AGE = 24 * 3600
+STAGES_FILENAME = "stages.json"
+
+
+class Snapshot:
+    """
+    Folder holding the raw files and the transformed records of one ETL.
+    The stages that completed are recorded in a `stages.json` file. Files
+    are written to a temporary path first, so an interrupted stage never
+    leaves incomplete data behind.
+
+    Args:
+        name (str): name of the snapshot, usually the ETL job name
+        path (str): folder of the snapshot (default: `snapshots/<name>` in
+            the local state folder)
+        max_age (int): time (in seconds) after which a snapshot is stale
+    """
+
+    def __init__(self, name, path=None, max_age=SNAPSHOT_MAX_AGE):
+        self.name = name
+        self.path = path or get_state_path(os.path.join("snapshots", name))
+        self.max_age = max_age
+        os.makedirs(self.path, exist_ok=True)
+
+    def get_path(self, filename):
+        return os.path.join(self.path, filename)
+
+    def get_stages(self):
+        try:
+            with open(self.get_path(STAGES_FILENAME)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get_stage_info(self, stage):
+        """
+        Returns the information saved when `stage` completed, or None if
+        it did not complete.
+        """
+        return self.get_stages().get(stage)
+
+    def is_done(self, stage):
+        return self.get_stage_info(stage) is not None
+
+    def mark_done(self, stage, **info):
+        stages = self.get_stages()
+        stages[stage] = dict(info, finished_at=time.time())
+        path = self.get_path(STAGES_FILENAME)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(stages, f)
+        os.replace(f"{path}.tmp", path)
+
+    def is_stale(self):
+        """
+        Returns True if the data was fetched more than `max_age` seconds ago.
+        """
+        fetch = self.get_stage_info("fetch")
+        return fetch is not None and time.time() - fetch["finished_at"] > self.max_age
+
+    def reset(self):
+        """
+        Deletes the content of the snapshot.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+    def write_file(self, filename, chunks):
+        """
+        Saves a raw file.
+
+        Args:
+            filename (str): name of the file in the snapshot
+            chunks (iterator(bytes)): content of the file
+        """
+        path = self.get_path(filename)
+        size = 0
+        with open(f"{path}.tmp", "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(f"{path}.tmp", path)
+        print(f"  Saved {filename} ({size // 1024} KB) to {self.path}")
+
+    def open_file(self, filename, mode="rb", **kwargs):
+        return open(self.get_path(filename), mode, **kwargs)
+
+    def get_records_path(self, node_type):
+        return self.get_path(f"records_{node_type}.jsonl")
+
+    def record_writer(self):
+        return RecordWriter(self)
+
+    def read_records(self, node_type):
+        """
+        Yields the transformed records of a node type, one at a time.
+        """
+        with open(self.get_records_path(node_type)) as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class RecordWriter:
+    """
+    Writes the records generated by the transform stage to one JSONL file
+    per node type. The files are only moved to their final path if all the
+    records were written:
+
+        with snapshot.record_writer() as writer:
+            writer.write({"type": "summary_location", ...})
+        print(writer.node_types)
+
+    Args:
+        snapshot (Snapshot): snapshot to write to
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.files = {}  # { <node type>: <file> }
+        self.node_types = []  # in the order they were first written
+        self.counts = {}
+
+    def write(self, record):
+        node_type = record["type"]
+        f = self.files.get(node_type)
+        if f is None:
+            path = self.snapshot.get_records_path(node_type)
+            f = self.files[node_type] = open(f"{path}.tmp", "w")
+            self.node_types.append(node_type)
+            self.counts[node_type] = 0
+        f.write(json.dumps(record, separators=(",", ":")))
+        f.write("\n")
+        self.counts[node_type] += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        for node_type, f in self.files.items():
+            f.close()
+            path = self.snapshot.get_records_path(node_type)
+            if exc_type is None:
+                os.replace(f"{path}.tmp", path)
+            else:
+                os.remove(f"{path}.tmp")